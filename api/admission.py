@@ -0,0 +1,202 @@
+"""
+Admission control for the expensive endpoints.
+
+Requests to recognition, detection and enrollment routes pass three checks
+before reaching the handler:
+
+1. Body size: rejected with 413 from Content-Length, or as soon as the
+   streamed body exceeds the limit.
+2. Per-client token bucket: a client (its remote address or, behind a
+   trusted proxy, the X-Session-Id / X-Client-Id / X-Forwarded-For headers
+   the proxy passes on) may send RATE_LIMIT_PER_MINUTE requests with
+   bursts of RATE_LIMIT_BURST; beyond that it gets 429.
+3. Global concurrency: at most MAX_CONCURRENT_REQUESTS run at once; a
+   request that can't start within QUEUE_TIMEOUT seconds gets 503.
+
+Shed requests get a JSON body with an `error` code and `retry_after`, plus a
+Retry-After header.
+"""
+
+import asyncio
+import json
+import ipaddress
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import metrics
+
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+MAX_ARCHIVE_BYTES = int(os.environ.get("MAX_ARCHIVE_BYTES", str(512 * 1024 * 1024)))
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE", "60"))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", "20"))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", str(2 * (os.cpu_count() or 1))))
+QUEUE_TIMEOUT = float(os.environ.get("QUEUE_TIMEOUT", "5"))
+# Peers whose client headers are believed, e.g. the Next.js server proxying browser
+# requests: comma-separated addresses or networks. TRUST_PROXY_HEADERS=true trusts
+# every peer, for servers only reachable through a proxy that sets the headers.
+TRUSTED_PROXIES = [ipaddress.ip_network(proxy.strip(), strict=False)
+                   for proxy in os.environ.get("TRUSTED_PROXIES", "").split(",") if proxy.strip()]
+TRUST_PROXY_HEADERS = os.environ.get("TRUST_PROXY_HEADERS", "false").lower() in ("1", "true", "yes")
+
+
+class TokenBucketLimiter:
+    """Token bucket per client key; the least recently seen clients are forgotten first."""
+
+    def __init__(self, rate_per_second: float, burst: int, max_clients: int = 10000):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> Tuple[bool, float]:
+        """Take one token for key. Returns (allowed, seconds until a token is available)."""
+        if self.rate <= 0:
+            return True, 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / self.rate
+
+
+def is_trusted_proxy(address: Optional[str]) -> bool:
+    if TRUST_PROXY_HEADERS:
+        return True
+    try:
+        ip = ipaddress.ip_address(address or "")
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_key(headers: Dict[str, str], remote_addr: Optional[str]) -> str:
+    """Identify the client by its address. Requests from a trusted proxy are identified
+    by the session/client id header or the forwarded address it passes on instead;
+    anyone else could set those headers to get a fresh bucket."""
+    if not is_trusted_proxy(remote_addr):
+        return f"ip:{remote_addr or 'unknown'}"
+    for header in ("x-session-id", "x-client-id"):
+        if headers.get(header):
+            return f"{header}:{headers[header][:128]}"
+    hops = [hop.strip() for hop in headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    # Each proxy appends the address it received the request from, so the nearest
+    # untrusted hop is the client
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop):
+            return f"ip:{hop}"
+    return f"ip:{hops[0] if hops else remote_addr or 'unknown'}"
+
+
+def shed_payload(error: str, message: str, retry_after: Optional[float] = None) -> Dict:
+    metrics.inc("face_api_requests_shed_total", "Requests rejected by admission control, by reason.", reason=error)
+    payload = {"success": False, "error": error, "message": message}
+    if retry_after is not None:
+        payload["retry_after"] = math.ceil(retry_after)
+    return payload
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying size, rate and concurrency limits to the given route limits.
+
+    limits maps a path to its maximum body size in bytes.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+        self.limiter = TokenBucketLimiter(RATE_LIMIT_PER_MINUTE / 60, RATE_LIMIT_BURST)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.limits or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self.limits[scope["path"]]
+        headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        try:
+            declared = int(headers.get("content-length", 0))
+        except ValueError:
+            declared = 0
+        if declared > max_bytes:
+            await self._reject(send, 413, shed_payload(
+                "payload_too_large", f"Request body exceeds {max_bytes} bytes"))
+            return
+
+        allowed, retry_after = self.limiter.acquire(client_key(headers, (scope.get("client") or [None])[0]))
+        if not allowed:
+            await self._reject(send, 429, shed_payload(
+                "rate_limited", "Too many requests from this client", retry_after), retry_after)
+            return
+
+        if self._semaphore is None:
+            # Created lazily so it binds to the server's event loop
+            self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            await self._reject(send, 503, shed_payload(
+                "overloaded", "Server is busy, please retry shortly", QUEUE_TIMEOUT), QUEUE_TIMEOUT)
+            return
+
+        received = 0
+        response_started = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes and not response_started:
+                    # Answer now and make the app see a disconnected client, so it stops reading
+                    rejected = True
+                    await self._reject(send, 413, shed_payload(
+                        "payload_too_large", f"Request body exceeds {max_bytes} bytes"))
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except Exception:
+            # The app failing to read a body we cut off is expected; the 413 is already sent
+            if not rejected:
+                raise
+        finally:
+            self._semaphore.release()
+
+    @staticmethod
+    async def _reject(send, status: int, payload: Dict, retry_after: Optional[float] = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        if retry_after is not None:
+            headers.append((b"retry-after", str(math.ceil(retry_after)).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+def route_limits(image_paths: Iterable[str], archive_paths: Iterable[str]) -> Dict[str, int]:
+    limits = {path: MAX_IMAGE_BYTES for path in image_paths}
+    limits.update({path: MAX_ARCHIVE_BYTES for path in archive_paths})
+    return limits
@@ -0,0 +1,330 @@
+"""
+Append-only attendance log.
+
+Every capture is appended as one JSON line to a per-day segment
+(``YYYY-MM-DD.jsonl``) under the attendance directory, so repeated captures
+of a session are all kept and concurrent writers (threads or uvicorn workers)
+never overwrite each other. Appends are made durable with group commit: one
+fsync covers every line written while the previous fsync was running.
+
+Segments of days before yesterday are compacted into sorted, gzip-compressed
+files (``YYYY-MM-DD.jsonl.gz``). An in-memory index by session and student,
+kept up to date by tailing the segments, answers lookups without touching disk.
+
+    python attendance_log.py compact
+    python attendance_log.py import-legacy
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+SEGMENT_SUFFIX = ".jsonl"
+COMPACTED_SUFFIX = ".jsonl.gz"
+# Compaction deletes the plain segment, so it leaves alone any segment written
+# to within this many seconds: another worker may still have it open
+COMPACT_MIN_IDLE = float(os.environ.get("ATTENDANCE_COMPACT_MIN_IDLE", "3600"))
+
+
+def _segment_day(path: str) -> str:
+    return os.path.basename(path).split(".", 1)[0]
+
+
+class AttendanceLog:
+    def __init__(self, directory: str, fsync: bool = True):
+        self.directory = directory
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+        # Open segment of the current day (only one is kept open)
+        self._day: Optional[str] = None
+        self._fd: Optional[int] = None
+        # Group commit state, all guarded by _cond
+        self._cond = threading.Condition()
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+        self._dirty: List[int] = []
+        # Segments closed while a sync was running; the syncer closes them
+        self._retired: List[int] = []
+
+        # In-memory index
+        self._index_lock = threading.Lock()
+        self._events: List[Dict] = []
+        self._event_ids = set()
+        self._by_session: Dict[str, List[int]] = {}
+        self._by_student: Dict[str, List[int]] = {}
+        self._offsets: Dict[str, int] = {}
+
+    # Writing
+
+    def append(self, event: Dict) -> Dict:
+        """Append one capture event and return it once it is durable."""
+        event = dict(event)
+        event.setdefault("event_id", uuid.uuid4().hex)
+        event.setdefault("recorded_at", datetime.now().isoformat())
+        line = (json.dumps(event, separators=(",", ":")) + "\n").encode("utf-8")
+
+        with self._cond:
+            fd = self._segment_fd(event["recorded_at"][:10])
+            # O_APPEND makes each single write atomic with respect to other processes
+            os.write(fd, line)
+            self._written += 1
+            sequence = self._written
+            if fd not in self._dirty:
+                self._dirty.append(fd)
+        if self.fsync:
+            self._sync(sequence)
+        return event
+
+    def _segment_fd(self, day: str) -> int:
+        if day != self._day:
+            if self._fd is not None:
+                self._retire(self._fd)
+            path = os.path.join(self.directory, day + SEGMENT_SUFFIX)
+            self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._day = day
+        return self._fd
+
+    def _retire(self, fd: int) -> None:
+        """Flush and close a segment that is no longer appended to. Called with _cond held."""
+        if fd in self._dirty:
+            self._dirty.remove(fd)
+            if self.fsync:
+                os.fsync(fd)
+        if self._syncing:
+            # The running sync may still fsync this fd outside the lock; closing it
+            # now could make that fsync fail or hit a file reopened under the same number
+            self._retired.append(fd)
+        else:
+            os.close(fd)
+
+    def _sync(self, sequence: int) -> None:
+        with self._cond:
+            while self._synced < sequence:
+                if self._syncing:
+                    # Another writer is syncing; our line is covered by the next round at the latest
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                target, fds, self._dirty = self._written, self._dirty, []
+                self._cond.release()
+                try:
+                    for fd in fds:
+                        os.fsync(fd)
+                finally:
+                    self._cond.acquire()
+                    self._syncing = False
+                    self._synced = max(self._synced, target)
+                    for fd in self._retired:
+                        os.close(fd)
+                    self._retired = []
+                    self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            while self._syncing:
+                self._cond.wait()
+            if self._fd is not None:
+                self._retire(self._fd)
+                self._fd = None
+                self._day = None
+                self._dirty = []
+
+    # Reading
+
+    def segments(self, start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+        """Segment paths in day order, optionally limited to days in [start, end] (YYYY-MM-DD)."""
+        paths = {}
+        for path in glob.glob(os.path.join(self.directory, "*" + SEGMENT_SUFFIX)) + \
+                glob.glob(os.path.join(self.directory, "*" + COMPACTED_SUFFIX)):
+            day = _segment_day(path)
+            if (start and day < start) or (end and day > end):
+                continue
+            # A day being compacted may briefly exist in both forms; both hold the same events
+            paths.setdefault(day, []).append(path)
+        return [path for day in sorted(paths) for path in sorted(paths[day])]
+
+    def scan(self, start: Optional[str] = None, end: Optional[str] = None) -> Iterator[Dict]:
+        """Stream every event recorded between start and end (inclusive days)."""
+        seen = set()
+        for path in self.segments(start, end):
+            for event, _ in self._read_segment(path):
+                if event["event_id"] not in seen:
+                    seen.add(event["event_id"])
+                    yield event
+
+    def _read_segment(self, path: str, offset: int = 0) -> Iterator[Tuple[Dict, int]]:
+        """Yield (event, line length in bytes) for complete lines from offset on."""
+        opener = gzip.open if path.endswith(COMPACTED_SUFFIX) else open
+        try:
+            with opener(path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    # A partial line is still being written; it is picked up next time
+                    if not line.endswith(b"\n"):
+                        break
+                    yield json.loads(line), len(line)
+        except FileNotFoundError:
+            # Compacted away between listing and opening
+            return
+
+    def refresh(self) -> None:
+        """Index events appended since the last refresh, by this or any other process."""
+        with self._index_lock:
+            for path in self.segments():
+                if path.endswith(COMPACTED_SUFFIX):
+                    if path in self._offsets:
+                        continue
+                    offset = 0
+                else:
+                    offset = self._offsets.get(path, 0)
+                    try:
+                        if os.path.getsize(path) <= offset:
+                            continue
+                    except FileNotFoundError:
+                        continue
+
+                for event, length in self._read_segment(path, offset):
+                    offset += length
+                    self._index(event)
+                self._offsets[path] = offset
+
+    def _index(self, event: Dict) -> None:
+        if event["event_id"] in self._event_ids:
+            return
+        self._event_ids.add(event["event_id"])
+        position = len(self._events)
+        self._events.append(event)
+        self._by_session.setdefault(event.get("session_id"), []).append(position)
+        for student_id in event.get("recognized_students", []):
+            self._by_student.setdefault(student_id, []).append(position)
+
+    def session_events(self, session_id: str) -> List[Dict]:
+        """All captures of a session, oldest first."""
+        self.refresh()
+        events = [self._events[i] for i in self._by_session.get(session_id, [])]
+        return sorted(events, key=lambda e: e["recorded_at"])
+
+    def student_events(self, student_id: str, start: Optional[str] = None, end: Optional[str] = None) -> List[Dict]:
+        """Captures in which a student was recognized, optionally limited to days in [start, end]."""
+        self.refresh()
+        events = []
+        for i in self._by_student.get(student_id, []):
+            day = self._events[i]["recorded_at"][:10]
+            if (start and day < start) or (end and day > end):
+                continue
+            events.append(self._events[i])
+        return sorted(events, key=lambda e: e["recorded_at"])
+
+    # Maintenance
+
+    def compact(self, before: Optional[str] = None, min_idle: float = COMPACT_MIN_IDLE) -> List[str]:
+        """Rewrite segments of days before `before` (default: yesterday) sorted by session and gzip them.
+
+        Yesterday is never compacted by default, and neither is any segment
+        modified in the last `min_idle` seconds: a worker that has not rolled
+        over to the new day yet would keep appending to the deleted file.
+        """
+        before = before or (date.today() - timedelta(days=1)).isoformat()
+        lock_file = None
+        if fcntl is not None:
+            lock_file = open(os.path.join(self.directory, ".compact.lock"), "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Another worker is already compacting
+                lock_file.close()
+                return []
+
+        compacted = []
+        try:
+            for path in glob.glob(os.path.join(self.directory, "*" + SEGMENT_SUFFIX)):
+                day = _segment_day(path)
+                if day >= before:
+                    continue
+                try:
+                    if time.time() - os.path.getmtime(path) < min_idle:
+                        continue
+                except FileNotFoundError:
+                    continue
+                events = list(self.scan(day, day))
+                events.sort(key=lambda e: (str(e.get("session_id")), e["recorded_at"]))
+                target = os.path.join(self.directory, day + COMPACTED_SUFFIX)
+                tmp_path = target + ".tmp"
+                with open(tmp_path, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                    for event in events:
+                        f.write((json.dumps(event, separators=(",", ":")) + "\n").encode("utf-8"))
+                with open(tmp_path, "rb+") as raw:
+                    os.fsync(raw.fileno())
+                os.replace(tmp_path, target)
+                os.remove(path)
+                compacted.append(day)
+                print(f"Compacted attendance segment {day} ({len(events)} events)")
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+        return compacted
+
+    def import_legacy(self) -> int:
+        """Append old per-session <session_id>.json files to the log and rename them to .json.migrated."""
+        imported = 0
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.json"))):
+            try:
+                with open(path) as f:
+                    record = json.load(f)
+                session_id = os.path.splitext(os.path.basename(path))[0]
+                record.setdefault("session_id", session_id)
+                record.setdefault("recorded_at", record.get("timestamp") or
+                                  datetime.fromtimestamp(os.path.getmtime(path)).isoformat())
+                self.append(record)
+                os.replace(path, path + ".migrated")
+                imported += 1
+            except Exception as e:
+                print(f"Error importing {path}: {e}")
+        return imported
+
+
+def run_compaction(log: AttendanceLog, interval: float, stop: threading.Event) -> None:
+    """Compact closed days every `interval` seconds until stop is set."""
+    while not stop.wait(interval):
+        try:
+            log.compact()
+        except Exception as e:
+            print(f"Error compacting attendance log: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the append-only attendance log.")
+    parser.add_argument("command", choices=["compact", "import-legacy"],
+                        help="compact: gzip segments of days before yesterday; import-legacy: import old <session>.json files")
+    parser.add_argument("--attendance-dir",
+                        default=os.path.join(os.environ.get("DATA_DIR", "/app/data"), "attendance"),
+                        help="Attendance directory (default: $DATA_DIR/attendance)")
+    args = parser.parse_args()
+
+    log = AttendanceLog(args.attendance_dir)
+    start = time.perf_counter()
+    if args.command == "compact":
+        days = log.compact()
+        print(f"Compacted {len(days)} segment(s) in {time.perf_counter() - start:.1f}s")
+    else:
+        imported = log.import_legacy()
+        print(f"Imported {imported} legacy attendance file(s)")
+    log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# recognition, metrics and the other modules shared by both servers live in
+# the repository's top-level common/ directory
+COMMON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common")
+if COMMON_DIR not in sys.path:
+    sys.path.insert(0, COMMON_DIR)
+
+import face_quality
+import gallery
+import recognition
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+ROSTER_FIELDS = ["id", "first_name", "last_name", "email", "phone", "batch", "semester", "department"]
+
+
+def read_roster(roster_path: str) -> List[Dict[str, str]]:
+    """Read the CSV roster. Requires at least id, first_name and last_name columns."""
+    with open(roster_path, "r", newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        missing = {"id", "first_name", "last_name"} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"Roster is missing required columns: {', '.join(sorted(missing))}")
+        return [
+            {key: (value or "").strip() for key, value in row.items() if key}
+            for row in reader
+            if (row.get("id") or "").strip()
+        ]
+
+
+def index_images(image_dir: str) -> Dict[str, str]:
+    """Map both file names and file stems (student ids) to image paths."""
+    index = {}
+    for root, _, files in os.walk(image_dir):
+        for file_name in files:
+            stem, ext = os.path.splitext(file_name)
+            if ext.lower() not in IMAGE_EXTENSIONS:
+                continue
+            path = os.path.join(root, file_name)
+            index.setdefault(file_name, path)
+            index.setdefault(stem, path)
+    return index
+
+
+def prepare_source(source: str) -> Tuple[str, Optional[str]]:
+    """Return a directory of images for source, extracting it first if it is a ZIP.
+
+    The second element is a temporary directory the caller must remove, or None.
+    """
+    if os.path.isdir(source):
+        return source, None
+    if zipfile.is_zipfile(source):
+        temp_dir = tempfile.mkdtemp(prefix="bulk_enroll_")
+        with zipfile.ZipFile(source) as archive:
+            archive.extractall(temp_dir)
+        return temp_dir, temp_dir
+    raise ValueError(f"{source} is neither a directory nor a ZIP archive")
+
+
+def encode_image(image_path: str, check_quality: bool = True):
+    """Detect and encode the single face in an enrollment image (runs in a worker process)."""
+    image = cv2.imread(image_path)
+    if image is None:
+        return None, "Could not load image"
+
+    gray = recognition.to_gray(image)
+    boxes = recognition.detect(gray)
+    if not boxes:
+        return None, "No face detected in the image"
+    if len(boxes) > 1:
+        return None, "Multiple faces detected. Please use an image with only one face"
+
+    if check_quality:
+        quality = face_quality.assess_face(gray, boxes[0], face_quality.ENROLLMENT)
+        if not quality["ok"]:
+            return None, f"Image quality too low: {face_quality.describe(quality['reasons'])}"
+
+    return recognition.encode(gray, boxes)[0], None
+
+
+def bounded_map(executor, fn, items, max_in_flight) -> Iterator[Tuple[object, object, Optional[Exception]]]:
+    """Run fn(item[1]) for each (key, argument) item, yielding (item, result, error) as work
+    completes and keeping at most max_in_flight tasks queued."""
+    items = iter(items)
+    pending = {}
+    while True:
+        while len(pending) < max_in_flight:
+            try:
+                item = next(items)
+            except StopIteration:
+                break
+            pending[executor.submit(fn, item[1])] = item
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            item = pending.pop(future)
+            error = future.exception()
+            yield item, None if error else future.result(), error
+
+
+def write_student(faces_dir: str, student: Dict[str, str], image_path: str, face_encoding,
+                  version: str = gallery.DEFAULT_VERSION) -> None:
+    """Write one student's metadata, encoding and face image in the layout load_known_faces expects."""
+    student_dir = os.path.join(faces_dir, student["id"])
+    os.makedirs(student_dir, exist_ok=True)
+
+    metadata = {field: student.get(field) or None for field in ROSTER_FIELDS}
+    metadata["registration_date"] = datetime.now().isoformat()
+    with open(os.path.join(student_dir, "metadata.json"), "w") as f:
+        json.dump(metadata, f)
+
+    np.save(os.path.join(student_dir, gallery.encoding_filename(version)), face_encoding)
+    shutil.copyfile(image_path, os.path.join(student_dir, "face.jpg"))
+
+
+def bulk_enroll(source: str, roster_path: str, faces_dir: str, workers: Optional[int] = None,
+                progress: Optional[Callable[[int, int, str, Optional[str]], None]] = None) -> Dict:
+    """Enroll every student in the roster from a ZIP or directory of images.
+
+    Images are encoded across a process pool. Callers should rebuild the
+    in-memory gallery once after this returns rather than per student.
+    """
+    roster = read_roster(roster_path)
+    image_dir, temp_dir = prepare_source(source)
+    workers = workers or os.cpu_count() or 1
+    version = gallery.get_active_version(faces_dir)
+
+    enrolled = []
+    failed = []
+    try:
+        images = index_images(image_dir)
+        total = len(roster)
+        done = 0
+        work = []
+        for student in roster:
+            image_path = images.get(student.get("image") or "") or images.get(student["id"])
+            if image_path is not None:
+                work.append((student, image_path))
+                continue
+            failed.append({"id": student["id"], "message": "No image found for student"})
+            done += 1
+            if progress:
+                progress(done, total, student["id"], "No image found for student")
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for (student, image_path), result, error in bounded_map(executor, encode_image, work, workers * 4):
+                if error is None:
+                    face_encoding, message = result
+                else:
+                    face_encoding, message = None, str(error)
+
+                if face_encoding is not None:
+                    try:
+                        write_student(faces_dir, student, image_path, face_encoding, version)
+                        enrolled.append(student["id"])
+                    except Exception as e:
+                        message = f"Error saving student: {str(e)}"
+                if message:
+                    failed.append({"id": student["id"], "message": message})
+
+                done += 1
+                if progress:
+                    progress(done, total, student["id"], message)
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return {"total": len(roster), "enrolled": enrolled, "failed": failed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk enroll students from a photo archive and CSV roster.")
+    parser.add_argument("source", help="ZIP archive or directory of student images")
+    parser.add_argument("roster", help="CSV roster with id, first_name, last_name and optional image columns")
+    parser.add_argument("--faces-dir", default=os.path.join(os.environ.get("DATA_DIR", "/app/data"), "faces"),
+                        help="Gallery directory (default: $DATA_DIR/faces)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    args = parser.parse_args()
+
+    def report(done, total, student_id, message):
+        status = message or "ok"
+        print(f"[{done}/{total}] {student_id}: {status}")
+
+    os.makedirs(args.faces_dir, exist_ok=True)
+    summary = bulk_enroll(args.source, args.roster, args.faces_dir, args.workers, report)
+    print(f"Enrolled {len(summary['enrolled'])} of {summary['total']} students, {len(summary['failed'])} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import json
+import os
+from typing import Optional
+
+# Version of the encodings written by the original registration flow
+DEFAULT_VERSION = "v1"
+
+
+def pointer_path(faces_dir: str) -> str:
+    """Path of the file naming the active gallery version."""
+    return os.path.join(faces_dir, "gallery.json")
+
+
+def encoding_filename(version: str) -> str:
+    """Per-student encoding file name for a gallery version."""
+    if version == DEFAULT_VERSION:
+        return "encoding.npy"
+    return f"encoding-{version}.npy"
+
+
+def get_active_version(faces_dir: str) -> str:
+    """Return the gallery version currently being served."""
+    try:
+        with open(pointer_path(faces_dir), "r") as f:
+            return json.load(f).get("version", DEFAULT_VERSION)
+    except (OSError, ValueError):
+        return DEFAULT_VERSION
+
+
+def set_active_version(faces_dir: str, version: str, previous: Optional[str] = None) -> None:
+    """Atomically switch the served gallery to version."""
+    path = pointer_path(faces_dir)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"version": version, "previous": previous}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def active_encoding_path(student_dir: str, version: str) -> str:
+    """Encoding file to load for a student, falling back to the original encoding
+    for students enrolled while a new version was still being built."""
+    path = os.path.join(student_dir, encoding_filename(version))
+    if version != DEFAULT_VERSION and not os.path.exists(path):
+        return os.path.join(student_dir, encoding_filename(DEFAULT_VERSION))
+    return path
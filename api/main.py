@@ -2,62 +2,132 @@ import base64
 import io
 import json
 import os
+import shutil
+import sys
+import tempfile
+import threading
 import time
+import uuid
 from datetime import datetime
-from typing import Dict, List, Optional, Union
-
-import cv2
-# import face_recognition
-import face_recognition as custom_fr  # Use our custom module
-import numpy as np
-from fastapi import BackgroundTasks, FastAPI, File, Form, HTTPException, UploadFile
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional
+
+# recognition, metrics and the other modules shared by both servers live in
+# the repository's top-level common/ directory
+COMMON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common")
+if COMMON_DIR not in sys.path:
+    sys.path.insert(0, COMMON_DIR)
+
+# cv2, numpy, PIL and the recognition engine are imported inside the
+# functions that need them so the server can start accepting requests (health,
+# readiness) before they are loaded; warm_up() loads them in the background
+import admission
+import face_quality
+import gallery
+from attendance_log import AttendanceLog, run_compaction
+import metrics
+import response_format
+import slow_requests
+from result_cache import ResultCache, make_key
+from fastapi import BackgroundTasks, FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from PIL import Image
+from starlette.concurrency import run_in_threadpool
+
+if TYPE_CHECKING:
+    from shared_gallery import SharedGallery
 
 # Initialize the FastAPI app
 app = FastAPI(title="Face Recognition API")
 
+# Size, per-client rate and concurrency limits on the expensive routes. Added
+# before CORS so that shed responses still carry CORS headers.
+app.add_middleware(
+    admission.AdmissionMiddleware,
+    limits=admission.route_limits(
+        image_paths=["/recognize-faces", "/api/take-attendance", "/detect-faces", "/api/detect-faces",
+                     "/register-face", "/api/register-student"],
+        archive_paths=["/bulk-register"],
+    ),
+)
+
+# Set CORS_ORIGINS (comma-separated) to restrict which sites may call the API
+CORS_ORIGINS = [origin.strip() for origin in os.environ.get("CORS_ORIGINS", "").split(",") if origin.strip()]
+
 # Add CORS middleware to allow frontend to call the API
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
+    allow_origins=CORS_ORIGINS or [
         "http://localhost:3000",
         "https://amsfacerecognition.vercel.app",
         "https://amsfacerecognition-p39wazpsi-yash-vermas-projects-400e0953.vercel.app",
         "https://bpit-attendance-system.vercel.app",
-        "*"  # Allow all origins during testing
     ],  # Add your Vercel domains
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After"],
 )
 
+# Attach per-stage timings to every response as a Server-Timing header
+SERVER_TIMING_ENABLED = os.environ.get("SERVER_TIMING", "true").lower() in ("1", "true", "yes")
+
 # Data directories
-DATA_DIR = os.path.join("/app", "data")
+DATA_DIR = os.environ.get("DATA_DIR", os.path.join("/app", "data"))
 FACES_DIR = os.path.join(DATA_DIR, "faces")
 ATTENDANCE_DIR = os.path.join(DATA_DIR, "attendance")
 
+# Slow recognition requests, saved for replay when SLOW_REQUEST_CAPTURE is enabled
+SLOW_REQUEST_PATHS = ("/recognize-faces", "/api/take-attendance")
+slow_request_buffer = slow_requests.CaptureBuffer(
+    os.environ.get("SLOW_REQUEST_DIR", os.path.join(DATA_DIR, "slow_requests")))
+
 # Ensure directories exist
 os.makedirs(FACES_DIR, exist_ok=True)
 os.makedirs(ATTENDANCE_DIR, exist_ok=True)
 
-# In-memory cache for known face encodings
-known_face_encodings = []
-known_face_names = []
+# Every capture is appended to a per-day log; closed days are compacted periodically
+ATTENDANCE_FSYNC = os.environ.get("ATTENDANCE_FSYNC", "true").lower() in ("1", "true", "yes")
+attendance_log = AttendanceLog(ATTENDANCE_DIR, fsync=ATTENDANCE_FSYNC)
+ATTENDANCE_COMPACT_INTERVAL = float(os.environ.get("ATTENDANCE_COMPACT_INTERVAL", "3600"))
+compaction_stop = threading.Event()
+
+# In-memory gallery (a recognition.Gallery once loaded)
+face_gallery = None
 last_encodings_load_time = 0
+# Bumped whenever the in-memory gallery is replaced; part of every result cache key
+gallery_generation = 0
 ENCODINGS_CACHE_TTL = 300  # 5 minutes
 
+# With several uvicorn workers, share one gallery through shared memory instead
+# of each worker loading its own copy (POSIX only)
+SHARED_GALLERY_ENABLED = os.environ.get("SHARED_GALLERY", "false").lower() in ("1", "true", "yes")
+SHARED_GALLERY_NAME = os.environ.get("SHARED_GALLERY_NAME", "face_gallery")
+shared_gallery: Optional["SharedGallery"] = None
+
+# Set by warm_up() once models, the gallery and a first inference are loaded
+readiness = {"ready": False, "started_at": time.time(), "warmup_seconds": None, "error": None}
+
+# Progress of bulk enrollment jobs, keyed by job id
+bulk_jobs: Dict[str, Dict] = {}
+
+# Recognition results of recently submitted images, so retries skip the pipeline
+result_cache = ResultCache("recognition")
+
 
 # Models for API request/response
 class FaceDetectionRequest(BaseModel):
     image: str  # Base64 encoded image
+    # Encodings have 22,500 values per face, so they are only sent when asked for
+    include_encodings: bool = False
+    # "json": list of floats; "float32": base64 of little-endian float32 (raw bytes in msgpack)
+    encoding_format: Literal["json", "float32"] = "json"
 
 class FaceDetectionResponse(BaseModel):
     success: bool
-    faces: List[Dict[str, Union[str, float, List[float]]]]
+    faces: List[Dict[str, Any]]
     message: Optional[str] = None
+    encoding_format: Optional[str] = None
 
 class StudentData(BaseModel):
     id: str
@@ -78,18 +148,55 @@ class AttendanceSessionRequest(BaseModel):
     image: str  # Base64 encoded image
 
 
-def load_known_faces():
+def load_known_faces(force: bool = False):
     """Load all known face encodings from disk."""
-    global known_face_encodings, known_face_names, last_encodings_load_time
+    global face_gallery, last_encodings_load_time, gallery_generation
+    import numpy as np
+    import recognition
+    
+    if shared_gallery is not None:
+        # The publisher worker reloads from disk; everyone else just maps the latest generation
+        if force:
+            shared_gallery.request_reload()
+            result_cache.clear()
+        matrix, names = shared_gallery.snapshot()
+        # Only the generation actually attached counts, so a failed attach is retried next call
+        if face_gallery is None or gallery_generation != shared_gallery.attached_generation:
+            # Wraps the shared rows (already normalized by the publisher) without copying
+            face_gallery = recognition.Gallery.from_normalized(matrix, [n["id"] for n in names], names)
+            gallery_generation = shared_gallery.attached_generation
+        metrics.set_gauge("face_api_gallery_size", "Number of encodings in the in-memory gallery.", len(face_gallery))
+        return
     
     # Only reload if cache is expired
     current_time = time.time()
-    if current_time - last_encodings_load_time < ENCODINGS_CACHE_TTL and known_face_encodings:
+    if not force and current_time - last_encodings_load_time < ENCODINGS_CACHE_TTL and face_gallery:
+        metrics.cache_hit("gallery")
         return
+    metrics.cache_miss("gallery")
     
-    print("Loading known face encodings...")
-    known_face_encodings = []
-    known_face_names = []
+    with metrics.timer("gallery_load"):
+        encodings, names = read_gallery_from_disk()
+        # Swap in the new gallery at once so requests never see a partial one
+        face_gallery = recognition.Gallery.from_normalized(
+            np.asarray(encodings, dtype=np.float32), [n["id"] for n in names], names)
+    
+    last_encodings_load_time = current_time
+    gallery_generation += 1
+    result_cache.clear()
+    metrics.set_gauge("face_api_gallery_size", "Number of encodings in the in-memory gallery.", len(face_gallery))
+    print(f"Loaded {len(face_gallery)} face encodings")
+
+
+def read_gallery_from_disk():
+    """Read the active gallery version from disk as (normalized encodings, names)."""
+    import numpy as np
+    import recognition
+    
+    version = gallery.get_active_version(FACES_DIR)
+    print(f"Loading known face encodings (gallery {version})...")
+    encodings = []
+    names = []
     
     # Load student data and face encodings
     for student_id in os.listdir(FACES_DIR):
@@ -107,15 +214,15 @@ def load_known_faces():
                 student_data = json.load(f)
             
             # Load face encoding
-            encoding_path = os.path.join(student_dir, "encoding.npy")
+            encoding_path = gallery.active_encoding_path(student_dir, version)
             if not os.path.exists(encoding_path):
                 continue
                 
-            face_encoding = np.load(encoding_path)
+            face_encoding = recognition.normalize(np.load(encoding_path))[0]
             
             # Add to known faces
-            known_face_encodings.append(face_encoding)
-            known_face_names.append({
+            encodings.append(face_encoding)
+            names.append({
                 "id": student_id,
                 "name": f"{student_data.get('first_name', '')} {student_data.get('last_name', '')}",
                 "metadata": student_data
@@ -124,21 +231,142 @@ def load_known_faces():
         except Exception as e:
             print(f"Error loading face data for {student_id}: {e}")
     
-    last_encodings_load_time = current_time
-    print(f"Loaded {len(known_face_encodings)} face encodings")
+    return encodings, names
+
+
+def match_faces(face_locations, query) -> List[Dict]:
+    """Match detected faces (normalized rows from recognition.query) against the in-memory gallery."""
+    recognized_students = []
+    matches = face_gallery.match_batch(query, normalized=True)
+    
+    for i, (face_location, match) in enumerate(zip(face_locations, matches)):
+        if match is not None:
+            student = dict(match["info"])
+            student["confidence"] = match["similarity"]
+            student["face_location"] = face_location
+            recognized_students.append(student)
+        else:
+            # Unknown face
+            recognized_students.append({
+                "id": f"unknown_{i+1}",
+                "name": "Unknown",
+                "confidence": 0.0,
+                "face_location": face_location
+            })
+    
+    return recognized_students
+
+
+def check_face_quality(gray, boxes, limits: Dict = face_quality.RECOGNITION) -> List[Dict]:
+    """Assess each (x, y, w, h) face box in a grayscale image, counting rejects by reason."""
+    with metrics.timer("quality"):
+        assessments = [face_quality.assess_face(gray, box, limits) for box in boxes]
+    for assessment in assessments:
+        # With QUALITY_GATE=false reasons are only reported; nothing was rejected
+        if assessment["ok"]:
+            continue
+        for reason in assessment["reasons"]:
+            metrics.inc("face_api_quality_rejects_total", "Faces failing a quality check, by reason.", reason=reason)
+    return assessments
 
 
 def decode_base64_image(base64_image: str):
     """Decode a base64 image to a numpy array."""
-    if "," in base64_image:
-        base64_image = base64_image.split(",")[1]
+    import cv2
+    import numpy as np
+    from PIL import Image
+    
+    with metrics.timer("decode"):
+        if "," in base64_image:
+            base64_image = base64_image.split(",")[1]
+        
+        image_bytes = base64.b64decode(base64_image)
+        image = Image.open(io.BytesIO(image_bytes))
+        
+        # Convert PIL Image to OpenCV format (RGB to BGR)
+        cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+        return cv_image
+
+
+def decode_upload_image(contents: bytes):
+    """Decode uploaded image bytes to a numpy array."""
+    import cv2
+    import numpy as np
     
-    image_bytes = base64.b64decode(base64_image)
-    image = Image.open(io.BytesIO(image_bytes))
+    with metrics.timer("decode"):
+        nparr = np.frombuffer(contents, np.uint8)
+        return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Record request latency and expose stage timings via Server-Timing."""
+    start = time.perf_counter()
+    timings = metrics.start_request()
+    # The loop thread is shared by every request; only the recognition work the
+    # handler runs on a worker thread (through slow_requests.run_profiled) is profiled
+    capture = (slow_requests.start(request.url.path, profile_scope="worker thread")
+               if request.url.path in SLOW_REQUEST_PATHS else None)
+    try:
+        response = await call_next(request)
+    finally:
+        if capture is not None:
+            capture.stop()
+    elapsed = time.perf_counter() - start
     
-    # Convert PIL Image to OpenCV format (RGB to BGR)
-    cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-    return cv_image
+    route = request.scope.get("route")
+    metrics.REQUEST_SECONDS.observe(elapsed, getattr(route, "path", "unmatched"))
+    slow_requests.finish(capture, slow_request_buffer, timings, elapsed, response.status_code)
+    if SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings, elapsed)
+    return response
+
+
+def warm_up():
+    """Load heavy modules, the face cascade and the gallery, and run one inference,
+    so the first real request doesn't pay for them."""
+    start = time.perf_counter()
+    try:
+        import cv2
+        import numpy as np
+        import recognition
+        from PIL import Image
+        
+        if shared_gallery is not None:
+            shared_gallery.start()
+        load_known_faces()
+        
+        # First inference builds the cascade and warms OpenCV's allocators
+        dummy = np.zeros((240, 320, 3), dtype=np.uint8)
+        recognition.encode(dummy, recognition.detect(dummy) or [(0, 0, 64, 64)])
+        
+        readiness["warmup_seconds"] = time.perf_counter() - start
+        readiness["ready"] = True
+        print(f"Warm-up finished in {readiness['warmup_seconds']:.2f}s")
+    except Exception as e:
+        readiness["error"] = str(e)
+        print(f"Error during warm-up: {e}")
+
+
+@app.on_event("startup")
+def start_warm_up():
+    """Start warm-up in the background so the server accepts connections immediately."""
+    global shared_gallery
+    if SHARED_GALLERY_ENABLED:
+        from shared_gallery import SharedGallery
+        shared_gallery = SharedGallery(SHARED_GALLERY_NAME, read_gallery_from_disk,
+                                       ttl=ENCODINGS_CACHE_TTL)
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    threading.Thread(target=run_compaction, args=(attendance_log, ATTENDANCE_COMPACT_INTERVAL, compaction_stop),
+                     name="attendance-compaction", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def stop_shared_gallery():
+    if shared_gallery is not None:
+        shared_gallery.stop()
+    compaction_stop.set()
+    attendance_log.close()
 
 
 @app.get("/")
@@ -149,57 +377,97 @@ async def root():
 
 @app.get("/health")
 async def health():
-    """Health check endpoint."""
+    """Health (liveness) check endpoint; see /ready for readiness."""
     return {
         "status": "ok",
         "version": "1.0.0",
         "timestamp": datetime.now().isoformat(),
-        "face_recognition_loaded": custom_fr is not None,
-        "known_faces_count": len(known_face_encodings)
+        "face_recognition_loaded": "recognition" in sys.modules,
+        "known_faces_count": len(shared_gallery.snapshot()[1]) if shared_gallery is not None else len(face_gallery or []),
+        "gallery_generation": shared_gallery.generation if shared_gallery is not None else gallery_generation,
+        "result_cache_entries": len(result_cache)
     }
 
 
+@app.get("/ready")
+async def ready():
+    """Readiness check: 200 once warm-up has finished, 503 before."""
+    status = {
+        "ready": readiness["ready"],
+        "uptime_seconds": time.time() - readiness["started_at"],
+        "warmup_seconds": readiness["warmup_seconds"],
+        "error": readiness["error"]
+    }
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=status)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics endpoint."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/api/detect-faces", response_model=FaceDetectionResponse)
-async def detect_faces_legacy(request: FaceDetectionRequest):
+async def detect_faces_legacy(request: FaceDetectionRequest, http_request: Request):
     """Legacy endpoint for detecting faces in an image."""
-    return await detect_faces(request)
+    return await detect_faces(request, http_request)
 
 
 @app.post("/detect-faces", response_model=FaceDetectionResponse)
-async def detect_faces(request: FaceDetectionRequest):
-    """Detect faces in an image."""
+async def detect_faces(request: FaceDetectionRequest, http_request: Request):
+    """Detect faces in an image.
+
+    Send include_encodings=true for encodings (encoding_format=float32 for compact
+    ones), and Accept: application/msgpack for a binary body.
+    """
+    import recognition
+    
     try:
         # Decode base64 image
         image = decode_base64_image(request.image)
-        
-        # Convert to RGB for face_recognition library
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        gray = recognition.to_gray(image)
         
         # Detect faces (locations and encodings)
-        face_locations = custom_fr.face_locations(rgb_image)
-        face_encodings = custom_fr.face_encodings(rgb_image, face_locations)
+        with metrics.timer("detect"):
+            boxes = recognition.detect(gray)
+        face_locations = recognition.to_locations(boxes)
+        metrics.FACES_PER_REQUEST.observe(len(face_locations))
+        # Lets the browser ask for a better capture before submitting it for attendance
+        qualities = check_face_quality(gray, boxes)
+        face_encodings = []
+        if request.include_encodings:
+            with metrics.timer("encode"):
+                face_encodings = recognition.encode(gray, boxes)
         
         # Format response
-        faces = []
-        for i, (face_location, face_encoding) in enumerate(zip(face_locations, face_encodings)):
-            top, right, bottom, left = face_location
-            face_data = {
-                "id": f"face_{i+1}",
-                "box": {
-                    "top": top,
-                    "right": right,
-                    "bottom": bottom,
-                    "left": left
-                },
-                "encoding": face_encoding.tolist()
+        binary = response_format.wants_msgpack(http_request)
+        with metrics.timer("serialize"):
+            faces = []
+            for i, face_location in enumerate(face_locations):
+                top, right, bottom, left = (int(v) for v in face_location)
+                face_data = {
+                    "id": f"face_{i+1}",
+                    "box": {
+                        "top": top,
+                        "right": right,
+                        "bottom": bottom,
+                        "left": left
+                    },
+                    "quality": {"ok": qualities[i]["ok"], "reasons": qualities[i]["reasons"]}
+                }
+                if request.include_encodings:
+                    face_data["encoding"] = response_format.encode_vector(
+                        face_encodings[i], request.encoding_format, binary)
+                faces.append(face_data)
+            
+            payload = {
+                "success": True,
+                "faces": faces,
+                "message": f"Detected {len(faces)} faces"
             }
-            faces.append(face_data)
-        
-        return {
-            "success": True,
-            "faces": faces,
-            "message": f"Detected {len(faces)} faces"
-        }
+            if request.include_encodings:
+                payload["encoding_format"] = request.encoding_format
+            return response_format.negotiated_response(http_request, payload, binary)
         
     except Exception as e:
         print(f"Error in face detection: {e}")
@@ -220,6 +488,10 @@ async def register_student_legacy(request: RegisterStudentRequest, background_ta
 async def register_student(request: RegisterStudentRequest = None, background_tasks: BackgroundTasks = None,
                           image: UploadFile = File(...), student_id: str = Form(...), name: str = Form(...)):
     """Register a new student with face data."""
+    import cv2
+    import numpy as np
+    import recognition
+    
     try:
         # If using JSON request
         if request:
@@ -231,8 +503,7 @@ async def register_student(request: RegisterStudentRequest = None, background_ta
         else:
             # For multipart form data
             contents = await image.read()
-            nparr = np.frombuffer(contents, np.uint8)
-            image_data = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            image_data = decode_upload_image(contents)
             student_name = name
             student_data = {
                 "id": student_id,
@@ -241,44 +512,56 @@ async def register_student(request: RegisterStudentRequest = None, background_ta
             }
         
         # Detect face in the image
-        rgb_image = cv2.cvtColor(image_data, cv2.COLOR_BGR2RGB)
-        face_locations = custom_fr.face_locations(rgb_image)
+        gray = recognition.to_gray(image_data)
+        with metrics.timer("detect"):
+            boxes = recognition.detect(gray)
         
-        if not face_locations:
+        if not boxes:
             return JSONResponse(
                 status_code=400,
                 content={"success": False, "message": "No face detected in the image"}
             )
         
-        if len(face_locations) > 1:
+        if len(boxes) > 1:
             return JSONResponse(
                 status_code=400, 
                 content={"success": False, "message": "Multiple faces detected. Please use an image with only one face"}
             )
         
-        # Get face encoding
-        face_encoding = custom_fr.face_encodings(rgb_image, face_locations)[0]
-        
-        # Create directory for student data
-        student_dir = os.path.join(FACES_DIR, student_id)
-        os.makedirs(student_dir, exist_ok=True)
-        
-        # Save metadata
-        with open(os.path.join(student_dir, "metadata.json"), "w") as f:
-            json.dump(student_data, f)
+        quality = check_face_quality(gray, boxes, face_quality.ENROLLMENT)[0]
+        if not quality["ok"]:
+            return JSONResponse(
+                status_code=400,
+                content={"success": False, "message": f"Image quality too low: {face_quality.describe(quality['reasons'])}",
+                         "reasons": quality["reasons"]}
+            )
         
-        # Save face encoding
-        np.save(os.path.join(student_dir, "encoding.npy"), face_encoding)
+        # Get face encoding
+        with metrics.timer("encode"):
+            face_encoding = recognition.encode(gray, boxes)[0]
         
-        # Save face image
-        cv2.imwrite(os.path.join(student_dir, "face.jpg"), image_data)
+        with metrics.timer("persist"):
+            # Create directory for student data
+            student_dir = os.path.join(FACES_DIR, student_id)
+            os.makedirs(student_dir, exist_ok=True)
+            
+            # Save metadata
+            with open(os.path.join(student_dir, "metadata.json"), "w") as f:
+                json.dump(student_data, f)
+            
+            # Save face encoding
+            version = gallery.get_active_version(FACES_DIR)
+            np.save(os.path.join(student_dir, gallery.encoding_filename(version)), face_encoding)
+            
+            # Save face image
+            cv2.imwrite(os.path.join(student_dir, "face.jpg"), image_data)
         
         # Refresh known faces cache in background
         if background_tasks:
-            background_tasks.add_task(load_known_faces)
+            background_tasks.add_task(load_known_faces, True)
         else:
             # If no background tasks available, reload directly
-            load_known_faces()
+            load_known_faces(force=True)
         
         return {
             "success": True,
@@ -293,6 +576,114 @@ async def register_student(request: RegisterStudentRequest = None, background_ta
         )
 
 
+def run_bulk_enrollment(job_id: str, source: str, roster_path: str, work_dir: str):
+    """Run a bulk enrollment job and rebuild the gallery once at the end."""
+    import bulk_enroll
+    
+    job = bulk_jobs[job_id]
+
+    def report(done, total, student_id, message):
+        job["done"] = done
+        job["total"] = total
+
+    try:
+        summary = bulk_enroll.bulk_enroll(source, roster_path, FACES_DIR, progress=report)
+        job.update(summary)
+        job["status"] = "completed"
+        load_known_faces(force=True)
+    except Exception as e:
+        print(f"Error in bulk enrollment: {e}")
+        job["status"] = "failed"
+        job["message"] = str(e)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+@app.post("/bulk-register")
+async def bulk_register(background_tasks: BackgroundTasks, archive: UploadFile = File(...),
+                        roster: UploadFile = File(...)):
+    """Start a bulk enrollment job from a ZIP of student images and a CSV roster."""
+    import bulk_enroll
+    
+    work_dir = tempfile.mkdtemp(prefix="bulk_upload_")
+    try:
+        archive_path = os.path.join(work_dir, "images.zip")
+        roster_path = os.path.join(work_dir, "roster.csv")
+        with open(archive_path, "wb") as f:
+            shutil.copyfileobj(archive.file, f)
+        with open(roster_path, "wb") as f:
+            shutil.copyfileobj(roster.file, f)
+        bulk_enroll.read_roster(roster_path)
+    except Exception as e:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "message": f"Invalid bulk enrollment upload: {str(e)}"}
+        )
+
+    job_id = uuid.uuid4().hex
+    bulk_jobs[job_id] = {"status": "running", "done": 0, "total": 0}
+    background_tasks.add_task(run_bulk_enrollment, job_id, archive_path, roster_path, work_dir)
+
+    return {"success": True, "job_id": job_id, "message": "Bulk enrollment started"}
+
+
+@app.get("/bulk-register/{job_id}")
+async def bulk_register_status(job_id: str):
+    """Report progress of a bulk enrollment job."""
+    job = bulk_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"success": False, "message": "Unknown job id"})
+    return {"success": True, "job_id": job_id, **job}
+
+
+def recognize_image(source, base64_encoded: bool, camera: Optional[str]):
+    """Recognize the faces in a submitted image; runs on a worker thread.
+
+    Returns (result, None) with the recognized and rejected faces, or
+    (None, response) when the image has no usable faces.
+    """
+    import recognition
+    
+    image_data = decode_base64_image(source) if base64_encoded else decode_upload_image(source)
+    
+    # Detect faces, searching only the face sizes this camera (or session) usually sees
+    gray = recognition.to_gray(image_data)
+    with metrics.timer("detect"):
+        boxes = recognition.detect_for(camera, gray)
+    metrics.FACES_PER_REQUEST.observe(len(boxes))
+    
+    if not boxes:
+        return None, {
+            "success": False,
+            "message": "No faces detected in the image",
+            "recognized": []
+        }
+    
+    # Skip faces too poor to match rather than spending encoding and matching on them
+    qualities = check_face_quality(gray, boxes)
+    rejected = [{"face_location": location, "reasons": quality["reasons"]}
+                for location, quality in zip(recognition.to_locations(boxes), qualities) if not quality["ok"]]
+    boxes = [box for box, quality in zip(boxes, qualities) if quality["ok"]]
+    if not boxes:
+        reasons = sorted({reason for face in rejected for reason in face["reasons"]})
+        return None, {
+            "success": False,
+            "message": f"No usable faces ({face_quality.describe(reasons)}). Please capture again",
+            "recognized": [],
+            "rejected": rejected
+        }
+    
+    # Encode all faces into one normalized query matrix
+    with metrics.timer("encode"):
+        query = recognition.query(gray, boxes)
+    
+    # Compare with known faces
+    with metrics.timer("match"):
+        recognized_students = match_faces(recognition.to_locations(boxes), query)
+    return {"recognized": recognized_students, "rejected": rejected}, None
+
+
 @app.post("/api/take-attendance")
 async def take_attendance_legacy(request: AttendanceSessionRequest):
     """Legacy endpoint for taking attendance."""
@@ -303,11 +694,13 @@ async def take_attendance_legacy(request: AttendanceSessionRequest):
 async def take_attendance(request: AttendanceSessionRequest = None, 
                          image: UploadFile = File(None)):
     """Take attendance by recognizing faces in an image."""
+    import recognition
+    
     try:
         # Load known faces if needed
         load_known_faces()
         
-        if len(known_face_encodings) == 0:
+        if len(face_gallery) == 0:
             return JSONResponse(
                 status_code=400,
                 content={"success": False, "message": "No registered faces found. Please register students first."}
@@ -316,78 +709,65 @@ async def take_attendance(request: AttendanceSessionRequest = None,
         # Get image based on request type
         if request and request.image:
             # JSON request with base64 image
-            image_data = decode_base64_image(request.image)
+            image_bytes = request.image.split(",")[-1].encode("ascii")
             session_data = request.sessionData
         elif image:
             # Multipart form data
-            contents = await image.read()
-            nparr = np.frombuffer(contents, np.uint8)
-            image_data = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            image_bytes = await image.read()
             session_data = {"type": "default", "timestamp": datetime.now().isoformat()}
         else:
             return JSONResponse(
                 status_code=400,
                 content={"success": False, "message": "No image provided"}
             )
-            
-        # Detect faces
-        rgb_image = cv2.cvtColor(image_data, cv2.COLOR_BGR2RGB)
-        face_locations = custom_fr.face_locations(rgb_image)
+        camera = session_data.get("camera_id") or session_data.get("id")
+        slow_requests.record_input(image_bytes, base64_encoded=bool(request and request.image),
+                                   fields={"sessionData": session_data}, gallery_generation=gallery_generation,
+                                   gallery_size=len(face_gallery), camera=camera,
+                                   detect_range=recognition.camera_size_range(camera))
         
-        if not face_locations:
-            return {
-                "success": False,
-                "message": "No faces detected in the image",
-                "recognized": []
-            }
+        # A resubmitted image from the same camera against the same gallery gets the same answer
+        cache_key = make_key(image_bytes, gallery_generation, threshold=face_gallery.threshold, camera=camera)
+        result = result_cache.get(cache_key)
+        cached = result is not None
         
-        # Get face encodings
-        face_encodings = custom_fr.face_encodings(rgb_image, face_locations)
-        
-        # Compare with known faces
-        recognized_students = []
-        
-        for i, (face_location, face_encoding) in enumerate(zip(face_locations, face_encodings)):
-            # Compare face with all known faces
-            matches = custom_fr.compare_faces(known_face_encodings, face_encoding, tolerance=0.6)
-            face_distances = custom_fr.face_distance(known_face_encodings, face_encoding)
-            
-            best_match_index = np.argmin(face_distances)
-            
-            if matches[best_match_index]:
-                student = known_face_names[best_match_index].copy()
-                student["confidence"] = float(1 - face_distances[best_match_index])
-                student["face_location"] = face_location
-                recognized_students.append(student)
-            else:
-                # Unknown face
-                top, right, bottom, left = face_location
-                recognized_students.append({
-                    "id": f"unknown_{i+1}",
-                    "name": "Unknown",
-                    "confidence": 0.0,
-                    "face_location": face_location
-                })
+        if not cached:
+            # Decoding, detection, encoding and matching are CPU-bound. They run on a worker
+            # thread, so the event loop keeps serving other requests (health and readiness
+            # checks included) and the admission concurrency limit bounds the CPU work.
+            source = request.image if request and request.image else image_bytes
+            result, failure = await run_in_threadpool(
+                slow_requests.run_profiled, recognize_image, source, bool(request and request.image), camera)
+            if failure is not None:
+                return failure
+            result_cache.put(cache_key, result)
+        recognized_students, rejected = result["recognized"], result["rejected"]
         
         # Record attendance if needed
+        session_id = session_data.get("id", datetime.now().strftime("%Y%m%d_%H%M%S"))
         attendance_record = {
+            # Same image and session give the same id, so retries collapse into one capture
+            "event_id": make_key(image_bytes, "capture", session_id=session_id),
+            "session_id": session_id,
             "session": session_data,
             "timestamp": datetime.now().isoformat(),
             "recognized_students": [s["id"] for s in recognized_students if "unknown_" not in s["id"]],
+            "confidences": {s["id"]: s["confidence"] for s in recognized_students if "unknown_" not in s["id"]},
             "unknown_count": sum(1 for s in recognized_students if "unknown_" in s["id"])
         }
         
-        # Save attendance record
-        session_id = session_data.get("id", datetime.now().strftime("%Y%m%d_%H%M%S"))
-        attendance_path = os.path.join(ATTENDANCE_DIR, f"{session_id}.json")
-        with open(attendance_path, "w") as f:
-            json.dump(attendance_record, f)
+        # Save attendance record. The append waits for fsync, so it runs off the event loop,
+        # which also lets concurrent captures share one group commit
+        with metrics.timer("persist"):
+            await run_in_threadpool(attendance_log.append, attendance_record)
         
         return {
             "success": True,
             "message": f"Recognized {len([s for s in recognized_students if 'unknown_' not in s['id']])} students",
             "recognized": recognized_students,
-            "session_id": session_id
+            "rejected": rejected,
+            "session_id": session_id,
+            "cached": cached
         }
         
     except Exception as e:
@@ -398,6 +778,22 @@ async def take_attendance(request: AttendanceSessionRequest = None,
         )
 
 
+@app.get("/attendance/session/{session_id}")
+async def get_session_attendance(session_id: str):
+    """All captures of a session and the students recognized in any of them."""
+    captures = attendance_log.session_events(session_id)
+    present = sorted({student_id for capture in captures for student_id in capture["recognized_students"]})
+    return {"success": True, "session_id": session_id, "captures": captures, "present": present}
+
+
+@app.get("/attendance/student/{student_id}")
+async def get_student_attendance(student_id: str, start: Optional[str] = None, end: Optional[str] = None):
+    """Captures a student was recognized in, optionally limited to days in [start, end] (YYYY-MM-DD)."""
+    captures = attendance_log.student_events(student_id, start, end)
+    sessions = sorted({capture["session_id"] for capture in captures})
+    return {"success": True, "student_id": student_id, "captures": captures, "sessions": sessions}
+
+
 @app.get("/test-connection")
 async def test_connection():
     """Simple endpoint to test API connectivity."""
@@ -0,0 +1,125 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Iterator, Optional, Set, Tuple
+
+import numpy as np
+
+import gallery
+from bulk_enroll import bounded_map, encode_image
+
+
+def checkpoint_path(faces_dir: str, version: str) -> str:
+    """Line-delimited log of students already processed for version."""
+    return os.path.join(faces_dir, f"reencode-{version}.log")
+
+
+def read_checkpoint(faces_dir: str, version: str) -> Set[str]:
+    """Return the ids of students an earlier run encoded successfully.
+
+    Students whose encode failed are left out, so a resumed run retries them.
+    """
+    path = checkpoint_path(faces_dir, version)
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r") as f:
+        fields = (line.rstrip("\n").split("\t") for line in f if line.strip())
+        return {row[0] for row in fields if len(row) > 1 and row[1] == "ok"}
+
+
+def iter_pending(faces_dir: str, processed: Set[str]) -> Iterator[Tuple[str, str]]:
+    """Stream (student_id, face image path) for students not yet processed."""
+    with os.scandir(faces_dir) as entries:
+        for entry in entries:
+            if not entry.is_dir() or entry.name in processed:
+                continue
+            image_path = os.path.join(entry.path, "face.jpg")
+            if os.path.exists(image_path):
+                yield entry.name, image_path
+
+
+def reencode_gallery(faces_dir: str, version: str, workers: Optional[int] = None, activate: bool = True,
+                     progress: Optional[Callable[[int, str, Optional[str]], None]] = None,
+                     allow_failures: bool = False) -> Dict:
+    """Re-encode every stored face image into a new gallery version.
+
+    Progress is checkpointed per student so an interrupted run resumes where it
+    stopped; students that failed are retried by the next run. The active version
+    is only switched once every student has been encoded (or, with
+    allow_failures, processed), so serving continues from the old encodings until
+    then.
+    """
+    active = gallery.get_active_version(faces_dir)
+    if version == active:
+        raise ValueError(f"Gallery version {version} is already active")
+
+    workers = workers or os.cpu_count() or 1
+    processed = read_checkpoint(faces_dir, version)
+    done = 0
+    failed = []
+
+    with open(checkpoint_path(faces_dir, version), "a") as checkpoint, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep sweeping until a pass finds nothing new, so students enrolled
+        # while the job was running are included before the switch
+        while True:
+            work = iter_pending(faces_dir, processed)
+            handled = 0
+            # Already-enrolled photos are re-encoded as they are, not re-judged by the quality gate
+            encode = partial(encode_image, check_quality=False)
+            for (student_id, _), result, error in bounded_map(executor, encode, work, workers * 4):
+                face_encoding, message = (None, str(error)) if error else result
+                if face_encoding is not None:
+                    student_dir = os.path.join(faces_dir, student_id)
+                    np.save(os.path.join(student_dir, gallery.encoding_filename(version)), face_encoding)
+                    checkpoint.write(f"{student_id}\tok\n")
+                else:
+                    failed.append(student_id)
+                    checkpoint.write(f"{student_id}\tfailed\t{message}\n")
+                checkpoint.flush()
+
+                processed.add(student_id)
+                handled += 1
+                done += 1
+                if progress:
+                    progress(done, student_id, message)
+            if handled == 0:
+                break
+
+    if activate and failed and not allow_failures:
+        # Those students would keep old-encoder vectors or stop matching
+        print(f"Not activating gallery {version}: {len(failed)} student(s) failed to re-encode "
+              f"({', '.join(map(str, failed))}). Fix their photos and run again to retry them.")
+        activate = False
+    if activate:
+        gallery.set_active_version(faces_dir, version, previous=active)
+        os.remove(checkpoint_path(faces_dir, version))
+        print(f"Gallery {version} is now active (previous: {active})")
+
+    return {"version": version, "processed": done, "failed": len(failed), "failed_ids": failed,
+            "activated": activate}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-encode all stored faces into a new gallery version.")
+    parser.add_argument("version", help="Name of the new gallery version, e.g. v2")
+    parser.add_argument("--faces-dir", default=os.path.join(os.environ.get("DATA_DIR", "/app/data"), "faces"),
+                        help="Gallery directory (default: $DATA_DIR/faces)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--no-activate", action="store_true",
+                        help="Build the new version without switching the server to it")
+    parser.add_argument("--allow-failures", action="store_true",
+                        help="Switch to the new version even if some students failed to re-encode")
+    args = parser.parse_args()
+
+    def report(done, student_id, message):
+        print(f"[{done}] {student_id}: {message or 'ok'}")
+
+    summary = reencode_gallery(args.faces_dir, args.version, args.workers, not args.no_activate, report,
+                               args.allow_failures)
+    print(f"Re-encoded {summary['processed'] - summary['failed']} faces, {summary['failed']} failed")
+
+
+if __name__ == "__main__":
+    main()
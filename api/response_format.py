@@ -0,0 +1,81 @@
+"""
+Content negotiation for detection responses.
+
+Encodings can be left out, sent as JSON float lists (the default, for
+existing clients) or as little-endian float32 bytes, base64-encoded in JSON
+or raw in msgpack. Large bodies are compressed with brotli or gzip when the
+client accepts it. msgpack and brotli are optional dependencies.
+"""
+
+import base64
+import gzip
+import json
+import os
+
+from fastapi import Request
+from fastapi.responses import Response
+
+ENCODING_FORMATS = ("json", "float32")
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Bodies smaller than this aren't worth the CPU to compress
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def encode_vector(vector, encoding_format: str, binary: bool = False):
+    """Serialize one face encoding in the requested format."""
+    import numpy as np
+
+    if encoding_format == "float32":
+        raw = np.asarray(vector, dtype="<f4").tobytes()
+        return raw if binary else base64.b64encode(raw).decode("ascii")
+    return np.asarray(vector, dtype=np.float64).tolist()
+
+
+def wants_msgpack(request: Request) -> bool:
+    accept = request.headers.get("accept", "")
+    return msgpack is not None and (MSGPACK_MEDIA_TYPE in accept or "application/x-msgpack" in accept)
+
+
+def _accepted_encodings(request: Request):
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name and params.strip().replace(" ", "") not in ("q=0", "q=0.0"):
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def negotiated_response(request: Request, payload: dict, binary: bool = False) -> Response:
+    """Serialize payload as msgpack or JSON and compress it if the client allows.
+
+    Bypasses FastAPI's response_model validation and jsonable_encoder, which
+    dominate serialization time for responses carrying many encodings.
+    """
+    if binary:
+        body = msgpack.packb(payload, use_bin_type=True)
+        media_type = MSGPACK_MEDIA_TYPE
+    else:
+        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        media_type = "application/json"
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if len(body) >= COMPRESS_MIN_BYTES:
+        accepted = _accepted_encodings(request)
+        if brotli is not None and "br" in accepted:
+            body = brotli.compress(body, quality=4)
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in accepted:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type=media_type, headers=headers)
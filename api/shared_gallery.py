@@ -0,0 +1,212 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Control block slots (int64): current generation, last reload request (ns), publisher pid
+_GENERATION, _RELOAD_REQUESTED, _PUBLISHER_PID = 0, 1, 2
+_CONTROL_SLOTS = 4
+# Segment header (int64): rows, dimensions, metadata length in bytes
+_HEADER_SLOTS = 3
+# Rows are stored as recognition.normalize() produces them
+_DTYPE = np.float32
+
+Loader = Callable[[], Tuple[List[np.ndarray], List[Dict]]]
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Attach to an existing segment without letting this process's resource
+    tracker unlink it on exit (segments outlive individual workers)."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        segment = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+def _create(name: str, size: int) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, create=True, size=size, track=False)
+    except TypeError:  # Python < 3.13
+        segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+def _unlink(name: str) -> None:
+    # A tracked attach here is balanced by the unregister inside unlink()
+    try:
+        segment = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    segment.close()
+    segment.unlink()
+
+
+class SharedGallery:
+    """Gallery shared by all uvicorn workers through POSIX shared memory.
+
+    Exactly one worker (whichever holds the lock file) is the publisher: it
+    loads the gallery from disk and writes it into a new segment named by
+    generation, then bumps the generation in a small control block. Every
+    worker, publisher included, maps the current segment read-only and
+    re-attaches when the generation changes, so all workers share one copy of
+    the encodings and see the same enrollments.
+    """
+
+    def __init__(self, name: str, loader: Loader, ttl: float = 300, poll_interval: float = 1.0):
+        if fcntl is None:
+            raise RuntimeError("Shared gallery mode requires a POSIX platform")
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.is_publisher = False
+        self._lock_file = None
+        self._control = self._open_control()
+        # Recently attached segments, kept open for requests still using their arrays
+        self._segments = deque(maxlen=3)
+        self._generation = -1
+        self._snapshot: Tuple[np.ndarray, List[Dict]] = (np.empty((0, 0), dtype=_DTYPE), [])
+        self._attach_lock = threading.Lock()
+        self._seen_request = 0
+        self._published_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _open_control(self) -> np.ndarray:
+        control_name = f"{self.name}_ctl"
+        try:
+            self._control_segment = _create(control_name, _CONTROL_SLOTS * 8)
+        except FileExistsError:
+            self._control_segment = _attach(control_name)
+        return np.ndarray((_CONTROL_SLOTS,), dtype=np.int64, buffer=self._control_segment.buf)
+
+    def _try_become_publisher(self) -> bool:
+        if self.is_publisher:
+            return True
+        lock_path = os.path.join(tempfile.gettempdir(), f"{self.name}.lock")
+        lock_file = open(lock_path, "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self.is_publisher = True
+        self._control[_PUBLISHER_PID] = os.getpid()
+        print(f"Worker {os.getpid()} is the shared gallery publisher")
+        return True
+
+    @property
+    def generation(self) -> int:
+        return int(self._control[_GENERATION])
+
+    @property
+    def attached_generation(self) -> int:
+        """Generation of the segment snapshot() returns; lags generation until attached."""
+        return self._generation
+
+    def publish(self) -> int:
+        """Load the gallery from disk and make it the current generation."""
+        encodings, names = self.loader()
+        if encodings:
+            matrix = np.asarray(encodings, dtype=_DTYPE).reshape(len(encodings), -1)
+        else:
+            matrix = np.empty((0, 0), dtype=_DTYPE)
+        metadata = json.dumps(names).encode("utf-8")
+        padded = (len(metadata) + 7) // 8 * 8
+        size = _HEADER_SLOTS * 8 + padded + matrix.nbytes
+
+        generation = self.generation + 1
+        segment_name = f"{self.name}_{generation}"
+        # Left over from a publisher that died between creating and announcing it
+        _unlink(segment_name)
+        segment = _create(segment_name, max(size, 8))
+        header = np.ndarray((_HEADER_SLOTS,), dtype=np.int64, buffer=segment.buf)
+        header[:] = (matrix.shape[0], matrix.shape[1], len(metadata))
+        offset = _HEADER_SLOTS * 8
+        segment.buf[offset:offset + len(metadata)] = metadata
+        target = np.ndarray(matrix.shape, dtype=_DTYPE, buffer=segment.buf, offset=offset + padded)
+        target[:] = matrix
+        # Views must be released before the mapping can be closed
+        del header, target
+        segment.close()
+
+        # Single aligned store: readers see either the old or the new generation
+        self._control[_GENERATION] = generation
+        self._published_at = time.time()
+        # Keep the previous generation for workers still attaching to it
+        _unlink(f"{self.name}_{generation - 2}")
+        print(f"Published shared gallery generation {generation} with {matrix.shape[0]} encodings")
+        return generation
+
+    def request_reload(self) -> None:
+        """Ask the publisher to reload from disk (e.g. after a registration in any worker)."""
+        self._control[_RELOAD_REQUESTED] = time.time_ns()
+
+    def snapshot(self) -> Tuple[np.ndarray, List[Dict]]:
+        """Return the current (encodings matrix, names), re-attaching if a new generation exists."""
+        generation = self.generation
+        if generation == self._generation:
+            return self._snapshot
+        with self._attach_lock:
+            if generation != self._generation and generation > 0:
+                try:
+                    self._attach_generation(generation)
+                except FileNotFoundError:
+                    # Superseded while attaching; the next call picks up the newer one
+                    pass
+        return self._snapshot
+
+    def _attach_generation(self, generation: int) -> None:
+        segment = _attach(f"{self.name}_{generation}")
+        rows, dims, metadata_length = np.ndarray((_HEADER_SLOTS,), dtype=np.int64, buffer=segment.buf)
+        offset = _HEADER_SLOTS * 8
+        names = json.loads(bytes(segment.buf[offset:offset + metadata_length]).decode("utf-8"))
+        padded = (int(metadata_length) + 7) // 8 * 8
+        matrix = np.ndarray((int(rows), int(dims)), dtype=_DTYPE, buffer=segment.buf, offset=offset + padded)
+        matrix.flags.writeable = False
+
+        self._segments.append(segment)
+        self._snapshot = (matrix, names)
+        self._generation = generation
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                if not self._try_become_publisher():
+                    continue
+                requested = int(self._control[_RELOAD_REQUESTED])
+                if requested != self._seen_request or time.time() - self._published_at >= self.ttl:
+                    self._seen_request = requested
+                    self.publish()
+            except Exception as e:
+                print(f"Error in shared gallery loop: {e}")
+
+    def start(self) -> None:
+        """Publish the first generation if this worker is the publisher and start polling."""
+        if self._try_become_publisher():
+            self._seen_request = int(self._control[_RELOAD_REQUESTED])
+            self.publish()
+        self._thread = threading.Thread(target=self._run, name="shared-gallery", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+            self.is_publisher = False
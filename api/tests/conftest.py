@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# Tests import the server modules the way the server does: from its own
+# directory, plus the shared modules in common/
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(SERVER_DIR), "common"))
+# main creates its data directories on import
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="face_api_tests_"))
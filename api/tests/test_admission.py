@@ -0,0 +1,103 @@
+import ipaddress
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import admission
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def test_token_bucket_allows_a_burst_then_refills(clock):
+    limiter = admission.TokenBucketLimiter(rate_per_second=2, burst=3)
+
+    assert [limiter.acquire("a")[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = limiter.acquire("a")
+    assert not allowed
+    assert retry_after == pytest.approx(0.5)
+    # Other clients have their own bucket
+    assert limiter.acquire("b")[0]
+
+    clock.now += 0.5
+    assert limiter.acquire("a")[0]
+    assert not limiter.acquire("a")[0]
+
+
+def test_token_bucket_forgets_the_least_recent_clients(clock):
+    limiter = admission.TokenBucketLimiter(rate_per_second=1, burst=1, max_clients=2)
+    limiter.acquire("a")
+    limiter.acquire("b")
+    limiter.acquire("c")
+
+    # "a" was evicted, so it starts again with a full bucket
+    assert limiter.acquire("a")[0]
+    assert not limiter.acquire("c")[0]
+
+
+def test_client_headers_are_only_believed_from_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", [ipaddress.ip_network("10.0.0.0/8")])
+    forwarded = {"x-forwarded-for": "203.0.113.7, 10.1.2.3", "x-client-id": "chosen-by-client"}
+
+    assert admission.client_key(forwarded, "198.51.100.1") == "ip:198.51.100.1"
+    assert admission.client_key({"x-forwarded-for": "203.0.113.7, 10.1.2.3"}, "10.0.0.5") == "ip:203.0.113.7"
+    assert admission.client_key(forwarded, "10.0.0.5") == "x-client-id:chosen-by-client"
+    assert admission.client_key({}, "10.0.0.5") == "ip:10.0.0.5"
+
+
+def test_rightmost_untrusted_hop_is_the_client(monkeypatch):
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", [ipaddress.ip_network("10.0.0.0/8")])
+    # The first entry was sent by the client itself and can't be believed
+    headers = {"x-forwarded-for": "1.2.3.4, 203.0.113.7, 10.9.9.9"}
+
+    assert admission.client_key(headers, "10.0.0.5") == "ip:203.0.113.7"
+
+
+async def upload(request):
+    body = await request.body()
+    return JSONResponse({"received": len(body)})
+
+
+@pytest.fixture
+def client():
+    app = Starlette(routes=[Route("/upload", upload, methods=["POST"]), Route("/other", upload, methods=["POST"])])
+    middleware = admission.AdmissionMiddleware(app, limits={"/upload": 10})
+    middleware.limiter = admission.TokenBucketLimiter(rate_per_second=0.001, burst=2)
+    return TestClient(middleware)
+
+
+def test_declared_oversized_body_is_rejected(client):
+    response = client.post("/upload", content=b"x" * 11)
+
+    assert response.status_code == 413
+    assert response.json()["error"] == "payload_too_large"
+
+
+def test_streamed_oversized_body_is_rejected(client):
+    response = client.post("/upload", content=iter([b"x" * 6, b"x" * 6]))
+
+    assert response.status_code == 413
+    assert response.json()["error"] == "payload_too_large"
+
+
+def test_rate_limit_applies_only_to_limited_routes(client):
+    assert [client.post("/upload", content=b"x").status_code for _ in range(3)] == [200, 200, 429]
+    response = client.post("/upload", content=b"x")
+    assert response.json()["error"] == "rate_limited"
+    assert int(response.headers["retry-after"]) > 0
+    assert client.post("/other", content=b"x" * 100).status_code == 200
@@ -0,0 +1,122 @@
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+from attendance_log import AttendanceLog
+
+
+def capture(session_id, students, recorded_at):
+    return {"session_id": session_id, "recognized_students": students, "recorded_at": recorded_at}
+
+
+def age(path, hours):
+    mtime = time.time() - hours * 3600
+    os.utime(path, (mtime, mtime))
+
+
+def test_append_indexes_by_session_and_student(tmp_path):
+    log = AttendanceLog(str(tmp_path), fsync=False)
+    log.append(capture("S1", ["A", "B"], "2026-01-05T09:00:00"))
+    log.append(capture("S1", ["B"], "2026-01-05T09:05:00"))
+    log.append(capture("S2", ["A"], "2026-01-06T09:00:00"))
+    log.close()
+
+    assert [e["recognized_students"] for e in log.session_events("S1")] == [["A", "B"], ["B"]]
+    assert [e["session_id"] for e in log.student_events("A")] == ["S1", "S2"]
+    assert [e["session_id"] for e in log.student_events("A", start="2026-01-06")] == ["S2"]
+    # A second process sees the same events by tailing the segments
+    assert len(AttendanceLog(str(tmp_path)).session_events("S1")) == 2
+
+
+def test_retried_event_is_indexed_once(tmp_path):
+    log = AttendanceLog(str(tmp_path), fsync=False)
+    event = dict(capture("S1", ["A"], "2026-01-05T09:00:00"), event_id="same")
+    log.append(event)
+    log.append(event)
+
+    assert len(log.session_events("S1")) == 1
+
+
+def test_compact_gzips_past_days_sorted_by_session(tmp_path):
+    log = AttendanceLog(str(tmp_path), fsync=False)
+    log.append(capture("S2", ["A"], "2026-01-05T10:00:00"))
+    log.append(capture("S1", ["B"], "2026-01-05T11:00:00"))
+    log.append(capture("S3", ["C"], "2026-01-06T09:00:00"))
+    log.close()
+    age(tmp_path / "2026-01-05.jsonl", hours=2)
+
+    assert log.compact(before="2026-01-06") == ["2026-01-05"]
+    assert sorted(os.listdir(tmp_path)) == [".compact.lock", "2026-01-05.jsonl.gz", "2026-01-06.jsonl"]
+    with gzip.open(tmp_path / "2026-01-05.jsonl.gz", "rt") as f:
+        assert [json.loads(line)["session_id"] for line in f] == ["S1", "S2"]
+    assert [e["session_id"] for e in AttendanceLog(str(tmp_path)).scan()] == ["S1", "S2", "S3"]
+
+
+def test_compact_skips_yesterday_and_recently_written_segments(tmp_path):
+    log = AttendanceLog(str(tmp_path), fsync=False)
+    days = [(date.today() - timedelta(days=n)).isoformat() for n in (3, 2, 1)]
+    for day in days:
+        log.append(capture("S1", ["A"], day + "T09:00:00"))
+    log.close()
+    age(tmp_path / (days[0] + ".jsonl"), hours=2)
+    age(tmp_path / (days[2] + ".jsonl"), hours=2)
+
+    # days[1] was written moments ago and days[2] is yesterday
+    assert log.compact() == [days[0]]
+    assert (tmp_path / (days[1] + ".jsonl")).exists()
+    assert (tmp_path / (days[2] + ".jsonl")).exists()
+
+
+def test_concurrent_appends_share_fsyncs(tmp_path, monkeypatch):
+    real_fsync = os.fsync
+    calls = []
+
+    def slow_fsync(fd):
+        calls.append(fd)
+        time.sleep(0.05)
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", slow_fsync)
+    log = AttendanceLog(str(tmp_path))
+    threads = [threading.Thread(target=log.append, args=(capture("S1", [str(i)], "2026-01-05T09:00:00"),))
+               for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(log.session_events("S1")) == 8
+    assert len(calls) < 8
+
+
+def test_day_rollover_keeps_the_old_segment_open_for_a_running_fsync(tmp_path, monkeypatch):
+    real_fsync = os.fsync
+    rolled_over = threading.Event()
+    synced_inodes = []
+
+    def fsync_after_rollover(fd):
+        rolled_over.wait(5)
+        # Fails with EBADF, or sees the new day's inode, if the fd was closed meanwhile
+        synced_inodes.append(os.fstat(fd).st_ino)
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", fsync_after_rollover)
+    log = AttendanceLog(str(tmp_path))
+    first = threading.Thread(target=log.append, args=(capture("S1", ["A"], "2026-01-05T23:59:59"),))
+    first.start()
+    while not log._syncing:
+        time.sleep(0.001)
+    second = threading.Thread(target=log.append, args=(capture("S2", ["B"], "2026-01-06T00:00:01"),))
+    second.start()
+    while log._day != "2026-01-06":
+        time.sleep(0.001)
+    rolled_over.set()
+    first.join()
+    second.join()
+    log.close()
+
+    assert synced_inodes[0] == os.stat(tmp_path / "2026-01-05.jsonl").st_ino
+    assert len(log.session_events("S1")) == 1 and len(log.session_events("S2")) == 1
@@ -0,0 +1,38 @@
+import numpy as np
+
+import face_quality
+import main
+import metrics
+
+
+def rejects(reason):
+    return metrics._counters.get(("face_api_quality_rejects_total", (("reason", reason),)), 0)
+
+
+def blurry_face():
+    gray = np.full((200, 200), 128, dtype=np.uint8)
+    gray[50:150, 50:150] = 90
+    return gray, (50, 50, 100, 100)
+
+
+def test_flat_face_is_rejected_as_blurry_and_counted():
+    gray, box = blurry_face()
+    before = rejects("blurry")
+
+    [quality] = main.check_face_quality(gray, [box])
+
+    assert not quality["ok"]
+    assert "blurry" in quality["reasons"]
+    assert rejects("blurry") == before + 1
+
+
+def test_disabled_gate_reports_reasons_without_counting_rejects(monkeypatch):
+    monkeypatch.setattr(face_quality, "QUALITY_GATE_ENABLED", False)
+    gray, box = blurry_face()
+    before = rejects("blurry")
+
+    [quality] = main.check_face_quality(gray, [box])
+
+    assert quality["ok"]
+    assert "blurry" in quality["reasons"]
+    assert rejects("blurry") == before
@@ -0,0 +1,57 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import gallery
+import recognition
+import reencode_gallery
+
+
+def enroll(faces_dir, *student_ids):
+    for student_id in student_ids:
+        (faces_dir / student_id).mkdir()
+        (faces_dir / student_id / "face.jpg").write_bytes(b"jpeg")
+
+
+def test_failed_students_block_activation_and_are_retried(tmp_path, monkeypatch):
+    enroll(tmp_path, "A", "B", "C")
+    broken = {"B"}
+    encoded = []
+
+    def encode_image(image_path, check_quality=True):
+        student_id = os.path.basename(os.path.dirname(image_path))
+        encoded.append(student_id)
+        if student_id in broken:
+            return None, "No face detected in the image"
+        return np.zeros(recognition.ENCODING_SIZE, dtype=np.uint8), None
+
+    # Threads instead of processes, so the stand-in encoder is used
+    monkeypatch.setattr(reencode_gallery, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(reencode_gallery, "encode_image", encode_image)
+
+    summary = reencode_gallery.reencode_gallery(str(tmp_path), "v2", workers=1)
+
+    assert summary["failed_ids"] == ["B"] and not summary["activated"]
+    assert gallery.get_active_version(str(tmp_path)) == gallery.DEFAULT_VERSION
+    assert reencode_gallery.read_checkpoint(str(tmp_path), "v2") == {"A", "C"}
+
+    broken.clear()
+    encoded.clear()
+    summary = reencode_gallery.reencode_gallery(str(tmp_path), "v2", workers=1)
+
+    # Only the student that failed is encoded again
+    assert encoded == ["B"]
+    assert summary["activated"]
+    assert gallery.get_active_version(str(tmp_path)) == "v2"
+
+
+def test_allow_failures_activates_anyway(tmp_path, monkeypatch):
+    enroll(tmp_path, "A", "B")
+    monkeypatch.setattr(reencode_gallery, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(reencode_gallery, "encode_image", lambda image_path, check_quality=True: (None, "broken"))
+
+    summary = reencode_gallery.reencode_gallery(str(tmp_path), "v2", workers=1, allow_failures=True)
+
+    assert summary["failed"] == 2 and summary["activated"]
+    assert gallery.get_active_version(str(tmp_path)) == "v2"
@@ -0,0 +1,68 @@
+import result_cache
+from result_cache import ResultCache, make_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_key_depends_on_image_generation_and_params():
+    key = make_key(b"image", 1, threshold=0.6)
+
+    assert key == make_key(b"image", 1, threshold=0.6)
+    assert key != make_key(b"other", 1, threshold=0.6)
+    assert key != make_key(b"image", 2, threshold=0.6)
+    assert key != make_key(b"image", 1, threshold=0.5)
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache.time, "monotonic", clock)
+    cache = ResultCache("test", max_entries=4, ttl=10)
+    cache.put("a", {"faces": 1})
+
+    clock.now += 10
+    assert cache.get("a") == {"faces": 1}
+
+    clock.now += 0.5
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache("test", max_entries=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+
+    # Reading "a" makes "b" the eviction candidate
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_cached_values_are_copies():
+    cache = ResultCache("test", max_entries=2, ttl=60)
+    value = {"faces": [1]}
+    cache.put("a", value)
+    value["faces"].append(2)
+
+    hit = cache.get("a")
+    hit["faces"].append(3)
+
+    assert cache.get("a") == {"faces": [1]}
+
+
+def test_zero_size_disables_caching():
+    cache = ResultCache("test", max_entries=0, ttl=60)
+    cache.put("a", 1)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
@@ -0,0 +1,48 @@
+import uuid
+
+import numpy as np
+import pytest
+
+import recognition
+import shared_gallery
+
+
+@pytest.fixture
+def gallery():
+    encodings = recognition.normalize(np.random.default_rng(0).random((3, recognition.ENCODING_SIZE)))
+    names = [{"id": f"S{i}"} for i in range(3)]
+    shared = shared_gallery.SharedGallery(f"test_gallery_{uuid.uuid4().hex[:8]}", lambda: (list(encodings), names))
+    yield shared, encodings
+    shared.stop()
+    for generation in range(shared.generation + 1):
+        shared_gallery._unlink(f"{shared.name}_{generation}")
+    shared_gallery._unlink(f"{shared.name}_ctl")
+
+
+def test_publish_shares_float32_rows(gallery):
+    shared, encodings = gallery
+    assert shared._try_become_publisher()
+    shared.publish()
+
+    matrix, names = shared.snapshot()
+    assert matrix.dtype == np.float32
+    np.testing.assert_array_equal(matrix, encodings)
+    assert [n["id"] for n in names] == ["S0", "S1", "S2"]
+    assert shared.attached_generation == shared.generation == 1
+
+
+def test_failed_attach_does_not_advance_the_attached_generation(gallery, monkeypatch):
+    shared, _ = gallery
+    assert shared._try_become_publisher()
+    shared.publish()
+    shared.snapshot()
+
+    shared.publish()
+
+    def superseded(generation):
+        raise FileNotFoundError(generation)
+
+    monkeypatch.setattr(shared, "_attach_generation", superseded)
+    shared.snapshot()
+    assert shared.generation == 2
+    assert shared.attached_generation == 1
@@ -0,0 +1,104 @@
+import contextvars
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+import recognition
+import slow_requests
+
+
+@pytest.fixture
+def capture(monkeypatch, tmp_path):
+    monkeypatch.setattr(slow_requests, "CAPTURE_ENABLED", True)
+    monkeypatch.setattr(slow_requests, "THRESHOLD", 0.0)
+    return slow_requests.CaptureBuffer(str(tmp_path))
+
+
+def jpeg():
+    image = np.full((240, 320, 3), 128, dtype=np.uint8)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+def test_capture_records_the_detect_range_and_profile_scope(capture):
+    request = slow_requests.start("/recognize-faces", profile_scope="worker thread")
+    slow_requests.record_input(jpeg(), gallery_size=3, camera="room-1", detect_range=(40, 90))
+    capture_id = slow_requests.finish(request, capture, {"detect": 0.5}, 1.5, 200)
+
+    record, _ = capture.load(capture_id)
+    assert record["profile_scope"] == "worker thread"
+    assert record["context"]["camera"] == "room-1"
+    assert record["context"]["detect_range"] == [40, 90]
+
+
+def test_worker_thread_scope_profiles_only_the_work_run_through_run_profiled(capture, monkeypatch):
+    monkeypatch.setattr(slow_requests, "PROFILE_ENABLED", True)
+    request = slow_requests.start("/recognize-faces", profile_scope="worker thread")
+    assert request.profiler is None
+
+    # The worker thread sees the request's capture the way run_in_threadpool passes it on
+    results = []
+    context = contextvars.copy_context()
+    worker = threading.Thread(target=lambda: results.append(
+        context.run(slow_requests.run_profiled, sum, [1, 2, 3])))
+    worker.start()
+    worker.join()
+
+    assert results == [6]
+    assert request.profiler is not None
+    # The profile ended with the work, so the next request can be profiled
+    assert slow_requests._profile_lock.acquire(blocking=False)
+    slow_requests._profile_lock.release()
+    slow_requests.finish(request, capture, {}, 0.0, 200)
+
+
+def test_replay_searches_the_captured_range_then_falls_back(monkeypatch):
+    searched = []
+    monkeypatch.setattr(recognition, "detect_in_range", lambda gray, low, high: searched.append((low, high)) or [])
+    monkeypatch.setattr(recognition, "detect", lambda gray: searched.append("full") or [])
+
+    slow_requests.replay({"context": {"gallery_size": 2, "detect_range": [40, 90]}}, jpeg(), repeat=1)
+    assert searched == [(40, 90), "full"] * 2
+
+    searched.clear()
+    slow_requests.replay({"context": {"gallery_size": 2}}, jpeg(), repeat=1)
+    assert searched == ["full"] * 2
+
+
+def test_camera_size_range_follows_the_adaptive_detector(monkeypatch):
+    monkeypatch.setattr(recognition, "ADAPTIVE_DETECTION", True)
+    monkeypatch.setattr(recognition, "_detectors", type(recognition._detectors)())
+    detector = recognition.AdaptiveDetector()
+    detector._sizes.extend([100] * recognition.ADAPTIVE_MIN_SAMPLES)
+    recognition._detectors["room-1"] = detector
+
+    low, high = recognition.camera_size_range("room-1")
+    assert low < 100 < high
+    assert recognition.camera_size_range("unknown") is None
+    assert recognition.camera_size_range(None) is None
+
+
+def test_adaptive_detector_learns_from_full_passes_and_falls_back_when_faces_go_missing(monkeypatch):
+    monkeypatch.setattr(recognition, "ADAPTIVE_MIN_SAMPLES", 2)
+    monkeypatch.setattr(recognition, "ADAPTIVE_FULL_PASS_INTERVAL", 0)
+    full = [(0, 0, 100, 100), (200, 0, 100, 100), (400, 0, 300, 300)]
+    narrowed = full[:2]
+    searched = []
+    monkeypatch.setattr(recognition, "detect", lambda gray: searched.append("full") or full)
+    monkeypatch.setattr(recognition, "detect_in_range",
+                        lambda gray, low, high: searched.append("narrowed") or narrowed)
+    detector = recognition.AdaptiveDetector()
+
+    assert detector.detect(None) == full
+    # The narrowed pass misses the large face the full pass found, so the frame is searched again
+    assert detector.detect(None) == full
+    assert searched == ["full", "narrowed", "full"]
+    # Narrowed passes never shrink the learned sizes
+    assert sorted(detector._sizes) == [100, 100, 100, 100, 300, 300]
+
+    full = full[:2]
+    searched.clear()
+    assert detector.detect(None) == narrowed
+    assert detector.detect(None) == narrowed
+    assert searched == ["narrowed", "full", "narrowed"]
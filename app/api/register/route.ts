@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from "next/server";
+import { clientHeaders } from "@/lib/proxy";
 
 export async function POST(req: NextRequest) {
   try {
@@ -17,6 +18,7 @@ export async function POST(req: NextRequest) {
     const pythonApiUrl = process.env.NEXT_PUBLIC_PYTHON_API_URL || 'http://localhost:5000';
     const pythonResponse = await fetch(`${pythonApiUrl}/api/register`, {
       method: 'POST',
+      headers: clientHeaders(req),
       body: formData,
     });
     
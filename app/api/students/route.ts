@@ -1,27 +1,53 @@
 import { NextRequest, NextResponse } from "next/server";
+import { clientHeaders } from "@/lib/proxy";
+
+// Conditional request headers passed to the backend, and validators passed back,
+// so revalidation works end to end through this proxy
+const FORWARDED_REQUEST_HEADERS = ["if-none-match", "if-modified-since"];
+const FORWARDED_RESPONSE_HEADERS = ["etag", "last-modified", "cache-control"];
 
 export async function GET(req: NextRequest) {
   try {
     const url = new URL(req.url);
-    const id = url.searchParams.get("id");
     
     // Forward the request to the Python backend
     const pythonApiUrl = process.env.NEXT_PUBLIC_PYTHON_API_URL || 'http://localhost:5000';
     let pythonUrl = `${pythonApiUrl}/api/students`;
     
-    // If ID is provided, include it in the request
-    if (id) {
-      pythonUrl += `?id=${id}`;
+    // Forward pagination (cursor, limit), fields and filter parameters as-is
+    if (url.search) {
+      pythonUrl += url.search;
+    }
+    
+    const headers = new Headers(clientHeaders(req));
+    for (const name of FORWARDED_REQUEST_HEADERS) {
+      const value = req.headers.get(name);
+      if (value) {
+        headers.set(name, value);
+      }
     }
     
     // Send request to Python backend
-    const pythonResponse = await fetch(pythonUrl);
+    const pythonResponse = await fetch(pythonUrl, { headers, cache: 'no-store' });
+    
+    const responseHeaders = new Headers();
+    for (const name of FORWARDED_RESPONSE_HEADERS) {
+      const value = pythonResponse.headers.get(name);
+      if (value) {
+        responseHeaders.set(name, value);
+      }
+    }
+    
+    // Not modified: no body to parse, the client reuses its copy
+    if (pythonResponse.status === 304) {
+      return new NextResponse(null, { status: 304, headers: responseHeaders });
+    }
     
     // Get the response from Python backend
     const data = await pythonResponse.json();
     
     // Return the response
-    return NextResponse.json(data, { status: pythonResponse.status });
+    return NextResponse.json(data, { status: pythonResponse.status, headers: responseHeaders });
     
   } catch (error) {
     console.error("Error retrieving student data:", error);
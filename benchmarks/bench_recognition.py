@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the shared recognition engine and the servers built on it.
+
+Generates synthetic galleries and group images with drawn faces, drives detection and
+matching directly (no HTTP), and reports throughput, p50/p99 latency and
+peak RSS per case as JSON. Each case runs in a fresh process so peak RSS
+is measured per case.
+
+    python benchmarks/bench_recognition.py --profile quick --output results.json
+    python benchmarks/bench_recognition.py --baseline results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMON_DIR = os.path.join(ROOT_DIR, "common")
+FLASK_DIR = os.path.join(ROOT_DIR, "python-server")
+
+RESOLUTIONS = {
+    "vga": (640, 480),
+    "hd": (1280, 720),
+    "fhd": (1920, 1080),
+    "4k": (3840, 2160),
+}
+
+PROFILES = {
+    "quick": {"galleries": [1000], "resolutions": ["vga", "hd"], "faces": [10]},
+    "full": {"galleries": [1000, 10000, 100000], "resolutions": ["vga", "hd", "fhd", "4k"], "faces": [10, 50]},
+}
+
+# Faces drawn into each group image, sized as a fraction of the image height
+GROUP_FACES = 10
+FACE_SIZE_RANGE = (0.12, 0.18)
+
+
+def build_cases(profile):
+    """List the benchmark cases for a profile."""
+    config = PROFILES[profile]
+    cases = []
+    for resolution in config["resolutions"]:
+        cases.append({"name": f"detect[{resolution}]", "kind": "detect", "resolution": resolution})
+        # Detection narrowed to the drawn face sizes, as detect_for() learns them on a fixed camera
+        cases.append({"name": f"detect_narrowed[{resolution}]", "kind": "detect_narrowed", "resolution": resolution})
+    for faces in config["faces"]:
+        cases.append({"name": f"encode[faces={faces}]", "kind": "encode", "faces": faces})
+    for gallery_size in config["galleries"]:
+        for faces in config["faces"]:
+            cases.append({"name": f"match[gallery={gallery_size},faces={faces}]", "kind": "match",
+                          "gallery": gallery_size, "faces": faces})
+        for resolution in config["resolutions"]:
+            cases.append({"name": f"flask_recognize[{resolution},gallery={gallery_size}]", "kind": "flask_recognize",
+                          "resolution": resolution, "gallery": gallery_size})
+    return cases
+
+
+def face_size_range(resolution):
+    """Smallest and largest face drawn into a group image of this resolution, in pixels."""
+    height = RESOLUTIONS[resolution][1]
+    return int(height * FACE_SIZE_RANGE[0]), int(height * FACE_SIZE_RANGE[1])
+
+
+def synthetic_face(seed, size):
+    """A drawn face the Haar cascade detects; the same seed draws the same person at any size.
+
+    Faces share one layout, so the person is told apart by the shading of the
+    hair and background around the face, which falls inside the detected box.
+    """
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    side = 200
+    surround = cv2.resize(rng.normal(0, 60, (5, 5)).astype(np.float32), (side, side), interpolation=cv2.INTER_CUBIC)
+    face = np.repeat(np.clip(170 + surround, 0, 255)[..., None], 3, axis=2)
+    center = side // 2
+    cv2.ellipse(face, (center, center), (int(side * .38), int(side * .48)), 0, 0, 360, (150, 170, 200), -1)
+    for side_sign in (-1, 1):
+        cv2.ellipse(face, (int(center + side_sign * side * .16), int(side * .40)), (int(side * .08), int(side * .04)),
+                    0, 0, 360, (30, 30, 30), -1)
+        cv2.line(face, (int(center + side_sign * side * .08), int(side * .32)),
+                 (int(center + side_sign * side * .26), int(side * .32)), (40, 40, 40), 5)
+    cv2.ellipse(face, (center, int(side * .72)), (int(side * .14), int(side * .05)), 0, 0, 360, (60, 60, 120), -1)
+    cv2.line(face, (center, int(side * .45)), (center, int(side * .6)), (100, 110, 140), 3)
+    face = cv2.GaussianBlur(face.astype(np.uint8), (5, 5), 0)
+    return cv2.resize(face, (size, size), interpolation=cv2.INTER_AREA)
+
+
+def synthetic_image(rng, resolution, faces=GROUP_FACES):
+    """A BGR group image: smooth gradients plus noise, with faces drawn on a jittered grid."""
+    import numpy as np
+
+    width, height = RESOLUTIONS[resolution]
+    y, x = np.mgrid[0:height, 0:width]
+    base = (x / width * 120 + y / height * 80)[..., None] + rng.normal(0, 25, (height, width, 3))
+    image = np.clip(base, 0, 255).astype(np.uint8)
+
+    columns = max(1, int(np.ceil(np.sqrt(faces * width / height))))
+    rows = max(1, int(np.ceil(faces / columns)))
+    cell_width, cell_height = width // columns, height // rows
+    smallest, largest = face_size_range(resolution)
+    for i in range(faces):
+        size = min(int(rng.integers(smallest, largest + 1)), cell_width, cell_height)
+        left = (i % columns) * cell_width + int(rng.integers(0, cell_width - size + 1))
+        top = (i // columns) * cell_height + int(rng.integers(0, cell_height - size + 1))
+        image[top:top + size, left:left + size] = synthetic_face(int(rng.integers(1 << 31)), size)
+    return image
+
+
+def _measure(fn, min_iterations, min_seconds):
+    """Call fn until both limits are reached and return per-call latencies in seconds."""
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < min_iterations or time.perf_counter() - start < min_seconds:
+        call_start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - call_start)
+        # Cap very slow cases so the full profile stays bounded
+        if time.perf_counter() - start > min_seconds * 10 and len(latencies) >= 3:
+            break
+    return latencies
+
+
+def _percentile(values, percentile):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _setup_flask(work_dir):
+    # Use the SQLite stand-in so no request reaches Supabase
+    os.environ["DATABASE_BACKEND"] = "local"
+    os.environ["SERVER_TIMING"] = "false"
+    # Benchmarks time cold paths themselves; no background warm-up
+    os.environ["WARMUP"] = "false"
+    os.chdir(work_dir)
+    sys.path.insert(0, FLASK_DIR)
+
+
+def run_case(case, seed, min_iterations, min_seconds):
+    """Run one case (in a child process) and return its result dict."""
+    import numpy as np
+
+    # Keep server start-up logging out of the JSON written to stdout
+    sys.stdout = sys.stderr
+    rng = np.random.default_rng(seed)
+    np.random.seed(seed)
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    kind = case["kind"]
+
+    if kind == "detect":
+        sys.path.insert(0, COMMON_DIR)
+        import recognition
+
+        image = synthetic_image(rng, case["resolution"])
+        fn = lambda: recognition.detect(image)
+        units = 1
+
+    elif kind == "detect_narrowed":
+        sys.path.insert(0, COMMON_DIR)
+        import recognition
+
+        image = synthetic_image(rng, case["resolution"])
+        smallest, largest = face_size_range(case["resolution"])
+        fn = lambda: recognition.detect_in_range(image, int(smallest / recognition.ADAPTIVE_MARGIN),
+                                                 int(largest * recognition.ADAPTIVE_MARGIN))
+        units = 1
+
+    elif kind == "encode":
+        sys.path.insert(0, COMMON_DIR)
+        import recognition
+
+        image = synthetic_image(rng, "fhd")
+        width, height = RESOLUTIONS["fhd"]
+        sizes = rng.integers(60, 200, case["faces"])
+        boxes = [(int(rng.integers(0, width - size)), int(rng.integers(0, height - size)), int(size), int(size))
+                 for size in sizes]
+        fn = lambda: recognition.query(image, boxes)
+        units = case["faces"]
+
+    elif kind == "match":
+        sys.path.insert(0, COMMON_DIR)
+        import recognition
+
+        gallery = recognition.Gallery()
+        gallery.extend((f"S{i}", encoding, None) for i, encoding in
+                       enumerate(rng.integers(0, 256, (case["gallery"], recognition.ENCODING_SIZE), dtype=np.uint8)))
+        query = recognition.normalize(rng.integers(0, 256, (case["faces"], recognition.ENCODING_SIZE), dtype=np.uint8))
+        fn = lambda: gallery.match_batch(query, normalized=True)
+        units = case["faces"]
+
+    elif kind == "flask_recognize":
+        _setup_flask(work_dir)
+        import cv2
+        import app
+
+        gallery = {
+            "encodings": list(rng.integers(0, 256, (case["gallery"], 150 * 150), dtype=np.uint8)),
+            "names": [f"Student {i}" for i in range(case["gallery"])],
+            "student_ids": [f"S{i}" for i in range(case["gallery"])],
+        }
+        app.sb.get_all_face_encodings = lambda: gallery
+        image_path = os.path.join(work_dir, "group.jpg")
+        cv2.imwrite(image_path, synthetic_image(rng, case["resolution"]))
+        fn = lambda: app.recognize_faces(image_path)
+        units = 1
+
+    else:
+        raise ValueError(f"Unknown benchmark kind: {kind}")
+
+    fn()  # Warm-up: lazy imports, cascade loading, allocator
+    latencies = _measure(fn, min_iterations, min_seconds)
+    total = sum(latencies)
+    return {
+        "iterations": len(latencies),
+        "throughput_per_s": len(latencies) * units / total if total else None,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "mean_ms": total / len(latencies) * 1000,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def run_benchmarks(profile, seed, min_iterations, min_seconds, only=None):
+    results = {}
+    context = get_context("spawn")
+    for case in build_cases(profile):
+        if only and only not in case["name"]:
+            continue
+        print(f"Running {case['name']}...", file=sys.stderr)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            try:
+                results[case["name"]] = executor.submit(run_case, case, seed, min_iterations, min_seconds).result()
+            except Exception as e:
+                print(f"  failed: {e}", file=sys.stderr)
+                results[case["name"]] = {"error": str(e)}
+    return {
+        "meta": {
+            "profile": profile,
+            "seed": seed,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold, out=None):
+    """Print a comparison against a baseline run to out and return the names of regressed cases.
+
+    The table goes to stderr by default so stdout stays parseable JSON. A metric
+    missing (None) from either run is shown as "-" and not compared.
+    """
+    out = out or sys.stderr
+    regressions = []
+    print(f"{'case':<50} {'p50 ms':>18} {'p99 ms':>18} {'throughput/s':>22}", file=out)
+    for name, result in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base or "error" in result or "error" in base:
+            continue
+
+        def values(key):
+            return base.get(key), result.get(key)
+
+        def cell(key):
+            before, after = values(key)
+            return "-" if before is None or after is None else f"{before:.2f}->{after:.2f}"
+
+        def slower(key, higher_is_better=False):
+            before, after = values(key)
+            if before is None or after is None:
+                return False
+            if higher_is_better:
+                return after < before * (1 - threshold)
+            return after > before * (1 + threshold)
+
+        regressed = slower("p50_ms") or slower("p99_ms") or slower("throughput_per_s", higher_is_better=True)
+        marker = "  REGRESSION" if regressed else ""
+        print(f"{name:<50} {cell('p50_ms'):>18} {cell('p99_ms'):>18} {cell('throughput_per_s'):>22}{marker}",
+              file=out)
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the face recognition pipelines.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--only", help="Only run cases whose name contains this string")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--min-iterations", type=int, default=20)
+    parser.add_argument("--min-seconds", type=float, default=1.0)
+    parser.add_argument("--output", help="Write results JSON to this file (default: stdout)")
+    parser.add_argument("--baseline", help="Compare against a previous results JSON file")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown that counts as a regression (default: 0.10)")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.profile, args.seed, args.min_iterations, args.min_seconds, args.only)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} case(s) regressed by more than {args.threshold:.0%}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
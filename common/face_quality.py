@@ -0,0 +1,93 @@
+"""
+Cheap per-face quality checks run before encoding and matching.
+
+Faces that are too small, blurry, badly exposed or cut off by the frame edge
+rarely produce a usable match, so they are rejected with reasons
+instead of being encoded and compared against the whole gallery. Enrollment
+uses stricter limits, since a poor enrollment photo hurts every later match.
+"""
+
+import os
+from typing import Dict, List, Sequence
+
+# Disable the gate entirely with QUALITY_GATE=false
+QUALITY_GATE_ENABLED = os.environ.get("QUALITY_GATE", "true").lower() in ("1", "true", "yes")
+
+# Sharpness is measured on crops resized to this size so it doesn't depend on face size
+_SAMPLE_SIZE = 96
+
+RECOGNITION = {
+    "min_size": int(os.environ.get("QUALITY_MIN_FACE_SIZE", "40")),
+    "min_sharpness": float(os.environ.get("QUALITY_MIN_SHARPNESS", "20")),
+    "min_brightness": 40.0,
+    "max_brightness": 220.0,
+    "min_contrast": 15.0,
+    "allow_truncated": True,
+}
+
+ENROLLMENT = dict(
+    RECOGNITION,
+    min_size=int(os.environ.get("QUALITY_MIN_ENROLL_FACE_SIZE", "80")),
+    min_sharpness=2 * RECOGNITION["min_sharpness"],
+    min_contrast=20.0,
+    allow_truncated=False,
+)
+
+REASON_MESSAGES = {
+    "too_small": "face is too small",
+    "blurry": "image is blurry",
+    "too_dark": "image is too dark",
+    "too_bright": "image is overexposed",
+    "low_contrast": "image has too little contrast",
+    "truncated": "face is cut off by the edge of the image",
+}
+
+
+def assess_face(gray, box: Sequence[int], limits: Dict = RECOGNITION) -> Dict:
+    """Check one face given a grayscale image and its (x, y, w, h) box.
+
+    Returns {"ok", "reasons", "sharpness", "brightness", "contrast", "size"}.
+    """
+    import cv2
+
+    x, y, w, h = (int(v) for v in box)
+    image_h, image_w = gray.shape[:2]
+    reasons: List[str] = []
+
+    if min(w, h) < limits["min_size"]:
+        reasons.append("too_small")
+    if not limits["allow_truncated"] and (x <= 0 or y <= 0 or x + w >= image_w or y + h >= image_h):
+        reasons.append("truncated")
+
+    crop = gray[max(y, 0):max(y + h, 0), max(x, 0):max(x + w, 0)]
+    if crop.size == 0:
+        return {"ok": False, "reasons": reasons or ["too_small"], "sharpness": 0.0,
+                "brightness": 0.0, "contrast": 0.0, "size": min(w, h)}
+
+    sample = cv2.resize(crop, (_SAMPLE_SIZE, _SAMPLE_SIZE), interpolation=cv2.INTER_AREA)
+    sharpness = float(cv2.Laplacian(sample, cv2.CV_64F).var())
+    brightness = float(sample.mean())
+    contrast = float(sample.std())
+
+    if sharpness < limits["min_sharpness"]:
+        reasons.append("blurry")
+    if brightness < limits["min_brightness"]:
+        reasons.append("too_dark")
+    elif brightness > limits["max_brightness"]:
+        reasons.append("too_bright")
+    if contrast < limits["min_contrast"]:
+        reasons.append("low_contrast")
+
+    return {
+        "ok": not reasons or not QUALITY_GATE_ENABLED,
+        "reasons": reasons,
+        "sharpness": round(sharpness, 1),
+        "brightness": round(brightness, 1),
+        "contrast": round(contrast, 1),
+        "size": min(w, h),
+    }
+
+
+def describe(reasons: Sequence[str]) -> str:
+    """Human-readable summary of reject reasons for error messages."""
+    return ", ".join(REASON_MESSAGES.get(reason, reason) for reason in reasons)
@@ -0,0 +1,149 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# Latency buckets in seconds, from a cached lookup up to a slow cold request
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Buckets for the number of faces found in one image
+FACE_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 40, 80)
+
+_lock = threading.Lock()
+_histograms: Dict[str, "Histogram"] = {}
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_gauges: Dict[str, float] = {}
+_help: Dict[str, str] = {}
+
+# Stage timings of the request currently being handled, for the Server-Timing header
+_request_timings: contextvars.ContextVar = contextvars.ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus exposition format, one series per label value."""
+
+    def __init__(self, name: str, help_text: str, buckets, label: Optional[str] = None):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.label = label
+        self.series: Dict[str, List[float]] = {}
+        _help[name] = help_text
+
+    def observe(self, value: float, label_value: str = "") -> None:
+        with _lock:
+            series = self.series.get(label_value)
+            if series is None:
+                # One slot per bucket plus +Inf, then sum
+                series = self.series[label_value] = [0.0] * (len(self.buckets) + 2)
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {_help[self.name]}", f"# TYPE {self.name} histogram"]
+        for label_value, series in sorted(self.series.items()):
+            prefix = f'{self.label}="{label_value}",' if self.label else ""
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative:g}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative:g}')
+            labels = f"{{{prefix.rstrip(',')}}}" if prefix else ""
+            lines.append(f"{self.name}_sum{labels} {series[-1]:g}")
+            lines.append(f"{self.name}_count{labels} {cumulative:g}")
+        return lines
+
+
+def histogram(name: str, help_text: str, buckets=LATENCY_BUCKETS, label: Optional[str] = None) -> Histogram:
+    """Return the histogram registered under name, creating it on first use."""
+    with _lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram(name, help_text, buckets, label)
+        return _histograms[name]
+
+
+STAGE_SECONDS = histogram("face_api_stage_seconds", "Time spent in each pipeline stage.", label="stage")
+REQUEST_SECONDS = histogram("face_api_request_seconds", "End-to-end request latency.", label="path")
+FACES_PER_REQUEST = histogram("face_api_faces_per_request", "Faces detected per image.", FACE_COUNT_BUCKETS)
+
+
+def inc(name: str, help_text: str, amount: float = 1, **labels) -> None:
+    """Increment a counter."""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _help.setdefault(name, help_text)
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name: str, help_text: str, value: float) -> None:
+    """Set a gauge to value."""
+    with _lock:
+        _help.setdefault(name, help_text)
+        _gauges[name] = value
+
+
+def cache_hit(cache: str) -> None:
+    inc("face_api_cache_requests_total", "Cache lookups by cache and result.", cache=cache, result="hit")
+
+
+def cache_miss(cache: str) -> None:
+    inc("face_api_cache_requests_total", "Cache lookups by cache and result.", cache=cache, result="miss")
+
+
+@contextmanager
+def timer(stage: str):
+    """Time a pipeline stage, recording it in the stage histogram and the current request's timings."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def start_request() -> Dict[str, float]:
+    """Begin collecting stage timings for the current request."""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    """Format stage timings as a Server-Timing header value (durations in milliseconds)."""
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def render() -> str:
+    """Render all metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    with _lock:
+        histograms = list(_histograms.values())
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+
+    for hist in histograms:
+        if hist.series:
+            lines.extend(hist.render())
+
+    seen = set()
+    for (name, labels), value in counters:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} counter")
+        label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+        lines.append(f"{name}{{{label_text}}} {value:g}" if label_text else f"{name} {value:g}")
+
+    for name, value in gauges:
+        lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value:g}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,335 @@
+"""
+Face recognition engine shared by the FastAPI and Flask servers.
+
+    boxes = detect(image)               # (x, y, w, h) per face
+    encodings = encode(image, boxes)    # one row per face, for storage
+    matches = gallery.match_batch(query(image, boxes), normalized=True)
+
+Detection uses OpenCV's Haar cascade, an encoding is the face cropped and
+resized to a CROP_SIZE x CROP_SIZE grayscale image, and faces are compared
+by normalized cross-correlation. The Gallery keeps every enrolled encoding
+normalized in one matrix, so matching all faces of a photo against all
+students is a single matrix product.
+
+A fixed classroom camera sees faces in a narrow size range. detect_for()
+learns that range per camera from its full-range passes and searches only
+it, on a downscaled frame. A periodic full-range pass, and one whenever the
+narrowed search finds fewer faces than the last full pass did, catch faces
+outside it.
+
+Both servers import this module from common/.
+"""
+
+import math
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import metrics
+
+SCALE_FACTOR = float(os.environ.get("DETECT_SCALE_FACTOR", "1.1"))
+MIN_NEIGHBORS = int(os.environ.get("DETECT_MIN_NEIGHBORS", "5"))
+MIN_FACE_SIZE = int(os.environ.get("DETECT_MIN_FACE_SIZE", "30"))
+# Minimum similarity for a face to count as a match
+MATCH_THRESHOLD = float(os.environ.get("MATCH_THRESHOLD", "0.5"))
+
+# Per-camera detection narrowed to the face sizes the camera usually sees
+ADAPTIVE_DETECTION = os.environ.get("ADAPTIVE_DETECTION", "true").lower() in ("1", "true", "yes")
+# Faces a camera must have produced before its search range is narrowed
+ADAPTIVE_MIN_SAMPLES = int(os.environ.get("ADAPTIVE_MIN_SAMPLES", "20"))
+# Every Nth frame of a camera searches the full range to pick up faces outside the learned one
+ADAPTIVE_FULL_PASS_INTERVAL = int(os.environ.get("ADAPTIVE_FULL_PASS_INTERVAL", "10"))
+# The learned range is widened by this factor on each side
+ADAPTIVE_MARGIN = 1.3
+# Narrowed passes downscale the frame so the smallest expected face is about this size
+ADAPTIVE_TARGET_FACE_SIZE = 48
+# Face sizes remembered per camera, and cameras remembered
+ADAPTIVE_WINDOW = 200
+ADAPTIVE_MAX_CAMERAS = 256
+
+CROP_SIZE = 150
+ENCODING_SIZE = CROP_SIZE * CROP_SIZE
+
+Box = Tuple[int, int, int, int]
+
+# detectMultiScale isn't thread-safe, so each thread builds its own cascade
+_local = threading.local()
+
+
+def get_face_cascade():
+    """Per-thread Haar cascade, built on first use."""
+    cascade = getattr(_local, "face_cascade", None)
+    if cascade is None:
+        import cv2
+
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+        if cascade.empty():
+            raise RuntimeError("Could not load face cascade classifier")
+        _local.face_cascade = cascade
+    return cascade
+
+
+def to_gray(image):
+    """Grayscale version of a BGR image; grayscale images are returned as they are."""
+    import cv2
+
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def detect(image) -> List[Box]:
+    """Find faces in a BGR or grayscale image, as (x, y, w, h) boxes."""
+    faces = get_face_cascade().detectMultiScale(
+        to_gray(image), scaleFactor=SCALE_FACTOR, minNeighbors=MIN_NEIGHBORS,
+        minSize=(MIN_FACE_SIZE, MIN_FACE_SIZE))
+    return [tuple(int(v) for v in face) for face in faces]
+
+
+def detect_in_range(image, min_size: int, max_size: int) -> List[Box]:
+    """Find faces between min_size and max_size pixels wide, as (x, y, w, h) boxes.
+
+    The frame is downscaled so min_size becomes ADAPTIVE_TARGET_FACE_SIZE, and the
+    cascade skips pyramid levels outside the range, so a narrow range is much
+    cheaper than detect().
+    """
+    import cv2
+
+    gray = to_gray(image)
+    scale = min(1.0, ADAPTIVE_TARGET_FACE_SIZE / min_size)
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    low = max(int(min_size * scale), 1)
+    high = max(int(math.ceil(max_size * scale)), low + 1)
+    faces = get_face_cascade().detectMultiScale(
+        gray, scaleFactor=SCALE_FACTOR, minNeighbors=MIN_NEIGHBORS, minSize=(low, low), maxSize=(high, high))
+    return [tuple(int(round(v / scale)) for v in face) for face in faces]
+
+
+class AdaptiveDetector:
+    """Face detection for one camera that learns the face sizes the camera sees.
+
+    Only full-range passes feed the learned sizes: a narrowed pass can't see
+    faces outside the range, so learning from it would only ever shrink it.
+    """
+
+    def __init__(self):
+        self._sizes: deque = deque(maxlen=ADAPTIVE_WINDOW)
+        self._frames = 0
+        # Faces found by the last full-range pass
+        self._expected_faces = 0
+        self._lock = threading.Lock()
+
+    def size_range(self) -> Optional[Tuple[int, int]]:
+        """(min, max) face size to search, or None until enough faces have been seen."""
+        with self._lock:
+            sizes = list(self._sizes)
+        if len(sizes) < ADAPTIVE_MIN_SAMPLES:
+            return None
+        low, high = np.percentile(sizes, [5, 95])
+        return max(MIN_FACE_SIZE, int(low / ADAPTIVE_MARGIN)), int(math.ceil(high * ADAPTIVE_MARGIN))
+
+    def detect(self, image) -> List[Box]:
+        with self._lock:
+            self._frames += 1
+            full_pass = ADAPTIVE_FULL_PASS_INTERVAL > 0 and self._frames % ADAPTIVE_FULL_PASS_INTERVAL == 0
+            expected_faces = self._expected_faces
+        size_range = None if full_pass else self.size_range()
+
+        if size_range is not None:
+            boxes = detect_in_range(image, *size_range)
+            if boxes and len(boxes) >= expected_faces:
+                metrics.inc("face_api_detect_passes_total", "Detection passes by search range.", search="narrowed")
+                return boxes
+        # Still learning, due for a full pass, or fewer faces in the usual range than
+        # the last full pass found (faces moved out of it, or the camera moved):
+        # search every size
+        boxes = detect(image)
+        search = "full" if size_range is None else "fallback"
+        metrics.inc("face_api_detect_passes_total", "Detection passes by search range.", search=search)
+
+        with self._lock:
+            self._sizes.extend(max(w, h) for _, _, w, h in boxes)
+            self._expected_faces = len(boxes)
+        return boxes
+
+
+_detectors: "OrderedDict[str, AdaptiveDetector]" = OrderedDict()
+_detectors_lock = threading.Lock()
+
+
+def detect_for(camera: Optional[str], image) -> List[Box]:
+    """detect(), narrowed to the face sizes this camera usually sees.
+
+    camera is any stable id of the capturing device or session; without one (or
+    with ADAPTIVE_DETECTION=false) this is plain detect().
+    """
+    if not ADAPTIVE_DETECTION or not camera:
+        return detect(image)
+    with _detectors_lock:
+        detector = _detectors.pop(camera, None) or AdaptiveDetector()
+        _detectors[camera] = detector
+        while len(_detectors) > ADAPTIVE_MAX_CAMERAS:
+            _detectors.popitem(last=False)
+    return detector.detect(image)
+
+
+def camera_size_range(camera: Optional[str]) -> Optional[Tuple[int, int]]:
+    """(min, max) face size detect_for() currently searches for camera, or None for every size."""
+    if not ADAPTIVE_DETECTION or not camera:
+        return None
+    with _detectors_lock:
+        detector = _detectors.get(camera)
+    return detector.size_range() if detector is not None else None
+
+
+def to_locations(boxes: Sequence[Box]) -> List[Tuple[int, int, int, int]]:
+    """Convert (x, y, w, h) boxes to (top, right, bottom, left) locations."""
+    return [(y, x + w, y + h, x) for x, y, w, h in boxes]
+
+
+def encode(image, boxes: Sequence[Box]) -> np.ndarray:
+    """Encode each face box of a BGR or grayscale image; returns a (faces, ENCODING_SIZE) uint8 array."""
+    import cv2
+
+    gray = to_gray(image)
+    # Every crop is resized straight into its slot of one preallocated batch
+    crops = np.empty((len(boxes), CROP_SIZE, CROP_SIZE), dtype=np.uint8)
+    for i, (x, y, w, h) in enumerate(boxes):
+        cv2.resize(gray[max(y, 0):y + h, max(x, 0):x + w], (CROP_SIZE, CROP_SIZE), dst=crops[i])
+    return crops.reshape(len(boxes), ENCODING_SIZE)
+
+
+def query(image, boxes: Sequence[Box]) -> np.ndarray:
+    """Encode and normalize every face box at once, ready for match_batch(..., normalized=True)."""
+    return normalize(encode(image, boxes))
+
+
+def normalize(encodings) -> np.ndarray:
+    """Zero-mean, unit-length float32 rows for one encoding or a batch, so the dot
+    product of two rows is their normalized cross-correlation.
+
+    Encodings stored at another crop size are resized; anything that isn't a
+    square crop raises ValueError.
+    """
+    # One float32 copy, normalized in place
+    batch = np.array(encodings, dtype=np.float32)
+    batch = batch.reshape(1 if batch.ndim == 1 else len(batch), int(np.prod(batch.shape[batch.ndim > 1:])))
+    if batch.shape[1] != ENCODING_SIZE:
+        batch = _resize_crops(batch)
+    batch -= batch.mean(axis=1, keepdims=True)
+    norms = np.sqrt(np.einsum("ij,ij->i", batch, batch))[:, None]
+    # A flat crop is all zeros after centering and correlates with nothing
+    np.divide(batch, norms, out=batch, where=norms > 0)
+    return batch
+
+
+def _resize_crops(batch: np.ndarray) -> np.ndarray:
+    import cv2
+
+    side = math.isqrt(batch.shape[1])
+    if side * side != batch.shape[1] or side == 0:
+        raise ValueError(f"Unsupported encoding with {batch.shape[1]} values (expected a square "
+                         f"grayscale crop); re-encode the gallery")
+    return np.stack([cv2.resize(row.reshape(side, side), (CROP_SIZE, CROP_SIZE)).reshape(-1)
+                     for row in batch])
+
+
+class Gallery:
+    """Enrolled faces as one matrix of normalized encodings.
+
+    Writers build a new matrix and swap it in, so match_batch never waits on
+    a lock and never sees a half-updated gallery.
+    """
+
+    def __init__(self, threshold: float = MATCH_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        # (matrix, ids, info, position by id), replaced as a whole on every change
+        self._state: Tuple[np.ndarray, List[str], List[Dict], Dict[str, int]] = (
+            np.empty((0, ENCODING_SIZE), dtype=np.float32), [], [], {})
+
+    @classmethod
+    def from_normalized(cls, matrix: np.ndarray, ids: Sequence[str], info: Optional[Sequence[Dict]] = None,
+                        threshold: float = MATCH_THRESHOLD) -> "Gallery":
+        """Wrap rows already passed through normalize(), e.g. a shared-memory matrix, without copying them."""
+        gallery = cls(threshold)
+        if len(ids):
+            ids = list(ids)
+            gallery._state = (matrix, ids, list(info) if info is not None else [{} for _ in ids],
+                              {face_id: i for i, face_id in enumerate(ids)})
+        return gallery
+
+    def __len__(self) -> int:
+        return len(self._state[1])
+
+    def __contains__(self, face_id: str) -> bool:
+        return face_id in self._state[3]
+
+    def add(self, face_id: str, encoding, info: Optional[Dict] = None) -> None:
+        """Add a face, replacing any earlier encoding with the same id."""
+        self.extend([(face_id, encoding, info)])
+
+    def extend(self, faces: Iterable[Tuple[str, object, Optional[Dict]]]) -> None:
+        """Add many (id, encoding, info) faces at once."""
+        faces = list(faces)
+        if not faces:
+            return
+        rows = normalize([encoding for _, encoding, _ in faces])
+        with self._lock:
+            matrix, ids, infos, positions = self._state
+            ids, infos, positions = list(ids), list(infos), dict(positions)
+            new_rows, replaced = [], {}
+            for (face_id, _, info), row in zip(faces, rows):
+                if face_id in positions:
+                    replaced[positions[face_id]] = row
+                    infos[positions[face_id]] = info or {}
+                else:
+                    positions[face_id] = len(ids)
+                    ids.append(face_id)
+                    infos.append(info or {})
+                    new_rows.append(row)
+            # Never write into the current matrix: readers may be using it
+            if new_rows:
+                matrix = np.vstack([matrix, np.asarray(new_rows, dtype=matrix.dtype)])
+            elif replaced:
+                matrix = matrix.copy()
+            for i, row in replaced.items():
+                matrix[i] = row
+            self._state = (matrix, ids, infos, positions)
+
+    def remove(self, face_id: str) -> bool:
+        """Remove a face; returns whether it was enrolled."""
+        with self._lock:
+            matrix, ids, infos, positions = self._state
+            if face_id not in positions:
+                return False
+            i = positions[face_id]
+            ids = ids[:i] + ids[i + 1:]
+            self._state = (np.delete(matrix, i, axis=0), ids, infos[:i] + infos[i + 1:],
+                           {other: j for j, other in enumerate(ids)})
+            return True
+
+    def match_batch(self, encodings, threshold: Optional[float] = None,
+                    normalized: bool = False) -> List[Optional[Dict]]:
+        """Best match for each encoding as {"id", "info", "similarity"}, or None below the threshold.
+
+        Pass normalized=True for rows from query() or normalize().
+        """
+        threshold = self.threshold if threshold is None else threshold
+        if len(encodings) == 0:
+            return []
+        matrix, ids, infos, _ = self._state
+        if not ids:
+            return [None] * len(encodings)
+
+        probes = encodings if normalized else normalize(encodings)
+        similarities = np.asarray(probes, dtype=matrix.dtype) @ matrix.T
+        best = similarities.argmax(axis=1)
+        matches: List[Optional[Dict]] = []
+        for row, index in enumerate(best):
+            similarity = float(similarities[row, index])
+            matches.append({"id": ids[index], "info": infos[index], "similarity": similarity}
+                           if similarity > threshold else None)
+        return matches
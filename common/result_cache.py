@@ -0,0 +1,67 @@
+"""
+Bounded LRU/TTL cache of recognition results keyed by image content.
+
+Keys combine a hash of the submitted image bytes with the gallery generation
+and any parameters that affect the result, so a new enrollment or re-encoding
+(which bumps the generation) never serves a stale match.
+"""
+
+import copy
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import metrics
+
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", "120"))
+
+
+def make_key(image_bytes: bytes, generation: Any, **params: Any) -> str:
+    """Cache key for an image submitted against a gallery generation with the given parameters."""
+    digest = hashlib.blake2b(image_bytes, digest_size=20)
+    digest.update(repr((generation, sorted(params.items()))).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, name: str, max_entries: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a copy of the cached value, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                metrics.cache_miss(self.name)
+                return None
+            self._entries.move_to_end(key)
+        metrics.cache_hit(self.name)
+        # Callers may annotate the result; keep the cached copy pristine
+        return copy.deepcopy(entry[1])
+
+    def put(self, key: str, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
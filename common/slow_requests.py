@@ -0,0 +1,391 @@
+"""
+Capture of slow recognition requests for offline replay.
+
+With SLOW_REQUEST_CAPTURE=true, requests to the recognition routes run under
+cProfile, and any request taking longer than SLOW_REQUEST_THRESHOLD seconds
+is saved to a ring buffer directory. The newest SLOW_REQUEST_MAX_CAPTURES are
+kept. Each capture is one folder holding:
+
+- the submitted image, its form fields, the gallery generation and size, the
+  detection settings and the face size range searched for the request's camera;
+- the stage timings and the status (request.json, image);
+- the profile (profile.prof, readable with pstats).
+
+Only one request is profiled at a time; requests running alongside it are
+captured with their timings but without a profile. cProfile follows a thread.
+The Flask server profiles the request's thread. The FastAPI server runs a
+request's recognition work on a worker thread through run_profiled and
+profiles only that (profile_scope "worker thread"), since the event loop
+thread is shared by every request.
+
+The CLI replays captures against the current code. It runs decode, detect,
+quality, encode and match again on the captured image, searching the face
+sizes the live detector searched, against a synthetic gallery of the captured
+size, and prints the stage timings next to the
+captured ones. Network stages (upload, session, persist) are not replayed.
+
+    python slow_requests.py list
+    python slow_requests.py show <capture>
+    python slow_requests.py replay [<capture> ...] [--repeat 3] [--profile]
+"""
+
+import argparse
+import base64
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import shutil
+import statistics
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+CAPTURE_ENABLED = os.environ.get("SLOW_REQUEST_CAPTURE", "false").lower() in ("1", "true", "yes")
+# Requests taking at least this many seconds are saved
+THRESHOLD = float(os.environ.get("SLOW_REQUEST_THRESHOLD", "1.0"))
+MAX_CAPTURES = int(os.environ.get("SLOW_REQUEST_MAX_CAPTURES", "50"))
+PROFILE_ENABLED = os.environ.get("SLOW_REQUEST_PROFILE", "true").lower() in ("1", "true", "yes")
+
+# Stages the replay runs again; the rest wait on the network or the database
+REPLAYED_STAGES = ("decode", "detect", "quality", "encode", "match")
+
+# Capture of the request currently being handled, filled in by the route handler
+_current: contextvars.ContextVar = contextvars.ContextVar("slow_request_capture", default=None)
+# cProfile can't run two profilers at once, so one request is profiled at a time
+_profile_lock = threading.Lock()
+
+
+class Capture:
+    """Input and profile of one request, kept until the request is known to be fast or slow."""
+
+    def __init__(self, path: str, profile_scope: str = "thread"):
+        self.path = path
+        self.profile_scope = profile_scope
+        self.image: Optional[bytes] = None
+        self.image_is_base64 = False
+        self.fields: Dict = {}
+        self.context: Dict = {}
+        self.profiler: Optional[cProfile.Profile] = None
+        self._profiling = False
+        if profile_scope != "worker thread":
+            self.start_profile()
+
+    def start_profile(self) -> bool:
+        """Profile the calling thread until stop(), unless another request is being profiled."""
+        if self._profiling or not PROFILE_ENABLED or not _profile_lock.acquire(blocking=False):
+            return False
+        profiler = self.profiler or cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiling tool (a debugger, py-spy in-process) is active
+            _profile_lock.release()
+            return False
+        self.profiler = profiler
+        self._profiling = True
+        return True
+
+    def stop(self) -> None:
+        """Stop profiling; safe to call more than once."""
+        if self._profiling:
+            self._profiling = False
+            self.profiler.disable()
+            _profile_lock.release()
+
+
+def start(path: str, profile_scope: str = "thread") -> Optional[Capture]:
+    """Begin capturing the current request, if capture is enabled.
+
+    profile_scope says what the profile covers: "thread" profiles the calling
+    thread from now on, for servers that give each request a thread. "worker
+    thread" profiles only the work the request runs through run_profiled.
+    """
+    if not CAPTURE_ENABLED:
+        return None
+    capture = Capture(path, profile_scope)
+    _current.set(capture)
+    return capture
+
+
+def run_profiled(fn, *args, **kwargs):
+    """Call fn, under the profiler if the current request is captured with profile_scope "worker thread".
+
+    Call it on the worker thread that runs a request's CPU work, so the profile
+    holds that work and nothing else running on the server.
+    """
+    capture = _current.get()
+    if capture is None or capture.profile_scope != "worker thread" or not capture.start_profile():
+        return fn(*args, **kwargs)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        capture.stop()
+
+
+def record_input(image: bytes, base64_encoded: bool = False, fields: Optional[Dict] = None, **context) -> None:
+    """Attach the submitted image and its parameters to the current request's capture.
+
+    context holds anything else needed to reproduce the request, e.g. the gallery
+    generation and size, and detect_range, the (min, max) face size searched (None
+    for every size). Does nothing unless the request is being captured.
+    """
+    capture = _current.get()
+    if capture is None:
+        return
+    capture.image = image
+    capture.image_is_base64 = base64_encoded
+    capture.fields = dict(fields or {})
+    capture.context = context
+
+
+def current_settings() -> Dict:
+    """Detection, matching and quality settings that affect the recognition stages."""
+    import face_quality
+    import recognition
+
+    return {
+        "scale_factor": recognition.SCALE_FACTOR,
+        "min_neighbors": recognition.MIN_NEIGHBORS,
+        "min_face_size": recognition.MIN_FACE_SIZE,
+        "adaptive_detection": recognition.ADAPTIVE_DETECTION,
+        "match_threshold": recognition.MATCH_THRESHOLD,
+        "quality_gate": face_quality.QUALITY_GATE_ENABLED,
+    }
+
+
+def finish(capture: Optional[Capture], buffer: "CaptureBuffer", timings: Dict[str, float],
+           total: float, status: int) -> Optional[str]:
+    """End a request's capture and save it if it was slow; returns the capture id if saved."""
+    if capture is None:
+        return None
+    capture.stop()
+    if total < THRESHOLD or capture.image is None:
+        return None
+    try:
+        image = base64.b64decode(capture.image) if capture.image_is_base64 else capture.image
+        capture_id = buffer.save({
+            "path": capture.path,
+            "status": status,
+            "total": total,
+            "timings": dict(timings),
+            "fields": capture.fields,
+            "context": capture.context,
+            "settings": current_settings(),
+            "profile_scope": capture.profile_scope,
+        }, image, capture.profiler)
+    except Exception as e:
+        print(f"Error saving slow request capture: {e}")
+        return None
+    metrics.inc("face_api_slow_requests_captured_total", "Slow requests saved for replay, by path.",
+                path=capture.path)
+    print(f"Captured slow request {capture.path} ({total * 1000:.0f} ms) as {capture_id}")
+    return capture_id
+
+
+class CaptureBuffer:
+    """Directory of the newest max_captures captures, one folder each, oldest removed first."""
+
+    def __init__(self, directory: str, max_captures: int = MAX_CAPTURES):
+        self.directory = directory
+        self.max_captures = max_captures
+
+    def save(self, record: Dict, image: bytes, profiler: Optional[cProfile.Profile] = None) -> str:
+        """Write one capture and evict the oldest beyond max_captures; returns its id."""
+        os.makedirs(self.directory, exist_ok=True)
+        # Ids sort by capture time, which is the eviction order
+        capture_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        record = dict(record, id=capture_id, captured_at=datetime.now().isoformat())
+
+        # Written under a temporary name and renamed, so readers never see a partial capture
+        tmp_dir = os.path.join(self.directory, f".tmp-{capture_id}")
+        os.makedirs(tmp_dir)
+        with open(os.path.join(tmp_dir, "image"), "wb") as f:
+            f.write(image)
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(tmp_dir, "profile.prof"))
+        with open(os.path.join(tmp_dir, "request.json"), "w") as f:
+            json.dump(record, f, indent=2)
+        os.rename(tmp_dir, os.path.join(self.directory, capture_id))
+
+        for old_id in self.ids()[:-self.max_captures]:
+            shutil.rmtree(os.path.join(self.directory, old_id), ignore_errors=True)
+        return capture_id
+
+    def ids(self) -> List[str]:
+        """Capture ids, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if not name.startswith("."))
+
+    def load(self, capture_id: str) -> Tuple[Dict, bytes]:
+        """The record and image of a capture."""
+        folder = os.path.join(self.directory, capture_id)
+        with open(os.path.join(folder, "request.json")) as f:
+            record = json.load(f)
+        with open(os.path.join(folder, "image"), "rb") as f:
+            return record, f.read()
+
+    def profile_path(self, capture_id: str) -> Optional[str]:
+        path = os.path.join(self.directory, capture_id, "profile.prof")
+        return path if os.path.exists(path) else None
+
+
+# Replay
+
+_synthetic_galleries: Dict[int, object] = {}
+
+
+def synthetic_gallery(size: int):
+    """A gallery of random encodings; matching cost depends only on the number of faces."""
+    import numpy as np
+    import recognition
+
+    if size not in _synthetic_galleries:
+        rng = np.random.default_rng(0)
+        encodings = rng.integers(0, 256, size=(size, recognition.ENCODING_SIZE), dtype=np.uint8)
+        ids = [f"synthetic_{i}" for i in range(size)]
+        _synthetic_galleries[size] = recognition.Gallery.from_normalized(recognition.normalize(encodings), ids)
+    return _synthetic_galleries[size]
+
+
+def replay_once(image: bytes, gallery, size_range: Optional[Tuple[int, int]] = None) -> Tuple[Dict[str, float], int]:
+    """Run the recognition stages on an image; returns (stage timings, faces matched).
+
+    With size_range, detection searches only those face sizes and falls back to every
+    size if it finds nothing, as adaptive detection does.
+    """
+    import cv2
+    import numpy as np
+    import face_quality
+    import recognition
+
+    timings = metrics.start_request()
+    with metrics.timer("decode"):
+        decoded = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+    if decoded is None:
+        raise ValueError("Captured image could not be decoded")
+    gray = recognition.to_gray(decoded)
+    with metrics.timer("detect"):
+        boxes = recognition.detect_in_range(gray, *size_range) if size_range else []
+        if not boxes:
+            boxes = recognition.detect(gray)
+    with metrics.timer("quality"):
+        boxes = [box for box in boxes if face_quality.assess_face(gray, box)["ok"]]
+    with metrics.timer("encode"):
+        query = recognition.query(gray, boxes)
+    with metrics.timer("match"):
+        gallery.match_batch(query, normalized=True)
+    return timings, len(boxes)
+
+
+def replay(record: Dict, image: bytes, repeat: int = 3,
+           profiler: Optional[cProfile.Profile] = None) -> Tuple[Dict[str, float], int]:
+    """Median stage timings of repeat replays of a capture, after one untimed warm-up run."""
+    context = record.get("context", {})
+    gallery = synthetic_gallery(int(context.get("gallery_size", 0)))
+    size_range = tuple(context["detect_range"]) if context.get("detect_range") else None
+    replay_once(image, gallery, size_range)
+    runs = []
+    for _ in range(max(repeat, 1)):
+        if profiler is not None:
+            profiler.enable()
+        try:
+            timings, faces = replay_once(image, gallery, size_range)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        runs.append(timings)
+    return {stage: statistics.median(run.get(stage, 0.0) for run in runs) for stage in runs[0]}, faces
+
+
+def _print_stats(source, limit: int) -> None:
+    output = io.StringIO()
+    pstats.Stats(source, stream=output).sort_stats("cumulative").print_stats(limit)
+    print(output.getvalue())
+
+
+def _print_replay(record: Dict, replayed: Dict[str, float], faces: int) -> None:
+    context = record.get("context", {})
+    print(f"{record['id']}  {record['path']}  status {record['status']}  "
+          f"captured {record['total'] * 1000:.1f} ms  gallery {context.get('gallery_size', '?')} faces "
+          f"(generation {context.get('gallery_generation', '?')})  {faces} face(s) matched in replay")
+    if context.get("detect_range"):
+        low, high = context["detect_range"]
+        print(f"  detection searched faces of {low}-{high} px (camera {context.get('camera')})")
+    settings = current_settings()
+    for name, value in record.get("settings", {}).items():
+        if settings.get(name) != value:
+            print(f"  setting {name} changed: {value} -> {settings.get(name)}")
+
+    print(f"  {'stage':<14}{'captured ms':>12}{'replay ms':>12}{'delta ms':>12}")
+    captured = record.get("timings", {})
+    for stage in list(REPLAYED_STAGES) + [s for s in captured if s not in REPLAYED_STAGES]:
+        before = captured.get(stage)
+        if stage not in replayed:
+            if before is not None:
+                print(f"  {stage:<14}{before * 1000:>12.1f}{'-':>12}{'not replayed':>14}")
+            continue
+        before_text = f"{before * 1000:.1f}" if before is not None else "-"
+        delta_text = f"{(replayed[stage] - before) * 1000:+.1f}" if before is not None else "-"
+        print(f"  {stage:<14}{before_text:>12}{replayed[stage] * 1000:>12.1f}{delta_text:>12}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List, inspect and replay captured slow requests.")
+    parser.add_argument("--dir", default=os.environ.get("SLOW_REQUEST_DIR", "slow_requests"),
+                        help="Capture directory (default: $SLOW_REQUEST_DIR or ./slow_requests)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List captures, oldest first")
+    show = commands.add_parser("show", help="Print a capture's record and its captured profile")
+    show.add_argument("capture")
+    show.add_argument("--limit", type=int, default=25, help="Profile rows to print (default: 25)")
+    replay_parser = commands.add_parser("replay", help="Replay captures against the current code")
+    replay_parser.add_argument("captures", nargs="*", help="Capture ids (default: all)")
+    replay_parser.add_argument("--repeat", type=int, default=3, help="Timed runs per capture (default: 3)")
+    replay_parser.add_argument("--profile", action="store_true", help="Print a profile of the replays")
+    replay_parser.add_argument("--limit", type=int, default=25, help="Profile rows to print (default: 25)")
+    args = parser.parse_args()
+
+    buffer = CaptureBuffer(args.dir)
+    if args.command == "list":
+        for capture_id in buffer.ids():
+            record, _ = buffer.load(capture_id)
+            timings = record.get("timings", {})
+            slowest = max(timings, key=timings.get) if timings else "-"
+            print(f"{capture_id}  {record['path']:<22} {record['status']}  {record['total'] * 1000:>8.1f} ms  "
+                  f"slowest: {slowest}")
+    elif args.command == "show":
+        record, image = buffer.load(args.capture)
+        print(json.dumps(record, indent=2))
+        print(f"image: {len(image)} bytes")
+        profile = buffer.profile_path(args.capture)
+        if profile:
+            # Written by FastAPI servers that still ran recognition on the event loop
+            if record.get("profile_scope") == "event loop":
+                print("Note: profiled on the event loop thread; it includes other requests that ran meanwhile")
+            _print_stats(profile, args.limit)
+        else:
+            print("No profile was captured for this request")
+    else:
+        profiler = cProfile.Profile() if args.profile else None
+        start = time.perf_counter()
+        capture_ids = args.captures or buffer.ids()
+        for capture_id in capture_ids:
+            record, image = buffer.load(capture_id)
+            replayed, faces = replay(record, image, args.repeat, profiler)
+            _print_replay(record, replayed, faces)
+        print(f"Replayed {len(capture_ids)} capture(s) in {time.perf_counter() - start:.1f}s")
+        if profiler is not None:
+            _print_stats(profiler, args.limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
 -- Drop existing tables with cascade to remove dependencies
+DROP TABLE IF EXISTS course_daily_sessions CASCADE;
+DROP TABLE IF EXISTS attendance_daily_counts CASCADE;
+DROP TABLE IF EXISTS gallery_settings CASCADE;
+DROP TABLE IF EXISTS student_face_encodings CASCADE;
 DROP TABLE IF EXISTS attendance_records CASCADE;
 DROP TABLE IF EXISTS attendance_sessions CASCADE;
 DROP TABLE IF EXISTS students CASCADE;
@@ -15,6 +19,7 @@ CREATE TABLE students (
     department VARCHAR,
     image_url VARCHAR,  -- URL to the student's image in Supabase Storage
     created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW()),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW()),  -- Drives Last-Modified on /api/students
     face_encoding BYTEA  -- Binary data for face encoding
 );
 
@@ -27,6 +32,7 @@ CREATE TABLE attendance_sessions (
     start_time TIME,
     end_time TIME,
     location VARCHAR,
+    present_count INTEGER NOT NULL DEFAULT 0,  -- Maintained by trigger on attendance_records
     created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW())
 );
 
@@ -44,4 +50,128 @@ CREATE TABLE attendance_records (
 
 -- Create index for faster queries
 CREATE INDEX idx_attendance_session ON attendance_records(session_id);
-CREATE INDEX idx_attendance_student ON attendance_records(student_id); 
\ No newline at end of file
+CREATE INDEX idx_attendance_student ON attendance_records(student_id);
+
+-- Re-encoded faces, one row per student per gallery version
+CREATE TABLE student_face_encodings (
+    student_id VARCHAR REFERENCES students(id) ON DELETE CASCADE,
+    version VARCHAR NOT NULL,
+    face_encoding BYTEA NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc', NOW()),
+    PRIMARY KEY (student_id, version)
+);
+
+-- Key/value settings, e.g. the active face encoding version
+CREATE TABLE gallery_settings (
+    key VARCHAR PRIMARY KEY,
+    value VARCHAR NOT NULL
+);
+
+-- Attendance summaries, maintained incrementally by the triggers below so the
+-- dashboard never has to aggregate raw attendance records
+CREATE TABLE attendance_daily_counts (
+    student_id VARCHAR REFERENCES students(id) ON DELETE CASCADE,
+    course VARCHAR NOT NULL,
+    date DATE NOT NULL,
+    present INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (student_id, course, date)
+);
+
+CREATE INDEX idx_daily_counts_course ON attendance_daily_counts(course, date);
+
+CREATE TABLE course_daily_sessions (
+    course VARCHAR NOT NULL,
+    date DATE NOT NULL,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (course, date)
+);
+
+CREATE OR REPLACE FUNCTION count_attendance_record() RETURNS TRIGGER AS $$
+DECLARE
+    session attendance_sessions%ROWTYPE;
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') AND OLD.status = 'present' THEN
+        SELECT * INTO session FROM attendance_sessions WHERE id = OLD.session_id;
+        UPDATE attendance_daily_counts SET present = present - 1
+            WHERE student_id = OLD.student_id AND course = session.course AND date = session.date;
+        UPDATE attendance_sessions SET present_count = present_count - 1 WHERE id = OLD.session_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'present' THEN
+        SELECT * INTO session FROM attendance_sessions WHERE id = NEW.session_id;
+        INSERT INTO attendance_daily_counts (student_id, course, date, present)
+            VALUES (NEW.student_id, session.course, session.date, 1)
+            ON CONFLICT (student_id, course, date) DO UPDATE SET present = attendance_daily_counts.present + 1;
+        UPDATE attendance_sessions SET present_count = present_count + 1 WHERE id = NEW.session_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER attendance_records_summary
+    AFTER INSERT OR DELETE OR UPDATE OF status ON attendance_records
+    FOR EACH ROW EXECUTE FUNCTION count_attendance_record();
+
+CREATE OR REPLACE FUNCTION count_attendance_session() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.course = NEW.course AND OLD.date = NEW.date THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE course_daily_sessions SET sessions = sessions - 1
+            WHERE course = OLD.course AND date = OLD.date;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO course_daily_sessions (course, date, sessions) VALUES (NEW.course, NEW.date, 1)
+            ON CONFLICT (course, date) DO UPDATE SET sessions = course_daily_sessions.sessions + 1;
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        -- Move the session's present students to the new course and date
+        UPDATE attendance_daily_counts SET present = present - 1
+            WHERE course = OLD.course AND date = OLD.date AND student_id IN (
+                SELECT student_id FROM attendance_records WHERE session_id = NEW.id AND status = 'present');
+        INSERT INTO attendance_daily_counts (student_id, course, date, present)
+            SELECT student_id, NEW.course, NEW.date, 1 FROM attendance_records
+                WHERE session_id = NEW.id AND status = 'present'
+            ON CONFLICT (student_id, course, date) DO UPDATE SET present = attendance_daily_counts.present + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER attendance_sessions_summary
+    AFTER INSERT OR DELETE OR UPDATE OF course, date ON attendance_sessions
+    FOR EACH ROW EXECUTE FUNCTION count_attendance_session();
+
+-- Backfill: rebuilds the summaries from existing sessions and records. It does
+-- nothing on a fresh install; run this block on its own when adding the
+-- summary tables and triggers to a database that already has attendance.
+BEGIN;
+LOCK TABLE attendance_sessions, attendance_records IN SHARE MODE;
+DELETE FROM attendance_daily_counts;
+INSERT INTO attendance_daily_counts (student_id, course, date, present)
+    SELECT r.student_id, s.course, s.date, COUNT(*)
+    FROM attendance_records r JOIN attendance_sessions s ON s.id = r.session_id
+    WHERE r.status = 'present'
+    GROUP BY r.student_id, s.course, s.date;
+DELETE FROM course_daily_sessions;
+INSERT INTO course_daily_sessions (course, date, sessions)
+    SELECT course, date, COUNT(*) FROM attendance_sessions GROUP BY course, date;
+UPDATE attendance_sessions SET present_count = (
+    SELECT COUNT(*) FROM attendance_records
+    WHERE session_id = attendance_sessions.id AND status = 'present');
+COMMIT;
+
+CREATE OR REPLACE FUNCTION set_updated_at() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = TIMEZONE('utc', NOW());
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER students_updated_at
+    BEFORE UPDATE ON students
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+-- Filters used by the paginated student listing
+CREATE INDEX idx_students_batch ON students(batch);
+CREATE INDEX idx_students_department ON students(department);
@@ -78,7 +78,8 @@ export async function detectFacesWithApi(input: HTMLCanvasElement | HTMLImageEle
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({ image: imageData })
+      // Only boxes are used here; skipping encodings keeps the response small
+      body: JSON.stringify({ image: imageData, include_encodings: false })
     });
     
     if (!response.ok) {
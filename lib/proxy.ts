@@ -0,0 +1,11 @@
+import { NextRequest } from "next/server";
+
+/**
+ * Headers that identify the browser to the Python backend, whose per-client rate
+ * limit would otherwise count every proxied request against this server's address.
+ * The backend only believes them from addresses listed in its TRUSTED_PROXIES.
+ */
+export function clientHeaders(req: NextRequest): Record<string, string> {
+  const forwardedFor = req.headers.get("x-forwarded-for") || req.headers.get("x-real-ip");
+  return forwardedFor ? { "x-forwarded-for": forwardedFor } : {};
+}
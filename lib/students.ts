@@ -0,0 +1,38 @@
+"use client"
+
+export interface StudentPage {
+  success?: boolean;
+  students: any[];
+  count: number;
+  next_cursor: string | null;
+}
+
+/**
+ * Fetch one page of students through the /api/students proxy.
+ * The browser cache revalidates pages with the ETag the backend sends.
+ */
+export async function getStudentPage(params: Record<string, string> = {}, cursor?: string | null): Promise<StudentPage> {
+  const query = new URLSearchParams(params);
+  if (cursor) {
+    query.set('cursor', cursor);
+  }
+  const response = await fetch(`/api/students?${query}`);
+  if (!response.ok) {
+    throw new Error(`HTTP error: ${response.status}`);
+  }
+  return response.json();
+}
+
+/**
+ * Fetch every student matching params, following next_cursor until the last page
+ */
+export async function getAllStudents(params: Record<string, string> = {}): Promise<any[]> {
+  const students: any[] = [];
+  let cursor: string | null = null;
+  do {
+    const page = await getStudentPage({ limit: '1000', ...params }, cursor);
+    students.push(...page.students);
+    cursor = page.next_cursor;
+  } while (cursor);
+  return students;
+}
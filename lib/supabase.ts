@@ -2,6 +2,7 @@
 
 import { createClientComponentClient } from '@supabase/auth-helpers-nextjs';
 import { AUTH_REDIRECT_URL, SUPABASE_URL, SUPABASE_ANON_KEY } from './config';
+import { getAllStudents } from './students';
 
 // Create a Supabase client for client components with explicit config
 export const supabase = createClientComponentClient({
@@ -20,14 +21,9 @@ const createConfiguredClient = () => {
 };
 
 // Students
+// Listed through the paginated backend API, page by page; face encodings are not included
 export async function getStudents() {
-  const supabase = createConfiguredClient();
-  const { data, error } = await supabase
-    .from('students')
-    .select('*');
-  
-  if (error) throw error;
-  return data;
+  return getAllStudents();
 }
 
 export async function getStudent(id: string) {
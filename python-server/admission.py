@@ -0,0 +1,175 @@
+"""
+Admission control for the expensive endpoints.
+
+Requests to recognition and registration routes pass three checks before
+reaching the handler:
+
+1. Body size: rejected with 413 from Content-Length, or by Werkzeug as soon
+   as the streamed body exceeds the route's limit.
+2. Per-client token bucket: a client (its remote address or, behind a
+   trusted proxy, the X-Session-Id / X-Client-Id / X-Forwarded-For headers
+   the proxy passes on) may send RATE_LIMIT_PER_MINUTE requests with
+   bursts of RATE_LIMIT_BURST; beyond that it gets 429.
+3. Global concurrency: at most MAX_CONCURRENT_REQUESTS run at once; a
+   request that can't start within QUEUE_TIMEOUT seconds gets 503.
+
+Shed requests get a JSON body with an `error` code and `retry_after`, plus a
+Retry-After header.
+"""
+
+import ipaddress
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from flask import Request, g, jsonify, request
+
+import metrics
+
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+MAX_ARCHIVE_BYTES = int(os.environ.get("MAX_ARCHIVE_BYTES", str(512 * 1024 * 1024)))
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE", "60"))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", "20"))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", str(2 * (os.cpu_count() or 1))))
+QUEUE_TIMEOUT = float(os.environ.get("QUEUE_TIMEOUT", "5"))
+# Peers whose client headers are believed, e.g. the Next.js server proxying browser
+# requests: comma-separated addresses or networks. TRUST_PROXY_HEADERS=true trusts
+# every peer, for servers only reachable through a proxy that sets the headers.
+TRUSTED_PROXIES = [ipaddress.ip_network(proxy.strip(), strict=False)
+                   for proxy in os.environ.get("TRUSTED_PROXIES", "").split(",") if proxy.strip()]
+TRUST_PROXY_HEADERS = os.environ.get("TRUST_PROXY_HEADERS", "false").lower() in ("1", "true", "yes")
+
+
+class TokenBucketLimiter:
+    """Token bucket per client key; the least recently seen clients are forgotten first."""
+
+    def __init__(self, rate_per_second: float, burst: int, max_clients: int = 10000):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> Tuple[bool, float]:
+        """Take one token for key. Returns (allowed, seconds until a token is available)."""
+        if self.rate <= 0:
+            return True, 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / self.rate
+
+
+def is_trusted_proxy(address: Optional[str]) -> bool:
+    if TRUST_PROXY_HEADERS:
+        return True
+    try:
+        ip = ipaddress.ip_address(address or "")
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_key(headers: Dict[str, str], remote_addr: Optional[str]) -> str:
+    """Identify the client by its address. Requests from a trusted proxy are identified
+    by the session/client id header or the forwarded address it passes on instead;
+    anyone else could set those headers to get a fresh bucket."""
+    if not is_trusted_proxy(remote_addr):
+        return f"ip:{remote_addr or 'unknown'}"
+    for header in ("x-session-id", "x-client-id"):
+        if headers.get(header):
+            return f"{header}:{headers[header][:128]}"
+    hops = [hop.strip() for hop in headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    # Each proxy appends the address it received the request from, so the nearest
+    # untrusted hop is the client
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop):
+            return f"ip:{hop}"
+    return f"ip:{hops[0] if hops else remote_addr or 'unknown'}"
+
+
+def shed_payload(error: str, message: str, retry_after: Optional[float] = None) -> Dict:
+    metrics.inc("face_api_requests_shed_total", "Requests rejected by admission control, by reason.", reason=error)
+    payload = {"success": False, "error": error, "message": message}
+    if retry_after is not None:
+        payload["retry_after"] = math.ceil(retry_after)
+    return payload
+
+
+class AdmissionRequest(Request):
+    """Request class whose body size limit depends on the route (enforced while streaming)."""
+
+    route_limits: Dict[str, int] = {}
+
+    @property
+    def max_content_length(self) -> Optional[int]:
+        return self.route_limits.get(self.path, super().max_content_length)
+
+
+def _shed(status: int, payload: Dict, retry_after: Optional[float] = None):
+    response = jsonify(payload)
+    response.status_code = status
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(math.ceil(retry_after))
+    return response
+
+
+def install(app, limits: Dict[str, int]) -> None:
+    """Apply size, rate and concurrency limits to the given routes of a Flask app.
+
+    limits maps a path to its maximum body size in bytes.
+    """
+    AdmissionRequest.route_limits = dict(limits)
+    app.request_class = AdmissionRequest
+    limiter = TokenBucketLimiter(RATE_LIMIT_PER_MINUTE / 60, RATE_LIMIT_BURST)
+    semaphore = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+    @app.before_request
+    def admit():
+        if request.path not in limits or request.method == "OPTIONS":
+            return None
+        if request.content_length is not None and request.content_length > limits[request.path]:
+            return _shed(413, shed_payload(
+                "payload_too_large", f"Request body exceeds {limits[request.path]} bytes"))
+
+        allowed, retry_after = limiter.acquire(client_key(
+            {name.lower(): value for name, value in request.headers.items()}, request.remote_addr))
+        if not allowed:
+            return _shed(429, shed_payload(
+                "rate_limited", "Too many requests from this client", retry_after), retry_after)
+
+        if not semaphore.acquire(timeout=QUEUE_TIMEOUT):
+            return _shed(503, shed_payload(
+                "overloaded", "Server is busy, please retry shortly", QUEUE_TIMEOUT), QUEUE_TIMEOUT)
+        g.admission_slot = True
+        if request.content_length is None:
+            # Chunked body: parse it here so an oversized one raises 413 before the
+            # handler runs (handlers catch broad exceptions and would turn it into a 500)
+            request.form
+        return None
+
+    @app.teardown_request
+    def release_slot(exc=None):
+        if g.pop("admission_slot", False):
+            semaphore.release()
+
+    @app.errorhandler(413)
+    def payload_too_large(e):
+        limit = request.max_content_length
+        return _shed(413, shed_payload("payload_too_large", f"Request body exceeds {limit} bytes"))
+
+
+def route_limits(image_paths: Iterable[str], archive_paths: Iterable[str]) -> Dict[str, int]:
+    limits = {path: MAX_IMAGE_BYTES for path in image_paths}
+    limits.update({path: MAX_ARCHIVE_BYTES for path in archive_paths})
+    return limits
@@ -1,13 +1,38 @@
 import os
-import cv2
+import time
 import numpy as np
 import datetime
 import traceback
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_from_directory
 from flask_cors import CORS
 import base64
+import contextvars
+import hashlib
+import json
+import shutil
+import sys
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
+
+# recognition, metrics and the other modules shared by both servers live in
+# the repository's top-level common/ directory
+COMMON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common")
+if COMMON_DIR not in sys.path:
+    sys.path.insert(0, COMMON_DIR)
+
 import supabase_helper as sb
+import bulk_register
+import admission
+import face_quality
+import image_derivatives
+from face_encoder import count_quality_rejects, encode_faces
+import metrics
+import recognition
+import slow_requests
+from result_cache import ResultCache, make_key
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -21,24 +46,202 @@ print(f"SUPABASE_URL is set: {'Yes' if os.environ.get('SUPABASE_URL') else 'No'}
 print(f"SUPABASE_SERVICE_ROLE_KEY is set: {'Yes' if os.environ.get('SUPABASE_SERVICE_ROLE_KEY') else 'No'}")
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+CORS(app, expose_headers=['Server-Timing', 'Retry-After'])  # Enable CORS for all routes
+
+# Attach per-stage timings to every response as a Server-Timing header
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING', 'true').lower() in ('1', 'true', 'yes')
 
 # Constants and configurations
 UPLOAD_FOLDER = 'uploads'
 STUDENT_IMAGES_FOLDER = os.path.join(UPLOAD_FOLDER, 'students')
 ATTENDANCE_FOLDER = os.path.join(UPLOAD_FOLDER, 'attendance')
 
+# Slow recognition requests, saved for replay when SLOW_REQUEST_CAPTURE is enabled
+SLOW_REQUEST_PATHS = ('/api/mark-attendance',)
+slow_request_buffer = slow_requests.CaptureBuffer(os.environ.get('SLOW_REQUEST_DIR', 'slow_requests'))
+
+# Progress of bulk registration jobs, keyed by job id
+bulk_jobs = {}
+
+# Network calls of a request (storage upload, session bookkeeping) run here while
+# the request thread does recognition
+io_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('IO_WORKERS', '16')), thread_name_prefix='request-io')
+
+def submit_io(stage, fn, *args):
+    """Run fn(*args) on the I/O pool, timed as stage in the current request's timings."""
+    def run():
+        with metrics.timer(stage):
+            return fn(*args)
+    # The copied context carries the request's timings into the worker thread
+    return io_pool.submit(contextvars.copy_context().run, run)
+
+# Attendance results of recently submitted images, so retries skip upload and recognition.
+# Enrollments through this process bump the generation; RESULT_CACHE_TTL bounds how long
+# changes made elsewhere (other instances, reencode_students.py) can go unnoticed.
+result_cache = ResultCache('attendance')
+gallery_generation = 0
+
+# Recognition gallery fetched from the database, refetched after GALLERY_CACHE_TTL
+# seconds so enrollments made elsewhere are picked up
+GALLERY_CACHE_TTL = float(os.environ.get('GALLERY_CACHE_TTL', '60'))
+face_gallery = None
+face_gallery_loaded_at = 0.0
+_gallery_lock = threading.Lock()
+
+def build_gallery(student_ids, encodings, names):
+    """A recognition.Gallery of the given students. Malformed encodings are logged and
+    dropped, so one bad row doesn't fail every attendance request."""
+    if not student_ids:
+        return recognition.Gallery()
+    infos = [{'name': name} for name in names]
+    try:
+        # One vectorized pass when every row is valid, as is normal
+        return recognition.Gallery.from_normalized(recognition.normalize(encodings), student_ids, infos)
+    except ValueError:
+        pass
+    ids, kept_infos, normalized = [], [], []
+    for student_id, encoding, info in zip(student_ids, encodings, infos):
+        try:
+            normalized.append(recognition.normalize(encoding)[0])
+        except ValueError as e:
+            print(f"Skipping face encoding of student {student_id}: {e}")
+            continue
+        ids.append(student_id)
+        kept_infos.append(info)
+    print(f"Dropped {len(student_ids) - len(ids)} malformed face encoding(s) from the gallery")
+    return recognition.Gallery.from_normalized(np.asarray(normalized, dtype=np.float32), ids, kept_infos)
+
+def get_gallery():
+    """The recognition.Gallery of every enrolled student, fetched on first use and after the TTL."""
+    global face_gallery, face_gallery_loaded_at
+    with _gallery_lock:
+        if face_gallery is not None and time.monotonic() - face_gallery_loaded_at < GALLERY_CACHE_TTL:
+            metrics.cache_hit('gallery')
+            return face_gallery
+        metrics.cache_miss('gallery')
+        with metrics.timer('gallery_fetch'):
+            rows = sb.get_all_face_encodings()
+            loaded = build_gallery(rows['student_ids'], rows['encodings'], rows['names'])
+        face_gallery, face_gallery_loaded_at = loaded, time.monotonic()
+    metrics.set_gauge('face_api_gallery_size', 'Number of encodings in the in-memory gallery.', len(loaded))
+    return loaded
+
+def gallery_changed(student_id=None, encoding=None, name=None):
+    """Invalidate caches after enrollment. A single new student is added to the loaded
+    gallery; without one the gallery is refetched on next use."""
+    global gallery_generation, face_gallery
+    gallery_generation += 1
+    result_cache.clear()
+    student_cache.clear()
+    if student_id is not None and face_gallery is not None:
+        face_gallery.add(student_id, encoding, {'name': name})
+    else:
+        face_gallery = None
+
+# Serialized student listing pages, invalidated with the gallery
+student_cache = ResultCache('students', ttl=float(os.environ.get('SUMMARY_CACHE_TTL', '30')))
+
+# Serialized attendance summaries. Writes through this process invalidate them;
+# SUMMARY_CACHE_TTL bounds staleness from writes made by other instances.
+summary_cache = ResultCache('summary', ttl=float(os.environ.get('SUMMARY_CACHE_TTL', '30')))
+attendance_generation = 0
+
+def attendance_changed():
+    global attendance_generation
+    attendance_generation += 1
+    summary_cache.clear()
+
+def conditional_json(cache, key, build):
+    """Serve build()'s (payload, last_modified) from cache with an ETag (and Last-Modified
+    if given), answering 304 to a matching If-None-Match or If-Modified-Since."""
+    cached = cache.get(key)
+    if cached is None:
+        payload, last_modified = build()
+        body = json.dumps({'success': True, **payload}, sort_keys=True, default=str).encode('utf-8')
+        cached = (body, hashlib.blake2b(body, digest_size=16).hexdigest(), last_modified)
+        cache.put(key, cached)
+    body, etag, last_modified = cached
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Clients must revalidate, which costs a 304 when nothing changed
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+def summary_response(kind, build, **params):
+    """Serve an attendance summary through the summary cache."""
+    key = make_key(kind.encode('utf-8'), attendance_generation, **params)
+    return conditional_json(summary_cache, key, lambda: (build(), None))
+
+def _parse_timestamp(value):
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
 # Create necessary directories
 os.makedirs(STUDENT_IMAGES_FOLDER, exist_ok=True)
 os.makedirs(ATTENDANCE_FOLDER, exist_ok=True)
 
-# Face detection cascade classifier
-try:
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    print("Face cascade classifier loaded successfully")
-except Exception as e:
-    print(f"Error loading face cascade classifier: {str(e)}")
-    traceback.print_exc()
+# OpenCV is imported on first use (by the recognition module) so the process can bind
+# its port quickly; the warm-up thread below loads it before real traffic arrives
+
+# Readiness of this process, reported by /api/ready
+readiness = {'ready': False, 'started_at': time.time(), 'warmup_seconds': None, 'error': None}
+
+def warm_up():
+    """Import OpenCV, build the cascade, connect to the database and fetch the
+    gallery once, so the first real request doesn't pay for them."""
+    start = time.perf_counter()
+    try:
+        recognition.detect(np.zeros((64, 64), dtype=np.uint8))
+        sb.get_client()
+        try:
+            get_gallery()
+        except Exception as e:
+            # An unreachable database shouldn't keep the server out of rotation forever
+            print(f"Warm-up could not fetch the gallery: {e}")
+        readiness['warmup_seconds'] = time.perf_counter() - start
+        readiness['ready'] = True
+        print(f"Warm-up finished in {readiness['warmup_seconds']:.2f}s")
+    except Exception as e:
+        readiness['error'] = str(e)
+        print(f"Error during warm-up: {e}")
+        traceback.print_exc()
+
+# CLIs that import this module for its helpers set WARMUP=false
+if os.environ.get('WARMUP', 'true').lower() in ('1', 'true', 'yes'):
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.request_timings = metrics.start_request()
+    g.slow_request = slow_requests.start(request.path) if request.path in SLOW_REQUEST_PATHS else None
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.request_start
+    metrics.REQUEST_SECONDS.observe(elapsed, request.url_rule.rule if request.url_rule else 'unmatched')
+    if SERVER_TIMING_ENABLED:
+        response.headers['Server-Timing'] = metrics.server_timing_header(g.request_timings, elapsed)
+    slow_requests.finish(g.slow_request, slow_request_buffer, g.request_timings, elapsed, response.status_code)
+    return response
+
+@app.teardown_request
+def stop_slow_request_profile(exc):
+    # after_request is skipped when a handler raises; the profiler must not keep running
+    capture = g.get('slow_request')
+    if capture is not None:
+        capture.stop()
+
+# Size, per-client rate and concurrency limits on the expensive routes (after the
+# metrics hooks so shed requests are still timed)
+admission.install(app, admission.route_limits(
+    image_paths=['/api/register', '/api/mark-attendance'],
+    archive_paths=['/api/register-bulk'],
+))
 
 # Function to process base64 image and save
 def process_base64_image(base64_string, save_path):
@@ -52,115 +255,51 @@ def process_base64_image(base64_string, save_path):
         f.write(img_data)
     return save_path
 
-# Function to detect and encode faces using OpenCV
-def encode_faces(image_path, student_id, name):
-    # Load image using OpenCV
-    image = cv2.imread(image_path)
-    if image is None:
-        return False, "Could not load image"
-    
-    # Convert to grayscale for face detection
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    
-    # Detect faces in the image
-    faces = face_cascade.detectMultiScale(gray, 1.1, 5)
-    
-    if len(faces) == 0:
-        return False, "No face detected in the image"
-    
-    # Get the largest face detected
-    largest_face = max(faces, key=lambda rect: rect[2] * rect[3])
-    x, y, w, h = largest_face
-    
-    # Extract face ROI
-    face_roi = image[y:y+h, x:x+w]
-    
-    # Resize to a standard size for better comparison
-    face_roi = cv2.resize(face_roi, (150, 150))
-    
-    # Convert to grayscale
-    face_roi_gray = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
-    
-    # Flatten the array for storage
-    face_encoding = face_roi_gray.flatten()
-    
-    return True, face_encoding
-
-# Calculate face similarity using normalized cross-correlation
-def face_similarity(face1, face2):
-    face1 = face1.astype(np.float32)
-    face2 = face2.astype(np.float32)
-    
-    # Reshape if flattened
-    if len(face1.shape) == 1:
-        size = int(np.sqrt(face1.shape[0] / 150) * 150)
-        face1 = face1.reshape(size, size)
-    if len(face2.shape) == 1:
-        size = int(np.sqrt(face2.shape[0] / 150) * 150)
-        face2 = face2.reshape(size, size)
-    
-    # Resize to ensure same dimensions
-    face1 = cv2.resize(face1, (150, 150))
-    face2 = cv2.resize(face2, (150, 150))
-    
-    # Normalize images
-    face1 = (face1 - np.mean(face1)) / np.std(face1)
-    face2 = (face2 - np.mean(face2)) / np.std(face2)
-    
-    # Calculate cross-correlation
-    correlation = np.sum(face1 * face2) / (np.sqrt(np.sum(face1 * face1)) * np.sqrt(np.sum(face2 * face2)))
-    
-    return correlation
-
 # Function to recognize faces in an image
-def recognize_faces(image_path):
+def recognize_faces(image_path, rejected=None, camera=None):
+    """Recognize faces in an image; faces failing the quality gate are skipped and,
+    if a list is passed as rejected, appended to it with their reasons. Detection
+    learns the face sizes seen by camera (any stable camera or session id)."""
+    import cv2
+
     # Load image
-    image = cv2.imread(image_path)
+    with metrics.timer('decode'):
+        image = cv2.imread(image_path)
     if image is None:
         return []
     
-    # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = recognition.to_gray(image)
     
     # Detect faces in the image
-    faces = face_cascade.detectMultiScale(gray, 1.1, 5)
+    with metrics.timer('detect'):
+        faces = recognition.detect_for(camera, gray)
+    metrics.FACES_PER_REQUEST.observe(len(faces))
     
-    recognized_students = []
+    with metrics.timer('quality'):
+        usable = []
+        for box in faces:
+            quality = face_quality.assess_face(gray, box)
+            if quality['ok']:
+                usable.append(box)
+                continue
+            count_quality_rejects(quality['reasons'])
+            if rejected is not None:
+                rejected.append({'box': list(box), 'reasons': quality['reasons']})
     
-    # Get all students with face encodings from Supabase
-    known_face_encodings = sb.get_all_face_encodings()
+    # All faces are encoded into one normalized query matrix
+    with metrics.timer('encode'):
+        query = recognition.query(gray, usable)
     
-    for (x, y, w, h) in faces:
-        # Extract face region
-        face_roi = image[y:y+h, x:x+w]
-        face_roi = cv2.resize(face_roi, (150, 150))
-        face_roi_gray = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
-        face_encoding = face_roi_gray.flatten()
-        
-        best_match = None
-        best_similarity = -1
-        threshold = 0.5  # Minimum similarity threshold
-        
-        # Compare with each known face
-        for i, known_encoding in enumerate(known_face_encodings['encodings']):
-            similarity = face_similarity(face_encoding, known_encoding)
-            
-            if similarity > threshold and similarity > best_similarity:
-                best_similarity = similarity
-                best_match = i
-        
-        if best_match is not None:
-            student_id = known_face_encodings['student_ids'][best_match]
-            name = known_face_encodings['names'][best_match]
-            
-            recognized_students.append({
-                'student_id': student_id,
-                'name': name,
-                'confidence': float(best_similarity),
-                'status': 'present'
-            })
+    gallery = get_gallery()
+    with metrics.timer('match'):
+        matches = gallery.match_batch(query, normalized=True)
     
-    return recognized_students
+    return [{
+        'student_id': match['id'],
+        'name': match['info']['name'],
+        'confidence': match['similarity'],
+        'status': 'present'
+    } for match in matches if match is not None]
 
 # Routes
 @app.route('/api/register', methods=['POST'])
@@ -201,13 +340,14 @@ def register():
         # Upload the image to Supabase Storage
         try:
             print("Uploading image to Supabase Storage...")
-            image_url = sb.upload_student_image(student_id, image_path)
-            print(f"Image uploaded, URL: {image_url}")
+            with metrics.timer('upload'):
+                image_urls = sb.upload_student_image(image_path)
+            print(f"Image uploaded, URL: {image_urls['original']}")
         except Exception as e:
             print(f"Error uploading to storage: {str(e)}")
             traceback.print_exc()
             # Use local path as fallback
-            image_url = f"/uploads/students/{filename}"
+            image_urls = {'original': f"/uploads/students/{filename}"}
         
         # Create student object
         student_data = {
@@ -219,14 +359,16 @@ def register():
             'batch': batch,
             'semester': semester,
             'department': department,
-            'image_url': image_url  # Store the image URL in the database
+            'image_url': image_urls['original']  # Store the image URL in the database
         }
         
         # Save to Supabase
         try:
             print("Saving student to Supabase...")
-            student = sb.create_student(student_data, face_encoding_or_message)
+            with metrics.timer('persist'):
+                student = sb.create_student(student_data, face_encoding_or_message)
             print("Student saved successfully")
+            gallery_changed(student_id, face_encoding_or_message, f"{first_name} {last_name}")
         except Exception as e:
             print(f"Error saving to database: {str(e)}")
             traceback.print_exc()
@@ -235,7 +377,8 @@ def register():
         return jsonify({
             'success': True,
             'message': 'Student registered successfully',
-            'student': student
+            'student': student,
+            'image_urls': image_urls  # Avatar, face crop and review-size copies
         })
         
     except Exception as e:
@@ -243,28 +386,74 @@ def register():
         traceback.print_exc()
         return jsonify({'success': False, 'message': str(e)}), 500
 
+def run_bulk_registration(job_id, archive_path, roster_path, work_dir):
+    job = bulk_jobs[job_id]
+    
+    def report(done, total, student_id, message):
+        job['done'] = done
+        job['total'] = total
+    
+    def stage(name):
+        job['stage'] = name
+    
+    try:
+        summary = bulk_register.bulk_register(archive_path, roster_path, encode_faces, progress=report, stage=stage)
+        job.update(summary)
+        job['status'] = 'completed'
+        gallery_changed()
+    except Exception as e:
+        print(f"Error in bulk registration: {str(e)}")
+        job['status'] = 'failed'
+        job['message'] = str(e)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+@app.route('/api/register-bulk', methods=['POST'])
+def register_bulk():
+    if 'archive' not in request.files or 'roster' not in request.files:
+        return jsonify({'success': False, 'message': 'Both an image archive and a CSV roster are required'}), 400
+    
+    work_dir = tempfile.mkdtemp(prefix='bulk_upload_')
+    archive_path = os.path.join(work_dir, 'images.zip')
+    roster_path = os.path.join(work_dir, 'roster.csv')
+    try:
+        request.files['archive'].save(archive_path)
+        request.files['roster'].save(roster_path)
+        bulk_register.read_roster(roster_path)
+    except Exception as e:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return jsonify({'success': False, 'message': f"Invalid bulk registration upload: {str(e)}"}), 400
+    
+    job_id = uuid.uuid4().hex
+    bulk_jobs[job_id] = {'status': 'running', 'done': 0, 'total': 0}
+    threading.Thread(
+        target=run_bulk_registration,
+        args=(job_id, archive_path, roster_path, work_dir),
+        daemon=True
+    ).start()
+    
+    return jsonify({'success': True, 'job_id': job_id, 'message': 'Bulk registration started'}), 202
+
+@app.route('/api/register-bulk/<job_id>', methods=['GET'])
+def register_bulk_status(job_id):
+    job = bulk_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Unknown job id'}), 404
+    return jsonify({'success': True, 'job_id': job_id, **job})
+
+def ensure_attendance_session(session_data):
+    """Create the attendance session unless it already exists."""
+    sessions = sb.get_attendance_sessions()
+    if not any(s['id'] == session_data['id'] for s in sessions):
+        sb.create_attendance_session(session_data)
+        attendance_changed()
+
 @app.route('/api/mark-attendance', methods=['POST'])
 def mark_attendance():
     try:
         # Extract attendance details
         session_id = request.form.get('sessionId')
         
-        # Check if session exists using direct function call
-        session = sb.get_attendance_sessions()
-        session_exists = any(s['id'] == session_id for s in session)
-        
-        if not session_exists:
-            # Create new session if it doesn't exist
-            session_data = {
-                'id': session_id,
-                'name': request.form.get('sessionName', 'Unnamed Session'),
-                'course': request.form.get('course', 'Unknown Course'),
-                'date': datetime.datetime.now().strftime('%Y-%m-%d'),
-                'start_time': datetime.datetime.now().strftime('%H:%M:%S'),
-                'location': request.form.get('location', 'Unknown Location')
-            }
-            sb.create_attendance_session(session_data)
-        
         # Process attendance image
         if 'attendanceImage' not in request.files:
             return jsonify({'success': False, 'message': 'No attendance image provided'}), 400
@@ -273,16 +462,46 @@ def mark_attendance():
         if attendance_image.filename == '':
             return jsonify({'success': False, 'message': 'No selected file'}), 400
         
+        # Detection adapts to the face sizes each camera (or, without one, session) sees
+        camera = request.form.get('cameraId') or session_id
+        
+        # A retry of the same image from the same camera for the same session returns
+        # the earlier result; its records are already saved and its image already uploaded
+        image_bytes = attendance_image.read()
+        cache_key = make_key(image_bytes, gallery_generation, session_id=session_id, camera=camera)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return jsonify({**cached, 'cached': True})
+        
         # Save the attendance image locally first
         filename = secure_filename(f"{session_id}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.jpg")
         image_path = os.path.join(ATTENDANCE_FOLDER, filename)
-        attendance_image.save(image_path)
+        with open(image_path, 'wb') as f:
+            f.write(image_bytes)
         
-        # Upload the image to Supabase Storage
-        image_url = sb.upload_attendance_image(session_id, image_path)
+        # Session bookkeeping and the storage upload only wait on the network, so they
+        # run alongside recognition; the request takes as long as the slowest of them
+        session_data = {
+            'id': session_id,
+            'name': request.form.get('sessionName', 'Unnamed Session'),
+            'course': request.form.get('course', 'Unknown Course'),
+            'date': datetime.datetime.now().strftime('%Y-%m-%d'),
+            'start_time': datetime.datetime.now().strftime('%H:%M:%S'),
+            'location': request.form.get('location', 'Unknown Location')
+        }
+        session_ready = submit_io('session', ensure_attendance_session, session_data)
+        image_uploaded = submit_io('upload', sb.upload_attendance_image, image_path)
         
         # Recognize faces in the image
-        recognized_students = recognize_faces(image_path)
+        slow_requests.record_input(image_bytes, fields=request.form.to_dict(), gallery_generation=gallery_generation,
+                                   gallery_size=len(get_gallery()), camera=camera,
+                                   detect_range=recognition.camera_size_range(camera))
+        rejected_faces = []
+        recognized_students = recognize_faces(image_path, rejected_faces, camera=camera)
+        
+        # Records reference the session and the uploaded image, so both must be done
+        session_ready.result()
+        image_urls = image_uploaded.result()
         
         # Create attendance records
         attendance_records = []
@@ -293,23 +512,29 @@ def mark_attendance():
                 'status': student['status'],
                 'confidence': student['confidence'],
                 'timestamp': datetime.datetime.now().isoformat(),
-                'image_url': image_url  # Store the attendance image URL
+                'image_url': image_urls['original']  # Store the attendance image URL
             }
             attendance_records.append(record)
         
         # Save attendance records to Supabase
         if attendance_records:
-            saved_records = sb.save_attendance_records(attendance_records)
+            with metrics.timer('persist'):
+                saved_records = sb.save_attendance_records(attendance_records)
+            attendance_changed()
         else:
             saved_records = []
         
-        return jsonify({
+        result = {
             'success': True,
             'message': f'Marked attendance for {len(saved_records)} student(s)',
             'records': saved_records,
             'recognized': recognized_students,
-            'image_url': image_url  # Return the image URL in the response
-        })
+            'rejected': rejected_faces,  # Faces skipped by the quality gate, with reasons
+            'image_url': image_urls['original'],  # Return the image URL in the response
+            'image_urls': image_urls  # Thumbnail and review-size copies for the review screen
+        }
+        result_cache.put(cache_key, result)
+        return jsonify({**result, 'cached': False})
         
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -317,12 +542,45 @@ def mark_attendance():
 
 @app.route('/api/students', methods=['GET'])
 def get_students():
+    """One page of students ordered by id.
+
+    Query parameters: fields (comma-separated columns; face_encoding only if listed),
+    batch/department/semester filters, limit (default 100, max 1000) and cursor
+    (the next_cursor of the previous page).
+    """
+    fields = request.args.get('fields')
+    columns = tuple(f.strip() for f in fields.split(',') if f.strip()) if fields else sb.STUDENT_COLUMNS
+    unknown = set(columns) - set(sb.STUDENT_COLUMNS) - {'face_encoding'}
+    if unknown:
+        return jsonify({'success': False, 'message': f"Unknown fields: {', '.join(sorted(unknown))}"}), 400
     try:
-        students = sb.get_all_students()
-        return jsonify({
-            'success': True,
-            'students': students
-        })
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+        cursor = request.args.get('cursor')
+        after = base64.b64decode(cursor, altchars=b'-_', validate=True).decode('utf-8') if cursor else None
+    except (ValueError, UnicodeError):
+        return jsonify({'success': False, 'message': 'Invalid limit or cursor'}), 400
+    filters = {column: request.args[column] for column in sb.STUDENT_FILTERS if column in request.args}
+    
+    def build():
+        # updated_at is always fetched for Last-Modified, but only returned if asked for
+        rows, has_more = sb.list_students(columns + ('updated_at',), after, limit, filters)
+        modified = [_parse_timestamp(row.get('updated_at') or row.get('created_at')) for row in rows]
+        if 'updated_at' not in columns:
+            for row in rows:
+                row.pop('updated_at', None)
+        if 'image_url' in columns:
+            # Lists show avatars; never make the browser fetch originals for them
+            for row in rows:
+                row['image_urls'] = sb.derivative_urls(row.get('image_url'), image_derivatives.STUDENT_DERIVATIVES)
+        next_cursor = None
+        if has_more and rows:
+            next_cursor = base64.urlsafe_b64encode(rows[-1]['id'].encode('utf-8')).decode('ascii')
+        last_modified = max((m for m in modified if m is not None), default=None)
+        return {'students': rows, 'count': len(rows), 'next_cursor': next_cursor}, last_modified
+    
+    try:
+        key = make_key(b'students', gallery_generation, columns=columns, after=after, limit=limit, **filters)
+        return conditional_json(student_cache, key, build)
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -333,6 +591,7 @@ def get_student(student_id):
         if not student:
             return jsonify({'success': False, 'message': 'Student not found'}), 404
         
+        student['image_urls'] = sb.derivative_urls(student.get('image_url'), image_derivatives.STUDENT_DERIVATIVES)
         return jsonify({
             'success': True,
             'student': student
@@ -373,13 +632,68 @@ def get_student_attendance(student_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/student/<student_id>/summary', methods=['GET'])
+def get_student_summary(student_id):
+    """Attendance percentage per course; optional start/end (YYYY-MM-DD) limit the date range."""
+    start, end = request.args.get('start'), request.args.get('end')
+    try:
+        return summary_response('student', lambda: sb.get_student_summary(student_id, start, end),
+                                student_id=student_id, start=start, end=end)
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/course/<course>/summary', methods=['GET'])
+def get_course_summary(course):
+    """Sessions held and attendance per date and per student for a course."""
+    start, end = request.args.get('start'), request.args.get('end')
+    try:
+        return summary_response('course', lambda: sb.get_course_summary(course, start, end),
+                                course=course, start=start, end=end)
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/sessions/summary', methods=['GET'])
+def get_session_summaries():
+    """Sessions with present counts, optionally filtered by course and date range."""
+    start, end, course = request.args.get('start'), request.args.get('end'), request.args.get('course')
+    try:
+        return summary_response('sessions', lambda: {'sessions': sb.get_session_summaries(start, end, course)},
+                                start=start, end=end, course=course)
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# Serve bucket files when running against the local backend stand-in
+if sb.DATABASE_BACKEND == 'local':
+    @app.route('/local-storage/<bucket>/<path:file_name>', methods=['GET'])
+    def local_storage(bucket, file_name):
+        return send_from_directory(sb.supabase.storage.root, f"{bucket}/{file_name}")
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Liveness check; answers as soon as the process is up."""
+    return jsonify({'status': 'ok', 'uptime_seconds': time.time() - readiness['started_at']})
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """Readiness check: 200 once warm-up has finished, 503 before."""
+    return jsonify({
+        'ready': readiness['ready'],
+        'uptime_seconds': time.time() - readiness['started_at'],
+        'warmup_seconds': readiness['warmup_seconds'],
+        'error': readiness['error']
+    }), 200 if readiness['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # Add a test endpoint to check Supabase connection
 @app.route('/api/test-connection', methods=['GET'])
 def test_connection():
     try:
         # Test database connection
         try:
-            students = sb.get_all_students()
+            sb.list_students(('id',), limit=1)
             db_status = "Connected"
         except Exception as e:
             db_status = f"Error: {str(e)}"
@@ -0,0 +1,173 @@
+import argparse
+import csv
+import os
+import shutil
+import tempfile
+import traceback
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import supabase_helper as sb
+from face_encoder import encode_faces
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+STUDENT_FIELDS = ['id', 'first_name', 'last_name', 'email', 'phone', 'batch', 'semester', 'department']
+
+
+def read_roster(roster_path):
+    """Read the CSV roster. Requires at least id, first_name and last_name columns."""
+    with open(roster_path, 'r', newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        missing = {'id', 'first_name', 'last_name'} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"Roster is missing required columns: {', '.join(sorted(missing))}")
+        return [
+            {key: (value or '').strip() for key, value in row.items() if key}
+            for row in reader
+            if (row.get('id') or '').strip()
+        ]
+
+
+def index_images(image_dir):
+    """Map both file names and file stems (student ids) to image paths."""
+    index = {}
+    for root, _, files in os.walk(image_dir):
+        for file_name in files:
+            stem, ext = os.path.splitext(file_name)
+            if ext.lower() not in IMAGE_EXTENSIONS:
+                continue
+            path = os.path.join(root, file_name)
+            index.setdefault(file_name, path)
+            index.setdefault(stem, path)
+    return index
+
+
+def prepare_source(source):
+    """Return (image_dir, temp_dir) for a directory or ZIP; temp_dir must be removed by the caller."""
+    if os.path.isdir(source):
+        return source, None
+    if zipfile.is_zipfile(source):
+        temp_dir = tempfile.mkdtemp(prefix='bulk_register_')
+        with zipfile.ZipFile(source) as archive:
+            archive.extractall(temp_dir)
+        return temp_dir, temp_dir
+    raise ValueError(f"{source} is neither a directory nor a ZIP archive")
+
+
+def bulk_register(source, roster_path, encode_fn, workers=None, progress=None, stage=None):
+    """Register every student in the roster from a ZIP or directory of images.
+
+    Faces are encoded across a process pool with encode_fn (face_encoder.encode_faces),
+    then images are uploaded concurrently and students inserted in batches.
+    Students that fail at any step are listed in the result's 'failed'.
+
+    progress(done, total, student_id, message) is called once a student is
+    finished: saved, or failed at any step. stage(name) is called as the job
+    moves through 'encoding', 'uploading' and 'saving'.
+    """
+    roster = read_roster(roster_path)
+    image_dir, temp_dir = prepare_source(source)
+    workers = workers or os.cpu_count() or 1
+    total = len(roster)
+    done = 0
+    failed = []
+    encoded = []
+
+    def report(student_id, message):
+        nonlocal done
+        done += 1
+        if message:
+            failed.append({'id': student_id, 'message': message})
+        if progress:
+            progress(done, total, student_id, message)
+
+    try:
+        if stage:
+            stage('encoding')
+        images = index_images(image_dir)
+        work = []
+        for student in roster:
+            image_path = images.get(student.get('image') or '') or images.get(student['id'])
+            if image_path is None:
+                report(student['id'], 'No image found for student')
+            else:
+                work.append((student, image_path))
+
+        # Keep a bounded number of tasks in flight so large archives don't queue every image at once
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            work = iter(work)
+            while True:
+                for student, image_path in work:
+                    name = f"{student['first_name']} {student['last_name']}"
+                    future = executor.submit(encode_fn, image_path, student['id'], name)
+                    pending[future] = (student, image_path)
+                    if len(pending) >= workers * 4:
+                        break
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    student, image_path = pending.pop(future)
+                    try:
+                        success, face_encoding_or_message = future.result()
+                    except Exception as e:
+                        success, face_encoding_or_message = False, str(e)
+                    if success:
+                        # Counted as done once it is saved
+                        encoded.append((student, image_path, face_encoding_or_message))
+                    else:
+                        report(student['id'], face_encoding_or_message)
+
+        if stage:
+            stage('uploading')
+        print(f"Uploading {len(encoded)} student images to Supabase Storage...")
+        image_urls = sb.upload_student_images([(student['id'], path) for student, path, _ in encoded])
+
+        records = []
+        for student, _, face_encoding in encoded:
+            student_data = {field: student.get(field) or None for field in STUDENT_FIELDS}
+            student_data['image_url'] = image_urls.get(student['id'], {}).get('original')
+            records.append((student_data, face_encoding))
+
+        if stage:
+            stage('saving')
+        print(f"Saving {len(records)} students to Supabase...")
+        created, insert_failed = sb.create_students(records)
+        for student in created:
+            report(student['id'], None)
+        for failure in insert_failed:
+            report(failure['id'], failure['message'])
+    except Exception:
+        traceback.print_exc()
+        raise
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return {
+        'total': total,
+        'registered': [student['id'] for student in created],
+        'failed': failed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk register students from a photo archive and CSV roster.')
+    parser.add_argument('source', help='ZIP archive or directory of student images')
+    parser.add_argument('roster', help='CSV roster with id, first_name, last_name and optional image columns')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    args = parser.parse_args()
+
+    def report(done, total, student_id, message):
+        print(f"[{done}/{total}] {student_id}: {message or 'ok'}")
+
+    def stage(name):
+        print(f"Stage: {name}")
+
+    summary = bulk_register(args.source, args.roster, encode_faces, args.workers, report, stage)
+    print(f"Registered {len(summary['registered'])} of {summary['total']} students, {len(summary['failed'])} failed")
+
+
+if __name__ == '__main__':
+    main()
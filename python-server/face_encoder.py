@@ -0,0 +1,52 @@
+"""
+Enrollment photo encoding.
+
+Kept apart from app.py so process pools (bulk registration, re-encoding) can
+use encode_faces as their target: under the spawn start method every worker
+imports the target's module, and importing this one loads no settings, prints
+nothing and starts no threads.
+"""
+
+import face_quality
+import metrics
+import recognition
+
+
+def count_quality_rejects(reasons):
+    for reason in reasons:
+        metrics.inc('face_api_quality_rejects_total', 'Faces failing a quality check, by reason.', reason=reason)
+
+# Function to detect and encode the largest face of an enrollment photo
+def encode_faces(image_path, student_id, name, check_quality=True):
+    import cv2
+
+    # Load image using OpenCV
+    with metrics.timer('decode'):
+        image = cv2.imread(image_path)
+    if image is None:
+        return False, "Could not load image"
+
+    gray = recognition.to_gray(image)
+
+    # Detect faces in the image
+    with metrics.timer('detect'):
+        faces = recognition.detect(gray)
+
+    if len(faces) == 0:
+        return False, "No face detected in the image"
+
+    # Get the largest face detected
+    largest_face = max(faces, key=lambda rect: rect[2] * rect[3])
+
+    # Reject unusable enrollment photos up front; they would hurt every later match
+    if check_quality:
+        with metrics.timer('quality'):
+            quality = face_quality.assess_face(gray, largest_face, face_quality.ENROLLMENT)
+        if not quality['ok']:
+            count_quality_rejects(quality['reasons'])
+            return False, f"Image quality too low: {face_quality.describe(quality['reasons'])}"
+
+    with metrics.timer('encode'):
+        face_encoding = recognition.encode(gray, [largest_face])[0]
+
+    return True, face_encoding
@@ -0,0 +1,109 @@
+"""
+Resized, recompressed copies of uploaded images.
+
+Avatars, face crops and review-size copies are generated once at upload and
+stored next to the original, so pages that show them never download the
+full-size photo.
+"""
+
+import os
+
+import numpy as np
+
+JPEG_QUALITY = int(os.environ.get('DERIVATIVE_JPEG_QUALITY', '80'))
+
+# name: (region, size). 'square' is a square around the face (or the centre of the
+# image) scaled to size x size; 'face' is the face box with a margin and 'image' the
+# whole image, both scaled so the longer side is at most size
+DERIVATIVES = {
+    'avatar': ('square', 96),
+    'face': ('face', 256),
+    'thumbnail': ('image', 320),
+    'review': ('image', 1280),
+}
+STUDENT_DERIVATIVES = ('avatar', 'face', 'review')
+ATTENDANCE_DERIVATIVES = ('thumbnail', 'review')
+
+# Faces are located on a copy scaled down to this size; portraits don't need more
+_DETECT_SIDE = 640
+
+
+def make_derivatives(content, names):
+    """JPEG bytes of each named derivative of an encoded image."""
+    import cv2
+
+    image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image")
+
+    needs_face = any(DERIVATIVES[name][0] != 'image' for name in names)
+    face = _largest_face(image) if needs_face else None
+    derivatives = {}
+    for name in names:
+        region, size = DERIVATIVES[name]
+        if region == 'image':
+            crop = image
+        elif region == 'face' and face is not None:
+            crop = _crop(image, *_expand(face, 0.2, image.shape))
+        else:
+            # Without a face the face crop falls back to the avatar framing
+            crop = _crop(image, *_square(face, image.shape))
+        derivatives[name] = _jpeg(_fit(crop, size))
+    return derivatives
+
+
+def _largest_face(image):
+    import cv2
+    import recognition
+
+    scale = min(1.0, _DETECT_SIDE / max(image.shape[:2]))
+    small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else image
+    faces = recognition.detect(small)
+    if not faces:
+        return None
+    return tuple(int(v / scale) for v in max(faces, key=lambda f: f[2] * f[3]))
+
+
+def _expand(box, margin, shape):
+    x, y, w, h = box
+    dx, dy = int(w * margin), int(h * margin)
+    left, top = max(x - dx, 0), max(y - dy, 0)
+    right, bottom = min(x + w + dx, shape[1]), min(y + h + dy, shape[0])
+    return left, top, right - left, bottom - top
+
+
+def _square(face, shape):
+    height, width = shape[:2]
+    if face is None:
+        side = min(height, width)
+        center_x, center_y = width // 2, height // 2
+    else:
+        x, y, w, h = face
+        side = min(int(max(w, h) * 1.8), height, width)
+        center_x, center_y = x + w // 2, y + h // 2
+    left = min(max(center_x - side // 2, 0), width - side)
+    top = min(max(center_y - side // 2, 0), height - side)
+    return left, top, side, side
+
+
+def _crop(image, x, y, w, h):
+    return image[y:y + h, x:x + w]
+
+
+def _fit(image, size):
+    import cv2
+
+    scale = size / max(image.shape[:2])
+    if scale >= 1:
+        return image
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def _jpeg(image):
+    import cv2
+
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY,
+                                               cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+    if not ok:
+        raise ValueError("Could not encode derivative")
+    return encoded.tobytes()
@@ -0,0 +1,305 @@
+"""
+Load generator for the attendance server.
+
+Replays a mix of student registrations and attendance captures at a fixed
+arrival rate and reports throughput and latency percentiles per operation.
+Latency is measured from each request's scheduled start, so queueing behind
+a saturated server counts against it.
+
+Without --images, a roster of students with drawn faces is enrolled before
+the clock starts, and attendance captures are group photos of them, so
+detection, encoding and matching do real work. Every upload carries a unique
+JPEG comment, so no request is answered from the result cache.
+
+    # Against a running server
+    python loadtest.py --url http://localhost:5000 --rate 20 --duration 60
+
+    # Fully offline against the SQLite/local-directory backend
+    python loadtest.py --in-process --rate 20 --duration 60 --classrooms 30
+"""
+
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib import error as urlerror
+from urllib import request as urlrequest
+
+import cv2
+import numpy as np
+
+# Faces are drawn by the benchmark suite's generator, so both tools exercise the same synthetic people
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from bench_recognition import synthetic_face  # noqa: E402
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def parse_mix(mix):
+    """Parse "register=1,attendance=9" into a list of (operation, weight)."""
+    weights = []
+    for part in mix.split(','):
+        operation, weight = part.split('=')
+        if operation not in ('register', 'attendance'):
+            raise ValueError(f"Unknown operation in mix: {operation}")
+        weights.append((operation, float(weight)))
+    return weights
+
+
+def load_images(image_dir):
+    """JPEG bytes of the face photos in image_dir."""
+    images = []
+    for file_name in sorted(os.listdir(image_dir)):
+        if file_name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(image_dir, file_name), 'rb') as f:
+                images.append(f.read())
+    if not images:
+        raise ValueError(f"No {', '.join(IMAGE_EXTENSIONS)} images in {image_dir}")
+    return images
+
+
+def synthetic_portrait(identity):
+    """JPEG bytes of an enrollment photo: one large, centred face."""
+    image = np.full((480, 480, 3), 180, dtype=np.uint8)
+    image[120:360, 120:360] = synthetic_face(identity, 240)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def synthetic_group_photo(identities, rng):
+    """JPEG bytes of a 1280x720 classroom photo with one face per identity on a jittered grid."""
+    height, width = 720, 1280
+    y, x = np.mgrid[0:height, 0:width]
+    image = np.clip((x / width * 120 + y / height * 80)[..., None] + rng.normal(0, 10, (height, width, 3)),
+                    0, 255).astype(np.uint8)
+    columns = 4
+    rows = (len(identities) + columns - 1) // columns
+    cell_width, cell_height = width // columns, height // max(rows, 1)
+    for i, identity in enumerate(identities):
+        size = min(int(rng.integers(110, 150)), cell_width, cell_height)
+        left = (i % columns) * cell_width + int(rng.integers(0, cell_width - size + 1))
+        top = (i // columns) * cell_height + int(rng.integers(0, cell_height - size + 1))
+        image[top:top + size, left:left + size] = synthetic_face(identity, size)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def unique_jpeg(content, tag):
+    """The same JPEG with a comment segment added, so its bytes (and cache key) are unique."""
+    comment = tag.encode()
+    return content[:2] + b'\xff\xfe' + struct.pack('>H', len(comment) + 2) + comment + content[2:]
+
+
+def encode_multipart(fields, files):
+    """Build a multipart/form-data body for urllib."""
+    boundary = uuid.uuid4().hex
+    body = bytearray()
+    for name, value in fields.items():
+        body += f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+    for name, (file_name, content) in files.items():
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{file_name}"\r\n'
+                 f'Content-Type: image/jpeg\r\n\r\n').encode()
+        body += content + b'\r\n'
+    body += f'--{boundary}--\r\n'.encode()
+    return bytes(body), f'multipart/form-data; boundary={boundary}'
+
+
+class HttpTarget:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def post(self, path, fields, files):
+        body, content_type = encode_multipart(fields, files)
+        req = urlrequest.Request(self.base_url + path, data=body, headers={'Content-Type': content_type})
+        try:
+            with urlrequest.urlopen(req, timeout=120) as response:
+                return response.status, _json(response.read())
+        except urlerror.HTTPError as e:
+            return e.code, _json(e.read())
+
+
+class InProcessTarget:
+    def __init__(self):
+        os.environ.setdefault('DATABASE_BACKEND', 'local')
+        os.environ.setdefault('SERVER_TIMING', 'false')
+        os.environ.setdefault('WARMUP', 'false')
+        # Every simulated client shares one address; measure the pipeline, not the rate limiter
+        os.environ.setdefault('RATE_LIMIT_PER_MINUTE', '0')
+        import app
+        # Warm up before the clock starts, as a load balancer would wait for /api/ready
+        app.warm_up()
+        self.app = app.app
+        self.local = threading.local()
+
+    def post(self, path, fields, files):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        from io import BytesIO
+        data = dict(fields)
+        for name, (file_name, content) in files.items():
+            data[name] = (BytesIO(content), file_name)
+        response = self.local.client.post(path, data=data, content_type='multipart/form-data')
+        return response.status_code, response.get_json(silent=True)
+
+
+def _json(body):
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def _percentile(values, percentile):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))]
+
+
+def summarize(samples, elapsed):
+    """Aggregate (operation, status, latency, service_time, recognized) samples into a report."""
+    report = {'elapsed_s': elapsed, 'operations': {}}
+    by_operation = {}
+    for operation, status, latency, service, recognized in samples:
+        by_operation.setdefault(operation, []).append((status, latency, service, recognized))
+
+    for operation, entries in sorted(by_operation.items()):
+        latencies = [latency * 1000 for _, latency, _, _ in entries]
+        services = [service * 1000 for _, _, service, _ in entries]
+        statuses = {}
+        for status, _, _, _ in entries:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        report['operations'][operation] = {
+            'count': len(entries),
+            'throughput_per_s': len(entries) / elapsed if elapsed else None,
+            'errors': sum(1 for status, _, _, _ in entries if status == 'error' or int(status) >= 500),
+            'statuses': statuses,
+            'latency_ms': {p: _percentile(latencies, int(p[1:])) for p in ('p50', 'p90', 'p99')},
+            'max_latency_ms': max(latencies),
+            'service_p50_ms': _percentile(services, 50),
+        }
+        recognized = [count for _, _, _, count in entries if count is not None]
+        if recognized:
+            report['operations'][operation]['recognized_per_request'] = sum(recognized) / len(recognized)
+    report['total_count'] = len(samples)
+    report['throughput_per_s'] = len(samples) / elapsed if elapsed else None
+    return report
+
+
+def student_fields(student_id, n):
+    return {
+        'studentId': student_id, 'firstName': 'Load', 'lastName': f"Test {n}",
+        'email': f"{student_id.lower()}@loadtest.invalid", 'batch': '2024',
+        'semester': '1', 'department': 'CSE'
+    }
+
+
+def enroll_roster(target, run_id, students, concurrency):
+    """Register students with drawn faces 0..students-1; returns the identities that enrolled."""
+    def register(identity):
+        student_id = f"LT{run_id}-R{identity}"
+        status, _ = target.post('/api/register', student_fields(student_id, identity),
+                                {'faceImage': (f"{student_id}.jpg", synthetic_portrait(identity))})
+        return identity if status == 200 else None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        roster = [identity for identity in executor.map(register, range(students)) if identity is not None]
+    print(f"Enrolled {len(roster)} of {students} roster students", file=sys.stderr)
+    if not roster:
+        raise RuntimeError("No roster student could be enrolled; check the server logs")
+    return roster
+
+
+def run(target, rate, duration, concurrency, mix, classrooms, images, seed, students=50, faces_per_photo=8):
+    """Generate the load; images are photos to upload, or None for the synthetic roster."""
+    rng = random.Random(seed)
+    operations, weights = zip(*mix)
+    # Ids are unique per run, so runs against the same backend never collide
+    run_id = f"{seed}-{uuid.uuid4().hex[:6]}"
+    sessions = [f"LOADTEST-{run_id}-{i}" for i in range(classrooms)]
+    samples = []
+    samples_lock = threading.Lock()
+    counter = iter(range(sys.maxsize))
+
+    if images is None:
+        roster = enroll_roster(target, run_id, students, concurrency)
+        photo_rng = np.random.default_rng(seed)
+        group_photos = [synthetic_group_photo(rng.sample(roster, min(faces_per_photo, len(roster))), photo_rng)
+                        for _ in range(32)]
+
+    def request(operation, scheduled):
+        sent = time.perf_counter()
+        n = next(counter)
+        if operation == 'register':
+            student_id = f"LT{run_id}-{n}"
+            # New students get identities past the roster's
+            image = synthetic_portrait(students + n) if images is None else rng.choice(images)
+            path = '/api/register'
+            fields, files = student_fields(student_id, n), {'faceImage': (f"{student_id}.jpg", image)}
+        else:
+            image = rng.choice(group_photos if images is None else images)
+            session_id = rng.choice(sessions)
+            path = '/api/mark-attendance'
+            fields = {'sessionId': session_id, 'sessionName': session_id, 'course': 'Load Test'}
+            files = {'attendanceImage': ('capture.jpg', image)}
+        files = {name: (file_name, unique_jpeg(content, f"loadtest {run_id} {n}"))
+                 for name, (file_name, content) in files.items()}
+        try:
+            status, payload = target.post(path, fields, files)
+        except Exception as e:
+            print(f"{operation} failed: {e}", file=sys.stderr)
+            status, payload = 'error', None
+        finished = time.perf_counter()
+        recognized = len(payload.get('recognized') or []) if operation == 'attendance' and payload else None
+        with samples_lock:
+            samples.append((operation, status, finished - scheduled, finished - sent, recognized))
+
+    total = int(rate * duration)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i in range(total):
+            scheduled = start + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(request, rng.choices(operations, weights)[0], scheduled)
+    return summarize(samples, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a register/attendance mix against the attendance server.')
+    target_group = parser.add_mutually_exclusive_group(required=True)
+    target_group.add_argument('--url', help='Base URL of a running server, e.g. http://localhost:5000')
+    target_group.add_argument('--in-process', action='store_true',
+                              help='Drive app.py in this process (defaults DATABASE_BACKEND to local)')
+    parser.add_argument('--rate', type=float, default=10.0, help='Requests per second (default: 10)')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds to generate load for (default: 30)')
+    parser.add_argument('--concurrency', type=int, default=64, help='Maximum requests in flight (default: 64)')
+    parser.add_argument('--mix', default='register=1,attendance=9',
+                        help='Operation weights (default: register=1,attendance=9)')
+    parser.add_argument('--classrooms', type=int, default=10, help='Number of concurrent sessions (default: 10)')
+    parser.add_argument('--images', help='Directory of face photos to upload instead of the synthetic roster')
+    parser.add_argument('--students', type=int, default=50,
+                        help='Synthetic roster size enrolled before the run (default: 50)')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', help='Write the report JSON to this file')
+    args = parser.parse_args()
+
+    target = InProcessTarget() if args.in_process else HttpTarget(args.url)
+    images = load_images(args.images) if args.images else None
+    report = run(target, args.rate, args.duration, args.concurrency, parse_mix(args.mix),
+                 args.classrooms, images, args.seed, args.students)
+    report['config'] = {key: value for key, value in vars(args).items() if key != 'output'}
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,489 @@
+"""
+In-process stand-in for the Supabase client, backed by SQLite and a local
+directory of buckets.
+
+It implements the subset of the supabase-py API that supabase_helper uses
+(table queries with select/eq/in_/gt/gte/lte/order/range/limit, insert/upsert/update,
+and bucket storage), so every helper function works unchanged for offline
+development and load testing. Select with DATABASE_BACKEND=local.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    id TEXT PRIMARY KEY,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    phone TEXT,
+    batch TEXT,
+    semester TEXT,
+    department TEXT,
+    image_url TEXT,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+    face_encoding TEXT
+);
+CREATE TABLE IF NOT EXISTS attendance_sessions (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    course TEXT NOT NULL,
+    date TEXT NOT NULL,
+    start_time TEXT,
+    end_time TEXT,
+    location TEXT,
+    present_count INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+CREATE TABLE IF NOT EXISTS attendance_records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT REFERENCES attendance_sessions(id),
+    student_id TEXT REFERENCES students(id),
+    status TEXT NOT NULL,
+    confidence REAL,
+    timestamp TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+    image_url TEXT,
+    UNIQUE(session_id, student_id)
+);
+CREATE INDEX IF NOT EXISTS idx_attendance_session ON attendance_records(session_id);
+CREATE INDEX IF NOT EXISTS idx_attendance_student ON attendance_records(student_id);
+CREATE TABLE IF NOT EXISTS student_face_encodings (
+    student_id TEXT REFERENCES students(id) ON DELETE CASCADE,
+    version TEXT NOT NULL,
+    face_encoding TEXT NOT NULL,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+    PRIMARY KEY (student_id, version)
+);
+CREATE TABLE IF NOT EXISTS gallery_settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attendance_daily_counts (
+    student_id TEXT REFERENCES students(id) ON DELETE CASCADE,
+    course TEXT NOT NULL,
+    date TEXT NOT NULL,
+    present INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (student_id, course, date)
+);
+CREATE INDEX IF NOT EXISTS idx_daily_counts_course ON attendance_daily_counts(course, date);
+CREATE TABLE IF NOT EXISTS course_daily_sessions (
+    course TEXT NOT NULL,
+    date TEXT NOT NULL,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (course, date)
+);
+"""
+
+# Columns added after the first release, with how to backfill them in older databases
+MIGRATIONS = [
+    ('attendance_sessions', 'present_count', 'INTEGER NOT NULL DEFAULT 0', None),
+    ('students', 'updated_at', 'TEXT', 'UPDATE students SET updated_at = created_at'),
+]
+
+# SQLite versions of the triggers in database_schema.sql
+TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS students_updated_at
+AFTER UPDATE ON students WHEN NEW.updated_at IS OLD.updated_at
+BEGIN
+    UPDATE students SET updated_at = strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now') WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS attendance_records_summary_insert
+AFTER INSERT ON attendance_records WHEN NEW.status = 'present'
+BEGIN
+    INSERT INTO attendance_daily_counts (student_id, course, date, present)
+        SELECT NEW.student_id, course, date, 1 FROM attendance_sessions WHERE id = NEW.session_id
+        ON CONFLICT (student_id, course, date) DO UPDATE SET present = present + 1;
+    UPDATE attendance_sessions SET present_count = present_count + 1 WHERE id = NEW.session_id;
+END;
+CREATE TRIGGER IF NOT EXISTS attendance_records_summary_delete
+AFTER DELETE ON attendance_records WHEN OLD.status = 'present'
+BEGIN
+    UPDATE attendance_daily_counts SET present = present - 1
+        WHERE student_id = OLD.student_id
+        AND (course, date) = (SELECT course, date FROM attendance_sessions WHERE id = OLD.session_id);
+    UPDATE attendance_sessions SET present_count = present_count - 1 WHERE id = OLD.session_id;
+END;
+CREATE TRIGGER IF NOT EXISTS attendance_records_summary_update
+AFTER UPDATE OF status ON attendance_records WHEN (OLD.status = 'present') != (NEW.status = 'present')
+BEGIN
+    INSERT INTO attendance_daily_counts (student_id, course, date, present)
+        SELECT NEW.student_id, course, date, 0 FROM attendance_sessions WHERE id = NEW.session_id
+        ON CONFLICT (student_id, course, date) DO NOTHING;
+    UPDATE attendance_daily_counts SET present = present + (CASE WHEN NEW.status = 'present' THEN 1 ELSE -1 END)
+        WHERE student_id = NEW.student_id
+        AND (course, date) = (SELECT course, date FROM attendance_sessions WHERE id = NEW.session_id);
+    UPDATE attendance_sessions SET present_count = present_count + (CASE WHEN NEW.status = 'present' THEN 1 ELSE -1 END)
+        WHERE id = NEW.session_id;
+END;
+CREATE TRIGGER IF NOT EXISTS attendance_sessions_summary_insert
+AFTER INSERT ON attendance_sessions
+BEGIN
+    INSERT INTO course_daily_sessions (course, date, sessions) VALUES (NEW.course, NEW.date, 1)
+        ON CONFLICT (course, date) DO UPDATE SET sessions = sessions + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS attendance_sessions_summary_delete
+AFTER DELETE ON attendance_sessions
+BEGIN
+    UPDATE course_daily_sessions SET sessions = sessions - 1 WHERE course = OLD.course AND date = OLD.date;
+END;
+CREATE TRIGGER IF NOT EXISTS attendance_sessions_summary_update
+AFTER UPDATE OF course, date ON attendance_sessions WHEN OLD.course IS NOT NEW.course OR OLD.date IS NOT NEW.date
+BEGIN
+    UPDATE course_daily_sessions SET sessions = sessions - 1 WHERE course = OLD.course AND date = OLD.date;
+    INSERT INTO course_daily_sessions (course, date, sessions) VALUES (NEW.course, NEW.date, 1)
+        ON CONFLICT (course, date) DO UPDATE SET sessions = sessions + 1;
+    UPDATE attendance_daily_counts SET present = present - 1
+        WHERE course = OLD.course AND date = OLD.date AND student_id IN (
+            SELECT student_id FROM attendance_records WHERE session_id = NEW.id AND status = 'present');
+    INSERT INTO attendance_daily_counts (student_id, course, date, present)
+        SELECT student_id, NEW.course, NEW.date, 1 FROM attendance_records
+            WHERE session_id = NEW.id AND status = 'present'
+        ON CONFLICT (student_id, course, date) DO UPDATE SET present = present + 1;
+END;
+"""
+
+# Rebuilds the trigger-maintained summaries, for databases created before the triggers
+SUMMARY_BACKFILL = """
+DELETE FROM attendance_daily_counts;
+INSERT INTO attendance_daily_counts (student_id, course, date, present)
+    SELECT r.student_id, s.course, s.date, COUNT(*)
+    FROM attendance_records r JOIN attendance_sessions s ON s.id = r.session_id
+    WHERE r.status = 'present'
+    GROUP BY r.student_id, s.course, s.date;
+DELETE FROM course_daily_sessions;
+INSERT INTO course_daily_sessions (course, date, sessions)
+    SELECT course, date, COUNT(*) FROM attendance_sessions GROUP BY course, date;
+UPDATE attendance_sessions SET present_count = (
+    SELECT COUNT(*) FROM attendance_records
+    WHERE session_id = attendance_sessions.id AND status = 'present');
+"""
+
+# Foreign keys used to resolve embedded selects such as "*, students(id, first_name)"
+RELATIONS = {
+    ('attendance_records', 'students'): ('student_id', 'id'),
+    ('attendance_records', 'attendance_sessions'): ('session_id', 'id'),
+    ('student_face_encodings', 'students'): ('student_id', 'id'),
+}
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class LocalBackendError(Exception):
+    """Raised for constraint violations and unsupported queries, like Supabase's APIError."""
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+
+
+def _identifier(name):
+    if not _IDENTIFIER.match(name):
+        raise LocalBackendError(f"Invalid identifier: {name}")
+    return f'"{name}"'
+
+
+def _split_columns(columns):
+    """Split a select string on top-level commas into columns and embedded tables."""
+    parts, depth, current = [], 0, ''
+    for char in columns:
+        if char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        depth += char == '('
+        depth -= char == ')'
+        current += char
+    if current.strip():
+        parts.append(current.strip())
+
+    plain, embedded = [], {}
+    for part in parts:
+        match = re.match(r'^(\w+)\s*\((.*)\)$', part, re.S)
+        if match:
+            embedded[match.group(1)] = match.group(2)
+        else:
+            plain.append(part)
+    return plain, embedded
+
+
+class Query:
+    def __init__(self, client, table, action, payload=None, columns='*'):
+        self.client = client
+        self.table = table
+        self.action = action
+        self.payload = payload
+        self.columns = columns
+        self.filters = []
+        self.ordering = []
+        self.offset = None
+        self.count = None
+        self.ignore_duplicates = False
+
+    def eq(self, column, value):
+        self.filters.append((f"{_identifier(column)} = ?", [value]))
+        return self
+
+    def in_(self, column, values):
+        values = list(values)
+        if not values:
+            self.filters.append(("0", []))
+        else:
+            self.filters.append((f"{_identifier(column)} IN ({', '.join('?' * len(values))})", values))
+        return self
+
+    def gt(self, column, value):
+        self.filters.append((f"{_identifier(column)} > ?", [value]))
+        return self
+
+    def gte(self, column, value):
+        self.filters.append((f"{_identifier(column)} >= ?", [value]))
+        return self
+
+    def lte(self, column, value):
+        self.filters.append((f"{_identifier(column)} <= ?", [value]))
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering.append(f"{_identifier(column)} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def range(self, start, end):
+        self.offset = start
+        self.count = end - start + 1
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def _where(self):
+        if not self.filters:
+            return '', []
+        clauses = [clause for clause, _ in self.filters]
+        params = [value for _, values in self.filters for value in values]
+        return ' WHERE ' + ' AND '.join(clauses), params
+
+    def execute(self):
+        with self.client.lock:
+            try:
+                return Response(getattr(self, f"_{self.action}")())
+            except sqlite3.IntegrityError as e:
+                self.client.db.rollback()
+                raise LocalBackendError(str(e))
+
+    def _select(self):
+        plain, embedded = _split_columns(self.columns)
+        # Foreign keys needed to resolve embeds must be fetched even if not requested
+        needed = set()
+        for other in embedded:
+            if (self.table, other) not in RELATIONS:
+                raise LocalBackendError(f"No relation between {self.table} and {other}")
+            needed.add(RELATIONS[(self.table, other)][0])
+        if '*' in plain:
+            column_sql = '*'
+        else:
+            column_sql = ', '.join(_identifier(c) for c in list(dict.fromkeys(plain + sorted(needed))))
+
+        where, params = self._where()
+        sql = f"SELECT {column_sql} FROM {_identifier(self.table)}{where}"
+        if self.ordering:
+            sql += ' ORDER BY ' + ', '.join(self.ordering)
+        if self.count is not None:
+            sql += f" LIMIT {int(self.count)} OFFSET {int(self.offset or 0)}"
+        rows = [dict(row) for row in self.client.db.execute(sql, params)]
+
+        for other, other_columns in embedded.items():
+            local_key, remote_key = RELATIONS[(self.table, other)]
+            keys = list({row[local_key] for row in rows if row[local_key] is not None})
+            related = {}
+            if keys:
+                sub_plain, _ = _split_columns(other_columns)
+                sub_columns = '*' if '*' in sub_plain else ', '.join(
+                    _identifier(c) for c in dict.fromkeys(sub_plain + [remote_key]))
+                placeholders = ', '.join('?' * len(keys))
+                for related_row in self.client.db.execute(
+                        f"SELECT {sub_columns} FROM {_identifier(other)} "
+                        f"WHERE {_identifier(remote_key)} IN ({placeholders})", keys):
+                    related_row = dict(related_row)
+                    key = related_row[remote_key]
+                    if '*' not in sub_plain and remote_key not in sub_plain:
+                        del related_row[remote_key]
+                    related[key] = related_row
+            for row in rows:
+                row[other] = related.get(row[local_key])
+
+        if '*' not in plain:
+            for row in rows:
+                for column in needed - set(plain):
+                    row.pop(column, None)
+        return rows
+
+    def _write(self, verb):
+        rows = self.payload if isinstance(self.payload, list) else [self.payload]
+        written = []
+        for row in rows:
+            columns = ', '.join(_identifier(c) for c in row)
+            placeholders = ', '.join('?' * len(row))
+            cursor = self.client.db.execute(
+                f"{verb} INTO {_identifier(self.table)} ({columns}) VALUES ({placeholders})", list(row.values()))
+            if cursor.rowcount == 0:
+                # Skipped by INSERT OR IGNORE; like PostgREST, only written rows are returned
+                continue
+            written.append(dict(self.client.db.execute(
+                f"SELECT * FROM {_identifier(self.table)} WHERE rowid = ?", [cursor.lastrowid]).fetchone()))
+        self.client.db.commit()
+        return written
+
+    def _insert(self):
+        return self._write('INSERT')
+
+    def _upsert(self):
+        return self._write('INSERT OR IGNORE' if self.ignore_duplicates else 'INSERT OR REPLACE')
+
+    def _update(self):
+        where, params = self._where()
+        assignments = ', '.join(f"{_identifier(c)} = ?" for c in self.payload)
+        table = _identifier(self.table)
+        rowids = [r[0] for r in self.client.db.execute(f"SELECT rowid FROM {table}{where}", params)]
+        self.client.db.execute(f"UPDATE {table} SET {assignments}{where}", list(self.payload.values()) + params)
+        self.client.db.commit()
+        if not rowids:
+            return []
+        placeholders = ', '.join('?' * len(rowids))
+        return [dict(r) for r in self.client.db.execute(
+            f"SELECT * FROM {table} WHERE rowid IN ({placeholders})", rowids)]
+
+    def _delete(self):
+        where, params = self._where()
+        table = _identifier(self.table)
+        rows = [dict(r) for r in self.client.db.execute(f"SELECT * FROM {table}{where}", params)]
+        self.client.db.execute(f"DELETE FROM {table}{where}", params)
+        self.client.db.commit()
+        return rows
+
+
+class Table:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def select(self, columns='*'):
+        return Query(self.client, self.name, 'select', columns=columns)
+
+    def insert(self, rows):
+        return Query(self.client, self.name, 'insert', rows)
+
+    def upsert(self, rows, on_conflict='', ignore_duplicates=False):
+        # Conflicts are detected on the table's primary key and unique constraints, as in
+        # Postgres; on_conflict is accepted for compatibility
+        query = Query(self.client, self.name, 'upsert', rows)
+        query.ignore_duplicates = ignore_duplicates
+        return query
+
+    def update(self, data):
+        return Query(self.client, self.name, 'update', data)
+
+    def delete(self):
+        return Query(self.client, self.name, 'delete')
+
+
+class Bucket:
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self.path = os.path.join(storage.root, name)
+
+    def _file(self, file_name):
+        path = os.path.normpath(os.path.join(self.path, file_name))
+        if not path.startswith(os.path.normpath(self.path) + os.sep):
+            raise LocalBackendError(f"Invalid object path: {file_name}")
+        return path
+
+    def upload(self, file_name, content, options=None):
+        path = self._file(file_name)
+        upsert = str((options or {}).get('upsert', False)).lower() == 'true'
+        if os.path.exists(path) and not upsert:
+            raise LocalBackendError(f"The resource already exists: {file_name}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return {'Key': f"{self.name}/{file_name}"}
+
+    def download(self, file_name):
+        with open(self._file(file_name), 'rb') as f:
+            return f.read()
+
+    def remove(self, file_names):
+        for file_name in file_names:
+            path = self._file(file_name)
+            if os.path.exists(path):
+                os.remove(path)
+        return [{'name': name} for name in file_names]
+
+    def list(self, path=None, options=None):
+        folder = self._file(path) if path else self.path
+        if not os.path.isdir(folder):
+            return []
+        return [{'name': name} for name in sorted(os.listdir(folder))]
+
+    def get_public_url(self, file_name):
+        return f"{self.storage.public_url}/{self.name}/{file_name}"
+
+
+class Storage:
+    def __init__(self, root, public_url):
+        self.root = root
+        self.public_url = public_url.rstrip('/')
+        os.makedirs(root, exist_ok=True)
+
+    def create_bucket(self, name, options=None):
+        path = os.path.join(self.root, name)
+        if os.path.isdir(path):
+            raise LocalBackendError(f"Bucket already exists: {name}")
+        os.makedirs(path)
+        return {'name': name}
+
+    def list_buckets(self):
+        return [{'name': name} for name in sorted(os.listdir(self.root))
+                if os.path.isdir(os.path.join(self.root, name))]
+
+    def from_(self, name):
+        return Bucket(self, name)
+
+
+class LocalClient:
+    """Drop-in replacement for supabase.Client used by supabase_helper."""
+
+    def __init__(self, data_dir, public_url='/local-storage'):
+        os.makedirs(data_dir, exist_ok=True)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(os.path.join(data_dir, 'database.sqlite3'), check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA foreign_keys=ON')
+        has_summaries = self.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'attendance_records_summary_insert'").fetchone()
+        self.db.executescript(SCHEMA)
+        for table, column, definition, backfill in MIGRATIONS:
+            columns = [row['name'] for row in self.db.execute(f'PRAGMA table_info({table})')]
+            if column not in columns:
+                self.db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+                if backfill:
+                    self.db.execute(backfill)
+        self.db.commit()
+        self.db.executescript(TRIGGERS)
+        if not has_summaries:
+            self.db.executescript(SUMMARY_BACKFILL)
+        self.storage = Storage(os.path.join(data_dir, 'buckets'), public_url)
+
+    def table(self, name):
+        return Table(self, name)
+
+
+def create_local_client(data_dir, public_url='/local-storage'):
+    return LocalClient(data_dir, public_url)
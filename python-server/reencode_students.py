@@ -0,0 +1,166 @@
+import argparse
+import os
+import shutil
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import supabase_helper as sb
+from face_encoder import encode_faces
+
+DATA_FOLDER = 'data'
+
+# Encodings are written to Supabase in batches of this size before being checkpointed
+SAVE_BATCH_SIZE = 100
+
+
+def checkpoint_path(version):
+    """Line-delimited log of students already saved for version."""
+    return os.path.join(DATA_FOLDER, f"reencode-{version}.log")
+
+
+def read_checkpoint(version):
+    """Return the ids of students an earlier run saved successfully.
+
+    Students whose download or encode failed are left out, so a resumed run
+    retries them.
+    """
+    path = checkpoint_path(version)
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r') as f:
+        fields = (line.rstrip('\n').split('\t') for line in f if line.strip())
+        return {row[0] for row in fields if len(row) > 1 and row[1] == 'ok'}
+
+
+def reencode_students(version, encode_fn, workers=None, activate=True, progress=None, allow_failures=False):
+    """Re-encode every student's stored image into a new gallery version.
+
+    Images are streamed from storage a page at a time and encoded across a
+    process pool. Results are saved in batches and checkpointed so the job can
+    resume after a crash; students that failed are retried by the next run.
+    Recognition keeps using the current version until the job finishes with
+    every student encoded (or, with allow_failures, processed) and the active
+    version is switched.
+    """
+    active = sb.get_active_encoding_version()
+    if version == active:
+        raise ValueError(f"Gallery version {version} is already active")
+
+    os.makedirs(DATA_FOLDER, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    processed = read_checkpoint(version)
+    temp_dir = tempfile.mkdtemp(prefix='reencode_')
+    done = 0
+    failed = []
+    batch = []
+    batch_log = []
+
+    def flush(checkpoint):
+        sb.save_face_encodings(version, batch)
+        checkpoint.writelines(batch_log)
+        checkpoint.flush()
+        batch.clear()
+        batch_log.clear()
+
+    try:
+        with open(checkpoint_path(version), 'a') as checkpoint, \
+                ProcessPoolExecutor(max_workers=workers) as executor:
+            # Keep sweeping until a pass finds nothing new, so students enrolled
+            # while the job was running are included before the switch
+            while True:
+                students = (
+                    s for s in sb.iter_students('id, first_name, last_name, image_url')
+                    if s['id'] not in processed and s.get('image_url')
+                )
+                pending = {}
+                handled = 0
+                while True:
+                    for student in students:
+                        image_path = os.path.join(temp_dir, f"{student['id']}.jpg")
+                        try:
+                            sb.download_student_image(student['image_url'], image_path)
+                        except Exception as e:
+                            failed.append(student['id'])
+                            done += 1
+                            checkpoint.write(f"{student['id']}\tfailed\t{str(e)}\n")
+                            processed.add(student['id'])
+                            if progress:
+                                progress(done, student['id'], str(e))
+                            continue
+                        name = f"{student['first_name']} {student['last_name']}"
+                        # Enrolled photos are re-encoded as they are, not re-judged by the quality gate
+                        future = executor.submit(encode_fn, image_path, student['id'], name, check_quality=False)
+                        pending[future] = (student['id'], image_path)
+                        if len(pending) >= workers * 4:
+                            break
+                    if not pending:
+                        break
+
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        student_id, image_path = pending.pop(future)
+                        os.remove(image_path)
+                        try:
+                            success, face_encoding_or_message = future.result()
+                        except Exception as e:
+                            success, face_encoding_or_message = False, str(e)
+
+                        if success:
+                            batch.append((student_id, face_encoding_or_message))
+                            batch_log.append(f"{student_id}\tok\n")
+                            message = None
+                        else:
+                            failed.append(student_id)
+                            message = face_encoding_or_message
+                            checkpoint.write(f"{student_id}\tfailed\t{message}\n")
+
+                        processed.add(student_id)
+                        handled += 1
+                        done += 1
+                        if progress:
+                            progress(done, student_id, message)
+
+                    if len(batch) >= SAVE_BATCH_SIZE:
+                        flush(checkpoint)
+
+                if batch:
+                    flush(checkpoint)
+                if handled == 0:
+                    break
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if activate and failed and not allow_failures:
+        # Those students would keep old-encoder vectors or stop matching
+        print(f"Not activating gallery {version}: {len(failed)} student(s) failed to re-encode "
+              f"({', '.join(map(str, failed))}). Fix their photos and run again to retry them.")
+        activate = False
+    if activate:
+        sb.set_active_encoding_version(version)
+        os.remove(checkpoint_path(version))
+        print(f"Gallery {version} is now active (previous: {active})")
+
+    return {'version': version, 'processed': done, 'failed': len(failed), 'failed_ids': failed,
+            'activated': activate}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-encode all stored student images into a new gallery version.')
+    parser.add_argument('version', help='Name of the new gallery version, e.g. v2')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--no-activate', action='store_true',
+                        help='Build the new version without switching recognition to it')
+    parser.add_argument('--allow-failures', action='store_true',
+                        help='Switch to the new version even if some students failed to re-encode')
+    args = parser.parse_args()
+
+    def report(done, student_id, message):
+        print(f"[{done}] {student_id}: {message or 'ok'}")
+
+    summary = reencode_students(args.version, encode_faces, args.workers, not args.no_activate, report,
+                                args.allow_failures)
+    print(f"Re-encoded {summary['processed'] - summary['failed']} students, {summary['failed']} failed")
+
+
+if __name__ == '__main__':
+    main()
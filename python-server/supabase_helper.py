@@ -1,137 +1,302 @@
 import os
+import sys
 import json
 import base64
+import hashlib
+import threading
 import numpy as np
-from supabase import create_client, Client
+from concurrent.futures import ThreadPoolExecutor
 import io
 from dotenv import load_dotenv
 
+# recognition, metrics and the other modules shared by both servers live in
+# the repository's top-level common/ directory
+COMMON_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common")
+if COMMON_DIR not in sys.path:
+    sys.path.insert(0, COMMON_DIR)
+
+import image_derivatives
+import recognition
+from result_cache import ResultCache
+
 # Load environment variables
 load_dotenv()
 
-# Initialize Supabase client
-supabase_url = os.environ.get("SUPABASE_URL")
-supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+# "supabase" (default) talks to the hosted project; "local" uses the SQLite and
+# local-directory stand-in in local_backend.py for offline development and load tests
+DATABASE_BACKEND = os.environ.get("DATABASE_BACKEND", "supabase").lower()
+
+if DATABASE_BACKEND == "local":
+    local_backend_dir = os.environ.get("LOCAL_BACKEND_DIR", os.path.join("data", "local_backend"))
+    print(f"DEBUG - Using local backend in {local_backend_dir}")
+else:
+    supabase_url = os.environ.get("SUPABASE_URL")
+    supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+    
+    print(f"DEBUG - Supabase URL is set: {'Yes' if supabase_url else 'No'}")
+    print(f"DEBUG - Supabase key is set: {'Yes' if supabase_key else 'No'}")
+    
+    # Check if the environment variables are loaded
+    if not supabase_url or not supabase_key:
+        raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set in environment variables")
+
+# The client (and the supabase package) is created on first use rather than at
+# import so the server can start serving before it is needed
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the Supabase client (or local stand-in), creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if DATABASE_BACKEND == "local":
+                    from local_backend import create_local_client
+                    _client = create_local_client(local_backend_dir)
+                else:
+                    from supabase import create_client
+                    _client = create_client(supabase_url, supabase_key)
+    return _client
 
-print(f"DEBUG - Supabase URL is set: {'Yes' if supabase_url else 'No'}")
-print(f"DEBUG - Supabase key is set: {'Yes' if supabase_key else 'No'}")
+def __getattr__(name):
+    # Keeps sb.supabase working for callers that use the client directly
+    if name == "supabase":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Check if the environment variables are loaded
-if not supabase_url or not supabase_key:
-    raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set in environment variables")
+# Buckets already created (or confirmed to exist) by this process
+_known_buckets = set()
 
-# Now create the client
-supabase: Client = create_client(supabase_url, supabase_key)
+# Maximum rows per insert request for batch operations
+INSERT_BATCH_SIZE = 500
+
+# Version of the encodings stored in students.face_encoding
+DEFAULT_ENCODING_VERSION = 'v1'
 
 # Helper functions for Supabase operations
 
 def encode_face_encoding(face_encoding):
     """Convert numpy array to base64 string for storage in Supabase"""
+    # Encodings are grayscale crops, so uint8 pixels are stored (8x smaller than float64)
+    face_encoding = np.asarray(face_encoding)
+    if face_encoding.dtype != np.uint8:
+        face_encoding = np.clip(np.rint(face_encoding), 0, 255).astype(np.uint8)
     return base64.b64encode(face_encoding.tobytes()).decode('utf-8')
 
 def decode_face_encoding(encoded_string):
-    """Convert base64 string back to numpy array"""
+    """Convert base64 string back to numpy array
+    
+    Encodings are stored as uint8 crop pixels; older rows hold float64 values. Every
+    uint8 row is exactly one crop, so any other length is read as float64.
+    """
     decoded = base64.b64decode(encoded_string)
+    if len(decoded) == recognition.ENCODING_SIZE:
+        return np.frombuffer(decoded, dtype=np.uint8)
     return np.frombuffer(decoded, dtype=np.float64)
 
 # Storage functions for images
-def upload_student_image(student_id, image_path):
-    """Upload student image to Supabase Storage
-    
-    Args:
-        student_id: The ID of the student
-        image_path: Local path to the image file
-        
-    Returns:
-        The public URL of the uploaded image
-    """
-    bucket_name = "student-images"
-    
-    # Create the bucket if it doesn't exist (will ignore if it exists)
+def _ensure_bucket(bucket_name):
+    """Create a public bucket once per process (will ignore if it exists)"""
+    if bucket_name in _known_buckets:
+        return
     try:
-        supabase.storage.create_bucket(bucket_name, {'public': True})
+        get_client().storage.create_bucket(bucket_name, {'public': True})
     except Exception as e:
         print(f"Bucket already exists or error creating bucket: {str(e)}")
         # Continue anyway, the bucket might already exist
+    _known_buckets.add(bucket_name)
+
+# Images this process has already stored, by (bucket, content key)
+_stored_images = ResultCache('stored_images', max_entries=4096, ttl=86400)
+
+# Stored objects never change (their name is their content hash), so they may be cached for good
+IMMUTABLE_CACHE_SECONDS = '31536000'
+
+def content_key(content):
+    """Storage name for image bytes: a hash of the bytes themselves"""
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+def _upload_new(bucket, file_name, content):
+    """Upload an object; returns False if identical bytes were already stored there"""
+    try:
+        bucket.upload(file_name, content, {"content-type": "image/jpeg", "cache-control": IMMUTABLE_CACHE_SECONDS})
+    except Exception as e:
+        # Identical bytes stored earlier or by a concurrent request
+        if 'exist' not in str(e).lower() and 'duplicate' not in str(e).lower():
+            raise
+        return False
+    return True
+
+# Derivatives are generated and uploaded here, off the request that stored the original
+_derivative_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('DERIVATIVE_WORKERS', '4')),
+                                      thread_name_prefix='image-derivatives')
+
+def _store_derivatives(bucket, bucket_name, key, folder, content, derivatives, check_existing=True):
+    """Generate and upload the derivatives missing from folder
     
-    # Read the image file
-    with open(image_path, "rb") as f:
-        file_content = f.read()
-    
-    # Get file extension
-    _, file_extension = os.path.splitext(image_path)
-    
-    # Upload the image with student ID as filename
-    file_name = f"{student_id}{file_extension}"
+    The image is remembered as stored only once all of them are there, so a
+    failed or interrupted run is repeated the next time the same bytes arrive.
+    """
     try:
-        res = supabase.storage.from_(bucket_name).upload(
-            file_name,
-            file_content,
-            {"content-type": "image/jpeg", "upsert": True}
-        )
+        if check_existing:
+            existing = {item['name'] for item in bucket.list(folder)}
+            derivatives = [name for name in derivatives if f"{name}.jpg" not in existing]
+        if derivatives:
+            for name, data in image_derivatives.make_derivatives(content, derivatives).items():
+                _upload_new(bucket, f"{folder}/{name}.jpg", data)
+        _stored_images.put((bucket_name, key), True)
     except Exception as e:
-        print(f"Error uploading file: {str(e)}")
-        # Return local path as fallback
-        return f"/uploads/students/{os.path.basename(image_path)}"
+        print(f"Error storing derivatives of {folder}: {str(e)}")
+
+def store_image(bucket_name, content, derivatives=(), wait=False):
+    """Store image bytes content-addressed, along with resized derivatives
     
-    # Get public URL
-    public_url = supabase.storage.from_(bucket_name).get_public_url(file_name)
+    Identical bytes always map to the same folder, so an image that is already
+    stored is not uploaded again; only derivatives missing from its folder are
+    generated. Only the original upload is waited for; derivatives are generated
+    and uploaded in the background (unless wait is set), so their URLs may not
+    resolve for the first moments.
     
-    return public_url
+    Returns:
+        Public URLs by derivative name, 'original' included
+    """
+    _ensure_bucket(bucket_name)
+    bucket = get_client().storage.from_(bucket_name)
+    key = content_key(content)
+    folder = f"{key[:2]}/{key}"
+    
+    if _stored_images.get((bucket_name, key)) is None:
+        created = _upload_new(bucket, f"{folder}/original.jpg", content)
+        if not derivatives:
+            _stored_images.put((bucket_name, key), True)
+        else:
+            # An original that already exists may lack derivatives whose upload failed
+            # or was interrupted; a new one has none yet, so there is nothing to check
+            args = (bucket, bucket_name, key, folder, content, tuple(derivatives), not created)
+            if wait:
+                _store_derivatives(*args)
+            else:
+                _derivative_pool.submit(_store_derivatives, *args)
+    
+    names = ('original',) + tuple(derivatives)
+    return {name: bucket.get_public_url(f"{folder}/{name}.jpg") for name in names}
+
+def derivative_urls(image_url, names):
+    """URLs of the derivatives stored next to an original returned by store_image
+    
+    Images uploaded before content-addressed storage have no derivatives; only
+    their original URL is returned.
+    """
+    if not image_url:
+        return {}
+    base, _, file_name = image_url.rpartition('/')
+    if file_name != 'original.jpg':
+        return {'original': image_url}
+    return {'original': image_url, **{name: f"{base}/{name}.jpg" for name in names}}
 
-def upload_attendance_image(session_id, image_path):
-    """Upload attendance image to Supabase Storage
+def upload_student_image(image_path):
+    """Upload a student photo with avatar, face and review-size derivatives
     
     Args:
-        session_id: The ID of the attendance session
         image_path: Local path to the image file
         
     Returns:
-        The public URL of the uploaded image
+        Public URLs by derivative name, 'original' included
     """
-    bucket_name = "attendance-images"
-    
-    # Create the bucket if it doesn't exist (will ignore if it exists)
+    with open(image_path, "rb") as f:
+        content = f.read()
     try:
-        supabase.storage.create_bucket(bucket_name, {'public': True})
+        return store_image("student-images", content, image_derivatives.STUDENT_DERIVATIVES)
     except Exception as e:
-        print(f"Bucket already exists or error creating bucket: {str(e)}")
-        # Continue anyway, the bucket might already exist
+        print(f"Error uploading file: {str(e)}")
+        # Return local path as fallback
+        return {'original': f"/uploads/students/{os.path.basename(image_path)}"}
+
+def upload_attendance_image(image_path):
+    """Upload an attendance photo with thumbnail and review-size derivatives
     
-    # Read the image file
+    Args:
+        image_path: Local path to the image file
+        
+    Returns:
+        Public URLs by derivative name, 'original' included
+    """
     with open(image_path, "rb") as f:
-        file_content = f.read()
-    
-    # Generate unique filename with timestamp
-    timestamp = os.path.basename(image_path).split('_')[-1]
-    file_name = f"{session_id}_{timestamp}"
-    
-    # Upload the image
+        content = f.read()
     try:
-        res = supabase.storage.from_(bucket_name).upload(
-            file_name,
-            file_content,
-            {"content-type": "image/jpeg", "upsert": True}
-        )
+        return store_image("attendance-images", content, image_derivatives.ATTENDANCE_DERIVATIVES)
     except Exception as e:
         print(f"Error uploading file: {str(e)}")
         # Return local path as fallback
-        return f"/uploads/attendance/{os.path.basename(image_path)}"
+        return {'original': f"/uploads/attendance/{os.path.basename(image_path)}"}
+
+def download_student_image(image_url, save_path):
+    """Download a student's stored image to a local file
     
-    # Get public URL
-    public_url = supabase.storage.from_(bucket_name).get_public_url(file_name)
+    Args:
+        image_url: The public URL returned by upload_student_image
+        save_path: Local path to write the image to
+        
+    Returns:
+        save_path
+    """
+    # Everything after the bucket name: "<id>.jpg" for older uploads, "<xx>/<hash>/original.jpg" now
+    file_name = image_url.split('?')[0].split('/student-images/', 1)[-1]
+    content = get_client().storage.from_("student-images").download(file_name)
+    with open(save_path, "wb") as f:
+        f.write(content)
+    return save_path
+
+def upload_student_images(images, max_workers=8):
+    """Upload many student images concurrently
+    
+    Args:
+        images: List of (student_id, image_path) tuples
+        max_workers: Number of concurrent uploads
+        
+    Returns:
+        Dict mapping student ID to its public URLs by derivative name
+    """
+    if not images:
+        return {}
     
-    return public_url
+    _ensure_bucket("student-images")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        urls = executor.map(lambda item: upload_student_image(item[1]), images)
+        return {student_id: url for (student_id, _), url in zip(images, urls)}
 
 # Student operations
-def get_all_students():
-    """Get all students from Supabase"""
-    response = supabase.table('students').select('*').execute()
-    return response.data
+# Columns returned by student listings unless others are asked for; face_encoding
+# is large and only needed by recognition
+STUDENT_COLUMNS = ('id', 'first_name', 'last_name', 'email', 'phone', 'batch',
+                   'semester', 'department', 'image_url', 'created_at', 'updated_at')
+STUDENT_FILTERS = ('batch', 'department', 'semester')
+
+def get_all_students(columns=STUDENT_COLUMNS):
+    """Get all students from Supabase, without face encodings unless requested"""
+    return list(iter_students(', '.join(columns)))
+
+def list_students(columns=STUDENT_COLUMNS, after=None, limit=100, filters=None):
+    """One page of students ordered by id, starting after the id `after`
+
+    Returns (rows, has_more). filters maps columns in STUDENT_FILTERS to values.
+    """
+    columns = list(dict.fromkeys(['id', *columns]))
+    query = get_client().table('students').select(', '.join(columns))
+    for column, value in (filters or {}).items():
+        if column not in STUDENT_FILTERS:
+            raise ValueError(f"Cannot filter students by {column}")
+        query = query.eq(column, value)
+    if after is not None:
+        query = query.gt('id', after)
+    # One extra row tells whether another page exists
+    rows = query.order('id').limit(limit + 1).execute().data
+    return rows[:limit], len(rows) > limit
 
 def get_student(student_id):
     """Get a student by ID"""
-    response = supabase.table('students').select('*').eq('id', student_id).execute()
+    response = get_client().table('students').select('*').eq('id', student_id).execute()
     if response.data:
         return response.data[0]
     return None
@@ -142,17 +307,72 @@ def create_student(student_data, face_encoding=None):
     if face_encoding is not None:
         student_data['face_encoding'] = encode_face_encoding(face_encoding)
     
-    response = supabase.table('students').insert(student_data).execute()
+    response = get_client().table('students').insert(student_data).execute()
     return response.data[0] if response.data else None
 
+def create_students(students):
+    """Create many students in batched inserts
+    
+    A batch that fails (e.g. one duplicate id) is retried row by row, so one bad
+    row only fails its own student.
+    
+    Args:
+        students: List of (student_data, face_encoding) tuples
+        
+    Returns:
+        (created rows, failures as {'id', 'message'})
+    """
+    rows = []
+    for student_data, face_encoding in students:
+        if face_encoding is not None:
+            student_data['face_encoding'] = encode_face_encoding(face_encoding)
+        rows.append(student_data)
+    
+    table = get_client().table('students')
+    created, failed = [], []
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        batch = rows[start:start + INSERT_BATCH_SIZE]
+        try:
+            created.extend(table.insert(batch).execute().data or [])
+            continue
+        except Exception as e:
+            print(f"Batch insert of {len(batch)} students failed ({str(e)}), inserting one by one")
+        for row in batch:
+            try:
+                created.extend(table.insert(row).execute().data or [])
+            except Exception as e:
+                failed.append({'id': row.get('id'), 'message': f"Could not save student: {str(e)}"})
+    return created, failed
+
 def update_student(student_id, student_data):
     """Update student data"""
-    response = supabase.table('students').update(student_data).eq('id', student_id).execute()
+    response = get_client().table('students').update(student_data).eq('id', student_id).execute()
     return response.data[0] if response.data else None
 
+def iter_students(columns='*', page_size=500):
+    """Stream all students page by page so large tables aren't held in memory"""
+    start = 0
+    while True:
+        response = get_client().table('students').select(columns).order('id').range(start, start + page_size - 1).execute()
+        yield from response.data
+        if len(response.data) < page_size:
+            return
+        start += page_size
+
 def get_all_face_encodings():
-    """Get all students with their face encodings"""
-    response = supabase.table('students').select('id, first_name, last_name, face_encoding').execute()
+    """Get all students with their face encodings from the active gallery version"""
+    # Both tables are read page by page; an unpaged select stops at PostgREST's max rows
+    students = _iter_rows(lambda: get_client().table('students').select(
+        'id, first_name, last_name, face_encoding').order('id'))
+    
+    # Students re-encoded into a newer version use that encoding; anyone enrolled
+    # while the new version was being built keeps their original encoding
+    version = get_active_encoding_version()
+    versioned = {}
+    if version != DEFAULT_ENCODING_VERSION:
+        versioned = {row['student_id']: row['face_encoding'] for row in _iter_rows(
+            lambda: get_client().table('student_face_encodings').select(
+                'student_id, face_encoding').eq('version', version).order('student_id'))}
     
     result = {
         'encodings': [],
@@ -160,36 +380,74 @@ def get_all_face_encodings():
         'student_ids': []
     }
     
-    for student in response.data:
-        if student.get('face_encoding'):
-            result['encodings'].append(decode_face_encoding(student['face_encoding']))
+    for student in students:
+        face_encoding = versioned.get(student['id']) or student.get('face_encoding')
+        if face_encoding:
+            try:
+                face_encoding = decode_face_encoding(face_encoding)
+            except ValueError as e:
+                # One corrupt row must not keep everyone else out of the gallery
+                print(f"Skipping unreadable face encoding of student {student['id']}: {e}")
+                continue
+            result['encodings'].append(face_encoding)
             result['names'].append(f"{student['first_name']} {student['last_name']}")
             result['student_ids'].append(student['id'])
     
     return result
 
+# Gallery versions
+def get_active_encoding_version():
+    """Get the face encoding version currently used for recognition"""
+    response = get_client().table('gallery_settings').select('value').eq('key', 'active_encoding_version').execute()
+    if response.data:
+        return response.data[0]['value']
+    return DEFAULT_ENCODING_VERSION
+
+def set_active_encoding_version(version):
+    """Switch recognition to a face encoding version in a single upsert"""
+    get_client().table('gallery_settings').upsert({'key': 'active_encoding_version', 'value': version}).execute()
+
+def save_face_encodings(version, encodings):
+    """Save re-encoded faces for a gallery version
+    
+    Args:
+        version: The gallery version being built
+        encodings: List of (student_id, face_encoding) tuples
+    """
+    rows = [
+        {'student_id': student_id, 'version': version, 'face_encoding': encode_face_encoding(face_encoding)}
+        for student_id, face_encoding in encodings
+    ]
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        get_client().table('student_face_encodings').upsert(rows[start:start + INSERT_BATCH_SIZE]).execute()
+
 # Attendance operations
 def create_attendance_session(session_data):
     """Create a new attendance session"""
-    response = supabase.table('attendance_sessions').insert(session_data).execute()
+    response = get_client().table('attendance_sessions').insert(session_data).execute()
     return response.data[0] if response.data else None
 
 def get_attendance_sessions():
     """Get all attendance sessions"""
-    response = supabase.table('attendance_sessions').select('*').order('date', desc=True).execute()
+    response = get_client().table('attendance_sessions').select('*').order('date', desc=True).execute()
     return response.data
 
 def save_attendance_records(records):
-    """Save multiple attendance records"""
+    """Save multiple attendance records
+    
+    A student already marked in the session keeps the first record; only newly
+    saved records are returned.
+    """
     if not records:
         return []
     
-    response = supabase.table('attendance_records').insert(records).execute()
+    response = get_client().table('attendance_records').upsert(
+        records, on_conflict='session_id,student_id', ignore_duplicates=True).execute()
     return response.data
 
 def get_session_attendance(session_id):
     """Get attendance records for a session with student details"""
-    response = supabase.table('attendance_records').select('''
+    response = get_client().table('attendance_records').select('''
         *,
         students(id, first_name, last_name)
     ''').eq('session_id', session_id).execute()
@@ -198,9 +456,103 @@ def get_session_attendance(session_id):
 
 def get_student_attendance(student_id):
     """Get attendance records for a student"""
-    response = supabase.table('attendance_records').select('''
+    response = get_client().table('attendance_records').select('''
         *,
         attendance_sessions(id, name, course, date)
     ''').eq('student_id', student_id).execute()
     
-    return response.data 
\ No newline at end of file
+    return response.data 
+
+def _iter_rows(build_query, page_size=1000):
+    """Stream all rows of an ordered query page by page (PostgREST caps unpaged responses)"""
+    start = 0
+    while True:
+        response = build_query().range(start, start + page_size - 1).execute()
+        yield from response.data
+        if len(response.data) < page_size:
+            return
+        start += page_size
+
+def _date_range(query, start=None, end=None):
+    if start:
+        query = query.gte('date', start)
+    if end:
+        query = query.lte('date', end)
+    return query
+
+def _percentage(attended, held):
+    return round(100.0 * attended / held, 1) if held else None
+
+def get_student_summary(student_id, start=None, end=None):
+    """Attendance counts and percentage per course for one student, from the summary tables"""
+    attended = {}
+    for row in _iter_rows(lambda: _date_range(
+            get_client().table('attendance_daily_counts').select('course, date, present')
+            .eq('student_id', student_id), start, end).order('course').order('date')):
+        attended[row['course']] = attended.get(row['course'], 0) + row['present']
+    
+    held = {}
+    if attended:
+        for row in _iter_rows(lambda: _date_range(
+                get_client().table('course_daily_sessions').select('course, date, sessions')
+                .in_('course', sorted(attended)), start, end).order('course').order('date')):
+            held[row['course']] = held.get(row['course'], 0) + row['sessions']
+    
+    courses = [{
+        'course': course,
+        'sessions_held': held.get(course, 0),
+        'attended': count,
+        'percentage': _percentage(count, held.get(course, 0))
+    } for course, count in sorted(attended.items())]
+    total_held = sum(c['sessions_held'] for c in courses)
+    total_attended = sum(c['attended'] for c in courses)
+    return {
+        'student_id': student_id,
+        'start': start,
+        'end': end,
+        'sessions_held': total_held,
+        'attended': total_attended,
+        'percentage': _percentage(total_attended, total_held),
+        'courses': courses
+    }
+
+def get_course_summary(course, start=None, end=None):
+    """Sessions held and attendance per date and per student for one course"""
+    by_date = {}
+    for row in _iter_rows(lambda: _date_range(
+            get_client().table('course_daily_sessions').select('date, sessions')
+            .eq('course', course), start, end).order('date')):
+        by_date[row['date']] = {'date': row['date'], 'sessions': row['sessions'], 'present': 0}
+    
+    students = {}
+    for row in _iter_rows(lambda: _date_range(
+            get_client().table('attendance_daily_counts').select('student_id, date, present')
+            .eq('course', course), start, end).order('date').order('student_id')):
+        by_date.setdefault(row['date'], {'date': row['date'], 'sessions': 0, 'present': 0})
+        by_date[row['date']]['present'] += row['present']
+        students[row['student_id']] = students.get(row['student_id'], 0) + row['present']
+    
+    held = sum(day['sessions'] for day in by_date.values())
+    return {
+        'course': course,
+        'start': start,
+        'end': end,
+        'sessions_held': held,
+        'by_date': [by_date[day] for day in sorted(by_date)],
+        'students': [{
+            'student_id': student_id,
+            'attended': count,
+            'percentage': _percentage(count, held)
+        } for student_id, count in sorted(students.items())]
+    }
+
+def get_session_summaries(start=None, end=None, course=None):
+    """Sessions with their present counts, newest first"""
+    def build_query():
+        query = get_client().table('attendance_sessions').select(
+            'id, name, course, date, start_time, location, present_count')
+        if course:
+            query = query.eq('course', course)
+        return _date_range(query, start, end).order('date', desc=True).order('id')
+    
+    return list(_iter_rows(build_query))
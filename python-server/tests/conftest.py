@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the server modules the way the server does: from its own
+# directory, plus the shared modules in common/
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(SERVER_DIR), "common"))
+os.environ.setdefault("DATABASE_BACKEND", "local")
+os.environ.setdefault("WARMUP", "false")
+
+
+@pytest.fixture
+def sb(tmp_path, monkeypatch):
+    """supabase_helper backed by a fresh local backend in a temporary directory."""
+    import supabase_helper
+    from local_backend import create_local_client
+
+    monkeypatch.setattr(supabase_helper, "_client", create_local_client(str(tmp_path)))
+    monkeypatch.setattr(supabase_helper, "_known_buckets", set())
+    supabase_helper._stored_images.clear()
+    return supabase_helper
+
+
+@pytest.fixture
+def client(sb, monkeypatch):
+    """Flask test client over the sb fixture's backend, with empty caches."""
+    import app
+
+    monkeypatch.setattr(app, "face_gallery", None)
+    app.result_cache.clear()
+    app.student_cache.clear()
+    app.summary_cache.clear()
+    return app.app.test_client()
@@ -0,0 +1,47 @@
+import ipaddress
+
+import pytest
+from flask import Flask, request
+
+import admission
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # install() sets the request class limits; restore them for the real app afterwards
+    monkeypatch.setattr(admission.AdmissionRequest, "route_limits", {})
+    monkeypatch.setattr(admission, "RATE_LIMIT_PER_MINUTE", 60 * 0.001)
+    monkeypatch.setattr(admission, "RATE_LIMIT_BURST", 2)
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", [ipaddress.ip_network("10.0.0.0/8")])
+    app = Flask(__name__)
+
+    @app.route("/upload", methods=["POST"])
+    @app.route("/other", methods=["POST"])
+    def upload():
+        return {"received": len(request.get_data())}
+
+    admission.install(app, {"/upload": 10})
+    return app.test_client()
+
+
+def test_declared_oversized_body_is_rejected(client):
+    response = client.post("/upload", data=b"x" * 11)
+
+    assert response.status_code == 413
+    assert response.get_json()["error"] == "payload_too_large"
+
+
+def test_rate_limit_applies_per_client_and_only_to_limited_routes(client):
+    statuses = [client.post("/upload", data=b"x").status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    response = client.post("/upload", data=b"x")
+    assert response.get_json()["error"] == "rate_limited"
+    assert int(response.headers["Retry-After"]) > 0
+    assert client.post("/other", data=b"x" * 100).status_code == 200
+
+    # A different browser behind the trusted proxy has its own bucket
+    proxied = {"environ_base": {"REMOTE_ADDR": "10.0.0.5"}, "headers": {"X-Forwarded-For": "203.0.113.7"}}
+    assert client.post("/upload", data=b"x", **proxied).status_code == 200
+    # Forwarded headers from an untrusted peer are ignored
+    spoofed = {"headers": {"X-Forwarded-For": "203.0.113.8", "X-Client-Id": "fresh"}}
+    assert client.post("/upload", data=b"x", **spoofed).status_code == 429
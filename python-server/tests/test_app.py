@@ -0,0 +1,118 @@
+import base64
+
+import numpy as np
+
+import recognition
+from test_supabase_helper import student
+
+
+def test_student_listing_follows_the_keyset_cursor(client, sb):
+    sb.create_students([(student(f"S{i}", f"s{i}@example.com"), None) for i in range(5)])
+
+    ids, cursor = [], None
+    while True:
+        response = client.get("/api/students", query_string={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        page = response.get_json()
+        assert page["count"] == len(page["students"]) <= 2
+        ids.extend(row["id"] for row in page["students"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert ids == [f"S{i}" for i in range(5)]
+    assert "face_encoding" not in page["students"][0]
+
+
+def test_student_listing_rejects_an_invalid_cursor(client):
+    assert client.get("/api/students?cursor=not*base64").status_code == 400
+
+
+def test_student_listing_revalidates_with_etag_and_last_modified(client, sb):
+    import app
+
+    sb.create_students([(student("A", "a@example.com"), None)])
+    first = client.get("/api/students")
+    etag, last_modified = first.headers["ETag"], first.headers["Last-Modified"]
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    assert client.get("/api/students", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/api/students", headers={"If-Modified-Since": last_modified}).status_code == 304
+
+    # A new enrollment changes the page, so the old validator no longer matches
+    sb.create_students([(student("B", "b@example.com"), None)])
+    app.gallery_changed()
+    changed = client.get("/api/students", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert [row["id"] for row in changed.get_json()["students"]] == ["A", "B"]
+
+
+def test_gallery_drops_malformed_rows_and_keeps_the_rest(client, sb):
+    import app
+
+    encoding = np.arange(recognition.ENCODING_SIZE, dtype=np.uint8)
+    sb.create_students([(student("GOOD", "good@example.com"), encoding)])
+    malformed = {
+        # Placeholder 128-value encoding from the old FastAPI server
+        "LEGACY": base64.b64encode(np.zeros(128, dtype=np.float64).tobytes()).decode("utf-8"),
+        # Neither a square uint8 nor a square float64 crop
+        "SHORT": base64.b64encode(b"\x01\x02\x03").decode("utf-8"),
+        "CORRUPT": "not base64!",
+    }
+    for student_id, face_encoding in malformed.items():
+        sb.get_client().table("students").insert(
+            dict(student(student_id, f"{student_id}@example.com"), face_encoding=face_encoding)).execute()
+
+    gallery = app.get_gallery()
+
+    assert len(gallery) == 1
+    assert "GOOD" in gallery
+    [match] = gallery.match_batch(encoding[None, :])
+    assert match["id"] == "GOOD"
+
+
+def test_attendance_results_are_cached_per_camera(client, sb, monkeypatch, tmp_path):
+    import io
+
+    import cv2
+
+    import app
+
+    monkeypatch.setattr(app, "ATTENDANCE_FOLDER", str(tmp_path))
+    cameras = []
+    monkeypatch.setattr(app, "recognize_faces", lambda path, rejected, camera: cameras.append(camera) or [])
+    image = cv2.imencode(".jpg", np.full((120, 160, 3), 128, dtype=np.uint8))[1].tobytes()
+
+    def mark(camera):
+        data = {"sessionId": "S1", "cameraId": camera, "attendanceImage": (io.BytesIO(image), "capture.jpg")}
+        return client.post("/api/mark-attendance", data=data, content_type="multipart/form-data").get_json()
+
+    assert [mark(camera)["cached"] for camera in ("front", "front", "back")] == [False, True, False]
+    assert cameras == ["front", "back"]
+
+
+def test_a_later_capture_of_an_already_marked_student_succeeds(client, sb, monkeypatch, tmp_path):
+    import io
+
+    import cv2
+
+    import app
+
+    sb.create_students([(student("A", "a@example.com"), None), (student("B", "b@example.com"), None)])
+    monkeypatch.setattr(app, "ATTENDANCE_FOLDER", str(tmp_path))
+    recognized = [[{"student_id": "A"}], [{"student_id": "A"}, {"student_id": "B"}]]
+    monkeypatch.setattr(app, "recognize_faces", lambda path, rejected, camera: [
+        dict(match, status="present", confidence=0.9) for match in recognized.pop(0)])
+
+    def mark(shade):
+        image = cv2.imencode(".jpg", np.full((120, 160, 3), shade, dtype=np.uint8))[1].tobytes()
+        data = {"sessionId": "S1", "attendanceImage": (io.BytesIO(image), "capture.jpg")}
+        return client.post("/api/mark-attendance", data=data, content_type="multipart/form-data")
+
+    first, second = mark(100), mark(120)
+
+    assert first.status_code == second.status_code == 200
+    # Only the newly marked student is saved by the second capture
+    assert [record["student_id"] for record in second.get_json()["records"]] == ["B"]
+    assert sorted(row["student_id"] for row in sb.get_session_attendance("S1")) == ["A", "B"]
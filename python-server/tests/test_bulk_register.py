@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import bulk_register
+import recognition
+
+
+def test_students_count_as_done_only_once_saved(sb, tmp_path, monkeypatch):
+    images = tmp_path / "images"
+    images.mkdir()
+    for student_id in ("A", "B"):
+        (images / f"{student_id}.jpg").write_bytes(b"jpeg")
+    roster = tmp_path / "roster.csv"
+    roster.write_text("id,first_name,last_name,email\nA,Ann,Lee,a@example.com\nB,Ben,Ray,b@example.com\n"
+                      "C,Cal,Poe,c@example.com\n")
+
+    def encode_fn(image_path, student_id, name):
+        return True, np.zeros(recognition.ENCODING_SIZE, dtype=np.uint8)
+
+    # Threads instead of processes, so the stand-in encoder is used
+    monkeypatch.setattr(bulk_register, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(sb, "upload_student_images", lambda images: {})
+    reports, stages = [], []
+
+    def progress(done, total, student_id, message):
+        saved = {row["id"] for row in sb.get_client().table("students").select("id").execute().data}
+        reports.append((done, total, student_id, message, student_id in saved))
+
+    summary = bulk_register.bulk_register(str(images), str(roster), encode_fn, workers=1,
+                                          progress=progress, stage=stages.append)
+
+    assert sorted(summary["registered"]) == ["A", "B"]
+    assert stages == ["encoding", "uploading", "saving"]
+    # C has no photo and is done right away; A and B only after they were inserted
+    assert reports[0] == (1, 3, "C", "No image found for student", False)
+    assert sorted(report[2:] for report in reports[1:]) == [("A", None, True), ("B", None, True)]
+    assert [report[0] for report in reports] == [1, 2, 3]
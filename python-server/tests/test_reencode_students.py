@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import recognition
+import reencode_students
+from test_supabase_helper import student
+
+
+def test_failed_students_block_activation_and_are_retried(sb, tmp_path, monkeypatch):
+    sb.create_students([(dict(student(student_id, f"{student_id}@example.com"), image_url=f"/{student_id}.jpg"), None)
+                        for student_id in ("A", "B", "C")])
+    broken = {"B"}
+    encoded = []
+
+    def encode_fn(image_path, student_id, name, check_quality=True):
+        encoded.append(student_id)
+        if student_id in broken:
+            return False, "No face detected in the image"
+        return True, np.zeros(recognition.ENCODING_SIZE, dtype=np.uint8)
+
+    monkeypatch.setattr(reencode_students, "DATA_FOLDER", str(tmp_path / "data"))
+    # Threads instead of processes, so the stand-in encoder is used
+    monkeypatch.setattr(reencode_students, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(sb, "download_student_image", lambda url, path: open(path, "wb").close())
+
+    summary = reencode_students.reencode_students("v2", encode_fn, workers=1)
+
+    assert summary["failed_ids"] == ["B"] and not summary["activated"]
+    assert sb.get_active_encoding_version() == sb.DEFAULT_ENCODING_VERSION
+    assert reencode_students.read_checkpoint("v2") == {"A", "C"}
+
+    broken.clear()
+    encoded.clear()
+    summary = reencode_students.reencode_students("v2", encode_fn, workers=1)
+
+    # Only the student that failed is encoded again
+    assert encoded == ["B"]
+    assert summary["activated"]
+    assert sb.get_active_encoding_version() == "v2"
@@ -0,0 +1,195 @@
+import base64
+import os
+
+import numpy as np
+
+import recognition
+
+
+def student(student_id, email):
+    return {"id": student_id, "first_name": "First", "last_name": "Last", "email": email}
+
+
+def test_create_students_retries_failed_batch_row_by_row(sb, monkeypatch):
+    monkeypatch.setattr(sb, "INSERT_BATCH_SIZE", 2)
+    sb.create_students([(student("A", "a@example.com"), None)])
+
+    created, failed = sb.create_students([
+        (student("B", "b@example.com"), None),
+        (student("A", "duplicate@example.com"), None),
+        (student("C", "c@example.com"), None),
+    ])
+
+    assert [row["id"] for row in created] == ["B", "C"]
+    assert [failure["id"] for failure in failed] == ["A"]
+    assert {row["id"] for row in sb.get_all_students()} == {"A", "B", "C"}
+
+
+def test_get_all_face_encodings_pages_past_the_row_limit(sb, monkeypatch):
+    real_iter_rows = sb._iter_rows
+    monkeypatch.setattr(sb, "_iter_rows", lambda build_query: real_iter_rows(build_query, page_size=2))
+    encoding = np.arange(recognition.ENCODING_SIZE, dtype=np.uint8)
+    sb.create_students([(student(f"S{i}", f"s{i}@example.com"), encoding) for i in range(5)])
+
+    sb.set_active_encoding_version("v2")
+    sb.save_face_encodings("v2", [(f"S{i}", encoding[::-1].copy()) for i in range(3)])
+
+    rows = sb.get_all_face_encodings()
+    assert rows["student_ids"] == [f"S{i}" for i in range(5)]
+    assert [int(e[0]) for e in rows["encodings"]] == [int(encoding[-1])] * 3 + [int(encoding[0])] * 2
+
+
+
+
+def test_save_attendance_records_keeps_the_first_mark_in_a_session(sb):
+    sb.create_students([(student("A", "a@example.com"), None), (student("B", "b@example.com"), None)])
+    sb.create_attendance_session({"id": "S1", "name": "Lecture", "course": "CS101", "date": "2026-01-05"})
+
+    first = sb.save_attendance_records([{"session_id": "S1", "student_id": "A", "status": "present"}])
+    second = sb.save_attendance_records([
+        {"session_id": "S1", "student_id": "A", "status": "late"},
+        {"session_id": "S1", "student_id": "B", "status": "present"},
+    ])
+
+    assert [row["student_id"] for row in first] == ["A"]
+    assert [row["student_id"] for row in second] == ["B"]
+    statuses = {row["student_id"]: row["status"] for row in sb.get_session_attendance("S1")}
+    assert statuses == {"A": "present", "B": "present"}
+
+def daily_counts(sb):
+    rows = sb.get_client().table('attendance_daily_counts').select('*').execute().data
+    return {(row["student_id"], row["course"], row["date"]): row["present"] for row in rows}
+
+
+def test_moving_a_session_moves_its_daily_counts(sb):
+    sb.create_students([(student("A", "a@example.com"), None)])
+    sb.create_attendance_session({"id": "S1", "name": "Lecture", "course": "CS101", "date": "2026-01-05"})
+    sb.save_attendance_records([{"session_id": "S1", "student_id": "A", "status": "present"}])
+
+    sb.get_client().table('attendance_sessions').update({"course": "CS102", "date": "2026-01-06"}).eq('id', 'S1').execute()
+
+    assert daily_counts(sb) == {("A", "CS101", "2026-01-05"): 0, ("A", "CS102", "2026-01-06"): 1}
+    sessions = sb.get_client().table('course_daily_sessions').select('*').execute().data
+    assert {(row["course"], row["date"]): row["sessions"] for row in sessions} == {
+        ("CS101", "2026-01-05"): 0, ("CS102", "2026-01-06"): 1}
+
+
+def test_summaries_are_backfilled_for_databases_without_triggers(tmp_path, monkeypatch):
+    import supabase_helper
+    from local_backend import create_local_client
+
+    client = create_local_client(str(tmp_path))
+    client.table('students').insert(student("A", "a@example.com")).execute()
+    client.table('attendance_sessions').insert(
+        {"id": "S1", "name": "Lecture", "course": "CS101", "date": "2026-01-05"}).execute()
+    # An older database: records written without the summary triggers
+    for name, in client.db.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+        client.db.execute(f'DROP TRIGGER "{name}"')
+    client.db.execute("DELETE FROM course_daily_sessions")
+    client.table('attendance_records').insert({"session_id": "S1", "student_id": "A", "status": "present"}).execute()
+
+    monkeypatch.setattr(supabase_helper, "_client", create_local_client(str(tmp_path)))
+    assert daily_counts(supabase_helper) == {("A", "CS101", "2026-01-05"): 1}
+    assert supabase_helper.get_client().table('attendance_sessions').select('present_count').execute().data == [
+        {"present_count": 1}]
+
+
+def test_face_encodings_are_stored_as_uint8_and_legacy_float64_rows_still_read(sb):
+    encoding = np.arange(recognition.ENCODING_SIZE, dtype=np.uint8)
+    stored = sb.encode_face_encoding(encoding)
+    legacy = base64.b64encode(encoding.astype(np.float64).tobytes()).decode("utf-8")
+
+    assert len(base64.b64decode(stored)) == recognition.ENCODING_SIZE
+    for encoded in (stored, legacy):
+        np.testing.assert_array_equal(sb.decode_face_encoding(encoded), encoding)
+
+
+def jpeg(width=640, height=480):
+    import cv2
+
+    image = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+def stored_files(sb, bucket_name):
+    root = sb.get_client().storage.from_(bucket_name).path
+    return sorted(os.path.relpath(os.path.join(folder, name), root).replace(os.sep, "/")
+                  for folder, _, files in os.walk(root) for name in files)
+
+
+def test_store_image_returns_urls_for_the_original_and_each_derivative(sb):
+    content = jpeg()
+    key = sb.content_key(content)
+
+    urls = sb.store_image("attendance-images", content, ("thumbnail", "review"), wait=True)
+
+    assert set(urls) == {"original", "thumbnail", "review"}
+    assert all(url.endswith(f"{key}/{name}.jpg") for name, url in urls.items())
+    assert stored_files(sb, "attendance-images") == [
+        f"{key[:2]}/{key}/{name}.jpg" for name in ("original", "review", "thumbnail")]
+
+
+def test_store_image_uploads_derivatives_in_the_background(sb, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(sb._derivative_pool, "submit", lambda fn, *args: submitted.append((fn, args)))
+    content = jpeg()
+    key = sb.content_key(content)
+
+    urls = sb.store_image("attendance-images", content, ("thumbnail",))
+
+    # The original is stored before returning; the derivative only once the pool runs
+    assert stored_files(sb, "attendance-images") == [f"{key[:2]}/{key}/original.jpg"]
+    assert set(urls) == {"original", "thumbnail"}
+    [(fn, args)] = submitted
+    fn(*args)
+    assert f"{key[:2]}/{key}/thumbnail.jpg" in stored_files(sb, "attendance-images")
+
+    # Storing the same bytes again in this process does nothing
+    sb.store_image("attendance-images", content, ("thumbnail",))
+    assert len(submitted) == 1
+
+
+def test_store_image_regenerates_derivatives_missing_from_a_stored_original(sb, monkeypatch):
+    content = jpeg()
+    key = sb.content_key(content)
+    real_make = sb.image_derivatives.make_derivatives
+    made = []
+
+    def failing_make(content, names):
+        raise RuntimeError("interrupted")
+
+    monkeypatch.setattr(sb.image_derivatives, "make_derivatives", failing_make)
+    sb.store_image("attendance-images", content, ("thumbnail", "review"), wait=True)
+    assert stored_files(sb, "attendance-images") == [f"{key[:2]}/{key}/original.jpg"]
+
+    def recording_make(content, names):
+        made.append(list(names))
+        return real_make(content, names)
+
+    monkeypatch.setattr(sb.image_derivatives, "make_derivatives", recording_make)
+    sb.get_client().storage.from_("attendance-images").upload(f"{key[:2]}/{key}/review.jpg", b"review")
+    sb.store_image("attendance-images", content, ("thumbnail", "review"), wait=True)
+
+    # The original was already there; only the missing derivative is made
+    assert made == [["thumbnail"]]
+    assert f"{key[:2]}/{key}/thumbnail.jpg" in stored_files(sb, "attendance-images")
+
+    # Another process storing the same bytes finds nothing missing
+    sb._stored_images.clear()
+    sb.store_image("attendance-images", content, ("thumbnail", "review"), wait=True)
+    assert made == [["thumbnail"]]
+
+
+def test_derivative_urls_sit_next_to_the_original():
+    import supabase_helper as sb
+
+    original = "https://example.com/storage/v1/object/public/student-images/ab/abcd/original.jpg"
+    assert sb.derivative_urls(original, ("avatar", "face")) == {
+        "original": original,
+        "avatar": original.replace("original.jpg", "avatar.jpg"),
+        "face": original.replace("original.jpg", "face.jpg"),
+    }
+    # Uploads from before content-addressed storage only have their original
+    legacy = "https://example.com/storage/v1/object/public/student-images/S1.jpg"
+    assert sb.derivative_urls(legacy, ("avatar",)) == {"original": legacy}
+    assert sb.derivative_urls(None, ("avatar",)) == {}